@@ -0,0 +1,66 @@
+import re
+
+# custom_id of a batch record: document id and the 0-based, inclusive range of pages the record covers
+CUSTOM_ID_PATTERN = re.compile(r"^(doc\d+):p(\d+)-(\d+)$")
+
+
+def document_id(position: int) -> str:
+    # Documents are identified by their position in the submission, file names may contain any character
+    return f"doc{position}"
+
+
+def document_position(doc_id: str) -> int:
+    # Position of the document in the submission, the inverse of document_id
+    return int(doc_id[len("doc"):])
+
+
+def make_custom_id(doc_id: str, first_page: int, last_page: int = None) -> str:
+    return f"{doc_id}:p{first_page}-{first_page if last_page is None else last_page}"
+
+
+def parse_custom_id(custom_id: str) -> tuple:
+    # Returns (document id, first page, last page)
+    match = CUSTOM_ID_PATTERN.match(custom_id)
+    if match is None:
+        raise ValueError(f"Not a batch record custom_id: {custom_id!r}")
+    return match.group(1), int(match.group(2)), int(match.group(3))
+
+
+class ResultIndex:
+    """
+    Index of (document id, page) → exported page for batch results that arrive out of order and possibly incomplete.
+    Documents are assembled by walking their page numbers, so reassembly is linear in the page count, and a document
+    can be released from memory as soon as all of its pages have arrived.
+    """
+
+    def __init__(self, page_counts: dict):
+        self.page_counts = page_counts
+        self.pages = {doc_id: {} for doc_id in page_counts}
+
+    def add(self, custom_id: str, pages: list) -> str:
+        # Record the pages covered by a batch record, returns the document id
+        doc_id, first_page, last_page = parse_custom_id(custom_id)
+        for page_number, page in zip(range(first_page, last_page + 1), pages):
+            self.pages[doc_id][page_number] = page
+        return doc_id
+
+    def skip(self, doc_id: str, pages: list):
+        # Pages that were deliberately not OCRed count as arrived, without a result
+        for page in pages:
+            self.pages[doc_id][page] = None
+
+    def is_complete(self, doc_id: str) -> bool:
+        return len(self.pages[doc_id]) == self.page_counts[doc_id]
+
+    def missing_pages(self, doc_id: str) -> list:
+        return [page for page in range(self.page_counts[doc_id]) if page not in self.pages[doc_id]]
+
+    def document_pages(self, doc_id: str) -> list:
+        # Pages in order, pages that never arrived or were skipped are left out
+        document_pages = self.pages[doc_id]
+        return [document_pages[page] for page in range(self.page_counts[doc_id])
+                if document_pages.get(page) is not None]
+
+    def release(self, doc_id: str):
+        # Drop the pages of a document once it has been written out
+        self.pages[doc_id] = {}
@@ -0,0 +1,62 @@
+"""
+Micro-benchmark of inlining OCR images into page markdown: the previous str.replace loop (one full scan and copy
+of the growing page per image) against the single-pass substitution in ocr_pipeline.replace_images_in_markdown.
+
+Usage: python benchmarks/bench_image_substitution.py [--images 50 100 200] [--image-kib 64]
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ocr_pipeline import replace_images_in_markdown
+
+
+def replace_images_in_markdown_loop(markdown_str: str, images_dict: dict) -> str:
+    for img_name, base64_str in images_dict.items():
+        markdown_str = markdown_str.replace(f"![{img_name}]({img_name})", f"![{img_name}]({base64_str})")
+    return markdown_str
+
+
+def make_page(image_count: int, image_kib: int) -> tuple:
+    # A page of text paragraphs, each followed by an image reference, and the base64 data of those images
+    images = {}
+    paragraphs = []
+    for i in range(image_count):
+        img_name = f"img-{i}.jpeg"
+        images[img_name] = "data:image/jpeg;base64," + base64.b64encode(os.urandom(image_kib * 768)).decode()
+        paragraphs.append(f"Paragraph {i} of the page with some text. " * 5 + f"\n\n![{img_name}]({img_name})")
+    return "\n\n".join(paragraphs), images
+
+
+def best_of(function, *args, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--image-kib", type=int, default=64, help="Size of each base64 encoded image")
+    args = parser.parse_args()
+
+    print(f"{'images':>7} {'output MiB':>11} {'loop ms':>9} {'single pass ms':>15} {'speedup':>8}")
+    for image_count in args.images:
+        markdown, images = make_page(image_count, args.image_kib)
+        expected = replace_images_in_markdown_loop(markdown, images)
+        assert replace_images_in_markdown(markdown, images) == expected
+
+        loop = best_of(replace_images_in_markdown_loop, markdown, images)
+        single_pass = best_of(replace_images_in_markdown, markdown, images)
+        print(f"{image_count:>7} {len(expected) / 2 ** 20:>11.1f} {1000 * loop:>9.1f} {1000 * single_pass:>15.1f} "
+              f"{loop / single_pass:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
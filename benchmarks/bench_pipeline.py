@@ -0,0 +1,181 @@
+"""
+End-to-end benchmark of the OCR pipeline against the offline stand-in for the Mistral API (fake_mistral.py), so
+throughput can be compared run to run without an API key or paid calls.
+
+Every scenario runs over generated PDFs of each page count and image density, with a cold OCR cache, and reports
+wall time, pages/second, peak Python memory (tracemalloc, which excludes the rasterization worker processes) and
+the API calls made per endpoint, retries and failures:
+
+    mistral_ocr             single document OCR
+    mistral_ocr_concurrent  concurrent direct requests
+    create_jsonl_batch      batch input of uploaded PDFs, or of rasterized pages with --rasterize
+    submit                  batch submission and the wait for its jobs (simulated queue and processing time)
+    download_markdown_files assembling the documents from the finished batch jobs
+
+Usage: python benchmarks/bench_pipeline.py [--pages 5 50] [--images 0 4] [--documents 4] [--json results.json]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import job_tracker
+import ocr_pipeline
+from fake_mistral import FakeMistral
+from metrics import collect_metrics
+from ocr_cache import get_ocr_cache
+
+SCENARIOS = ("mistral_ocr", "mistral_ocr_concurrent", "create_jsonl_batch", "submit", "download_markdown_files")
+
+
+def make_pdf(page_count: int, images_per_page: int, seed: int = 0) -> bytes:
+    # Letter sized pages at 100 DPI with lines of text and images_per_page photo-like noise blocks
+    rng = random.Random(seed)
+    pages = []
+    for page_number in range(page_count):
+        page = Image.new("RGB", (850, 1100), "white")
+        draw = ImageDraw.Draw(page)
+        for line in range(30):
+            draw.text((60, 40 + line * 23), f"Document {seed} page {page_number + 1} line {line + 1} " +
+                      "lorem ipsum dolor " * 4, fill="black")
+        for i in range(images_per_page):
+            block = Image.frombytes("RGB", (200, 150), rng.randbytes(200 * 150 * 3))
+            page.paste(block, (60 + (i % 3) * 250, 760 + (i // 3 % 2) * 170))
+        pages.append(page)
+
+    buffer = io.BytesIO()
+    pages[0].save(buffer, format="PDF", save_all=True, append_images=pages[1:], resolution=100)
+    return buffer.getvalue()
+
+
+def write_pdfs(directory: str, documents: int, page_count: int, images_per_page: int) -> list:
+    pdfs = []
+    for i in range(documents):
+        path = os.path.join(directory, f"doc{i}_{page_count}p_{images_per_page}img.pdf")
+        with open(path, "wb") as f:
+            f.write(make_pdf(page_count, images_per_page, seed=i))
+        pdfs.append(ocr_pipeline.PdfFile(os.path.basename(path), path))
+    return pdfs
+
+
+def run_scenario(scenario: str, pdfs: list, client: FakeMistral, args) -> int:
+    # Returns the number of failed documents (mistral_ocr*), batch requests (submit) or pages (download_markdown_files)
+    failed = 0
+    if scenario == "mistral_ocr":
+        for pdf in pdfs:
+            try:
+                ocr_pipeline.mistral_ocr(pdf, "benchmark")
+            except Exception:
+                failed += 1
+    elif scenario == "mistral_ocr_concurrent":
+        for _, result in ocr_pipeline.mistral_ocr_concurrent(pdfs, "benchmark", args.concurrency):
+            failed += isinstance(result, Exception)
+    elif scenario == "create_jsonl_batch":
+        contents = ((ocr_pipeline.document_id(i), pdf.name, pdf.getvalue()) for i, pdf in enumerate(pdfs))
+        with ocr_pipeline.create_jsonl_batch(contents, max_workers=args.workers,
+                                             client=None if args.rasterize else client):
+            pass
+    elif scenario == "submit":
+        manifest = ocr_pipeline.submit(pdfs, "benchmark", args.workers, submit_pdfs=not args.rasterize)
+        if manifest["job_id"] is not None:
+            failed = ocr_pipeline.wait_for_job(manifest["job_id"], "benchmark", interval=0.1)["failed_requests"]
+    elif scenario == "download_markdown_files":
+        failed_pages = {}
+        ocr_pipeline.download_markdown_files(client, args.finished_manifest, failed_pages=failed_pages)
+        failed = sum(len(pages) for pages in failed_pages.values())
+    return failed
+
+
+def prepare_download(pdfs: list, args) -> dict:
+    # A finished submission, assembled into a fresh output directory by the benchmark run
+    manifest = ocr_pipeline.submit(pdfs, "benchmark", args.workers, submit_pdfs=not args.rasterize)
+    manifest = ocr_pipeline.wait_for_job(manifest["job_id"], "benchmark", interval=0.1)
+    get_ocr_cache().clear()
+    return dict(manifest, output_dir=tempfile.mkdtemp(dir=ocr_pipeline.BATCH_OUTPUTS_DIR))
+
+
+def benchmark(scenario: str, pdfs: list, args) -> dict:
+    client = FakeMistral(request_latency=args.request_latency, queue_latency=args.queue_latency,
+                         pages_per_second=args.pages_per_second, failure_rate=args.failure_rate,
+                         images_per_page=args.images_per_page)
+    ocr_pipeline.get_mistral_client = lambda api_key: client
+    get_ocr_cache().clear()
+    if scenario == "download_markdown_files":
+        args.finished_manifest = prepare_download(pdfs, args)
+        client.calls.clear()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with collect_metrics() as run_metrics:
+        failed = run_scenario(scenario, pdfs, client, args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    pages = len(pdfs) * args.page_count
+    retries = run_metrics.snapshot()["counters"].get("retries", 0)
+    return {"scenario": scenario, "documents": len(pdfs), "pages": pages, "images_per_page": args.images_per_page,
+            "seconds": elapsed, "pages_per_second": pages / elapsed, "peak_memory_mib": peak / 2 ** 20,
+            "failed": failed, "api_calls": dict(client.calls), "retries": retries,
+            "stages": run_metrics.stage_rows()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 50], help="pages per generated PDF")
+    parser.add_argument("--images", type=int, nargs="+", default=[0, 4], help="images per page")
+    parser.add_argument("--documents", type=int, default=4, help="PDFs per scenario")
+    parser.add_argument("--concurrency", type=int, default=ocr_pipeline.MAX_CONCURRENT_REQUESTS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="rasterization processes")
+    parser.add_argument("--rasterize", action="store_true", help="submit page images instead of the PDFs")
+    parser.add_argument("--request-latency", type=float, default=0.05, help="seconds per simulated API call")
+    parser.add_argument("--queue-latency", type=float, default=0.5, help="seconds a batch job stays queued")
+    parser.add_argument("--pages-per-second", type=float, default=500.0, help="simulated OCR rate")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of OCR requests that fail")
+    parser.add_argument("--stages", action="store_true", help="also print the per-stage timings of every run")
+    parser.add_argument("--json", help="write the results to this file, for comparison with later runs")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    # The OCR cache, job manifests and outputs of the runs are kept out of the working tree
+    os.chdir(tempfile.mkdtemp(prefix="ocr-benchmark-"))
+    job_tracker.MIN_POLL_INTERVAL = 0.1
+    # Import the SDK up front, so the first scenario does not pay for it
+    import mistralai  # noqa: F401
+    os.makedirs(ocr_pipeline.BATCH_OUTPUTS_DIR, exist_ok=True)
+
+    results = []
+    print(f"{'scenario':<24} {'docs':>4} {'pages':>6} {'img/p':>5} {'seconds':>8} {'pages/s':>9} {'peak MiB':>9} "
+          f"{'calls':>6} {'retries':>7} {'failed':>6}")
+    for page_count in args.pages:
+        for images_per_page in args.images:
+            args.page_count, args.images_per_page = page_count, images_per_page
+            pdfs = write_pdfs(tempfile.mkdtemp(dir="."), args.documents, page_count, images_per_page)
+            for scenario in args.scenarios:
+                result = benchmark(scenario, pdfs, args)
+                results.append(result)
+                print(f"{scenario:<24} {result['documents']:>4} {result['pages']:>6} {images_per_page:>5} "
+                      f"{result['seconds']:>8.2f} {result['pages_per_second']:>9.1f} "
+                      f"{result['peak_memory_mib']:>9.1f} {sum(result['api_calls'].values()):>6} "
+                      f"{result['retries']:>7} {result['failed']:>6}")
+                if args.stages:
+                    for row in result["stages"]:
+                        print(f"    {row['stage']:<16} {row['calls']:>5} calls {row['total_s']:>8.3f}s "
+                              f"{row['throughput']}")
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
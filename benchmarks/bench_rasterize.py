@@ -0,0 +1,56 @@
+"""
+Benchmark of batch preparation throughput (pages/second) against the number of rasterization workers.
+
+Usage: python benchmarks/bench_rasterize.py [--pages 300] [--workers 1 2 4 8]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ocr_pipeline import iter_jsonl_batch_records
+
+
+def make_synthetic_pdf(page_count: int) -> bytes:
+    # Letter sized pages at 100 DPI filled with lines of text, so rendering and JPEG encoding do real work
+    pages = []
+    for page_number in range(page_count):
+        page = Image.new("RGB", (850, 1100), "white")
+        draw = ImageDraw.Draw(page)
+        for line in range(45):
+            draw.text((60, 40 + line * 23), f"Page {page_number + 1} line {line + 1} " + "lorem ipsum dolor " * 4,
+                      fill="black")
+        pages.append(page)
+
+    buffer = io.BytesIO()
+    pages[0].save(buffer, format="PDF", save_all=True, append_images=pages[1:], resolution=100)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count()} & set(range(1, os.cpu_count() + 1))))
+    args = parser.parse_args()
+
+    pdf_bytes = make_synthetic_pdf(args.pages)
+    print(f"Synthetic PDF: {args.pages} pages, {len(pdf_bytes) / 1024:.0f} KiB")
+    print(f"{'workers':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8}")
+
+    baseline = None
+    for workers in args.workers:
+        start = time.perf_counter()
+        records = sum(1 for _ in iter_jsonl_batch_records([("doc0", "synthetic.pdf", pdf_bytes)],
+                                                           max_workers=workers))
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>9.2f} {records / elapsed:>9.1f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Contention benchmark of the shared request budget (rate_limiter.py) against the offline stand-in for the Mistral API
+(fake_mistral.py), rate limited like the real API.
+
+Several sessions OCR their PDFs concurrently at the same time, each in its own thread as Streamlit runs them: one
+heavy session with many documents and a few light ones. Every scenario reports the 429s the API returned, retries,
+failed documents, and when each session got its last document:
+
+    unlimited  every session calls the API as fast as its own concurrency allows, and retries what is rate limited
+    budget     calls are admitted by a RequestBudget at the API's rate, round robin across sessions
+
+Usage: python benchmarks/bench_rate_limit.py [--sessions 4] [--heavy-documents 24] [--api-rate-limit 8]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ocr_pipeline
+from bench_pipeline import make_pdf
+from fake_mistral import FakeMistral
+from metrics import collect_metrics
+from ocr_cache import get_ocr_cache
+from rate_limiter import RateLimitedClient, RateLimits, RequestBudget, current_session, use_session
+
+SCENARIOS = ("unlimited", "budget")
+
+
+def write_pdfs(session: int, documents: int, page_count: int) -> list:
+    # Distinct PDFs for every session, so no document is served from the OCR cache
+    paths = []
+    for i in range(documents):
+        path = os.path.abspath(f"session{session}_doc{i}.pdf")
+        with open(path, "wb") as f:
+            f.write(make_pdf(page_count, 0, seed=session * 1000 + i))
+        paths.append(path)
+    return paths
+
+
+def run_session(session: str, pdfs: list, args, results: dict, start: float):
+    # OCR the session's PDFs like the concurrent inference view, recording when its last document arrived
+    use_session(session)
+    retry_policy = ocr_pipeline.RetryPolicy(max_attempts=args.max_attempts, base_delay=args.retry_delay)
+    failed = 0
+    with collect_metrics() as run_metrics:
+        for _, pages in ocr_pipeline.mistral_ocr_concurrent_pages(pdfs, "benchmark", args.concurrency, retry_policy):
+            failed += isinstance(pages, Exception)
+    counters = run_metrics.snapshot()["counters"]
+    results[session] = {"documents": len(pdfs), "seconds": time.perf_counter() - start, "failed": failed,
+                        "retries": counters.get("retries", 0)}
+
+
+def benchmark(scenario: str, sessions: dict, args) -> dict:
+    client = FakeMistral(request_latency=args.request_latency, pages_per_second=args.pages_per_second,
+                         rate_limit=args.api_rate_limit)
+    if scenario == "budget":
+        # The API counts calls over a sliding second, which a full bucket plus its refill must not exceed
+        budget = RequestBudget(RateLimits(requests_per_second=args.api_rate_limit, burst=1))
+    else:
+        budget = RequestBudget(RateLimits(requests_per_second=None, max_concurrent_uploads=1000,
+                                          max_concurrent_polls=1000))
+    ocr_pipeline.get_mistral_client = lambda api_key: RateLimitedClient(client, budget, current_session())
+    get_ocr_cache().clear()
+
+    results = {}
+    start = time.perf_counter()
+    threads = [threading.Thread(target=run_session, args=(session, pdfs, args, results, start))
+               for session, pdfs in sessions.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"scenario": scenario, "seconds": time.perf_counter() - start, "rate_limited": client.rate_limited,
+            "api_calls": sum(client.calls.values()), "sessions": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions, the first one is heavy")
+    parser.add_argument("--heavy-documents", type=int, default=24, help="PDFs of the heavy session")
+    parser.add_argument("--documents", type=int, default=3, help="PDFs of every other session")
+    parser.add_argument("--pages", type=int, default=2, help="pages per generated PDF")
+    parser.add_argument("--concurrency", type=int, default=8, help="documents in flight per session")
+    parser.add_argument("--api-rate-limit", type=float, default=8.0, help="calls per second the fake API accepts")
+    parser.add_argument("--request-latency", type=float, default=0.05, help="seconds per simulated API call")
+    parser.add_argument("--pages-per-second", type=float, default=50.0, help="simulated OCR rate")
+    parser.add_argument("--max-attempts", type=int, default=ocr_pipeline.MAX_ATTEMPTS)
+    parser.add_argument("--retry-delay", type=float, default=0.25, help="seconds before the first retry")
+    args = parser.parse_args()
+
+    # The OCR cache of the runs is kept out of the working tree
+    os.chdir(tempfile.mkdtemp(prefix="ocr-benchmark-"))
+    # Import the SDK up front, so the first scenario does not pay for it
+    import mistralai  # noqa: F401
+
+    sessions = {}
+    for i in range(args.sessions):
+        documents = args.heavy_documents if i == 0 else args.documents
+        sessions[f"session{i}"] = [ocr_pipeline.PdfFile(f"s{i}_doc{j}.pdf", path) for j, path in
+                                   enumerate(write_pdfs(i, documents, args.pages))]
+
+    print(f"{'scenario':<10} {'seconds':>8} {'calls':>6} {'429s':>5}   "
+          + "  ".join(f"{session:>22}" for session in sessions))
+    for scenario in args.scenarios:
+        result = benchmark(scenario, sessions, args)
+        cells = [f"{r['documents']:>3} docs {r['seconds']:>6.2f}s {r['failed']:>2}F {r['retries']:>3}R"
+                 for r in (result["sessions"][session] for session in sessions)]
+        print(f"{scenario:<10} {result['seconds']:>8.2f} {result['api_calls']:>6} {result['rate_limited']:>5}   "
+              + "  ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Measures the upload payload (bytes per page) and render + encode time of every rendering profile.
+
+Usage: python benchmarks/bench_render_profiles.py [document.pdf] [--pages 20]
+Without a document a synthetic text PDF is generated.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_rasterize import make_synthetic_pdf
+from ocr_pipeline import RENDER_PROFILES, iter_pdf_pages_as_base64
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", nargs="?", help="PDF to measure, defaults to a synthetic text document")
+    parser.add_argument("--pages", type=int, default=20, help="Pages of the synthetic document")
+    args = parser.parse_args()
+
+    if args.pdf:
+        with open(args.pdf, "rb") as f:
+            pdf_bytes = f.read()
+    else:
+        pdf_bytes = make_synthetic_pdf(args.pages)
+
+    print(f"{'profile':<16} {'pages':>6} {'KiB/page':>10} {'ms/page':>9} {'vs default':>11}")
+    default_size = None
+    for name, profile in RENDER_PROFILES.items():
+        start = time.perf_counter()
+        sizes = [len(image_str) for image_str in iter_pdf_pages_as_base64(pdf_bytes, profile=profile)]
+        elapsed = time.perf_counter() - start
+
+        bytes_per_page = sum(sizes) / len(sizes)
+        default_size = default_size or bytes_per_page
+        print(f"{name:<16} {len(sizes):>6} {bytes_per_page / 1024:>10.1f} {1000 * elapsed / len(sizes):>9.1f} "
+              f"{bytes_per_page / default_size:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Offline stand-in for the Mistral client, so the OCR pipeline can be benchmarked without an API key or paid calls.
+
+Implements the endpoints the pipeline calls (file upload, signed URLs and download, ocr.process and batch jobs) with
+simulated request latency, batch queue time, processing rate, failure rate and rate limit. OCR results are synthetic
+pages of text with `images_per_page` base64 images each. Every call is counted per endpoint in FakeMistral.calls.
+
+    client = FakeMistral(queue_latency=1.0, failure_rate=0.01)
+    ocr_pipeline.get_mistral_client = lambda api_key: client
+"""
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+import types
+from collections import Counter, deque
+
+# Page objects of a PDF, but not the /Pages tree nodes
+PDF_PAGE_PATTERN = re.compile(rb"/Type\s*/Page(?!s)")
+
+
+class FakePage(dict):
+    # OCR page as returned by the SDK, which the pipeline turns into a dict with model_dump()
+    def model_dump(self) -> dict:
+        return dict(self)
+
+
+class FakeResponse:
+    # Streamed file download
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def read(self) -> bytes:
+        return self.data
+
+    def iter_lines(self):
+        return iter(self.data.decode("utf-8").splitlines())
+
+    def close(self):
+        pass
+
+
+def service_unavailable():
+    # The error the SDK raises for a 503, retried by ocr_pipeline.call_with_retries
+    import httpx
+    from mistralai.models import SDKError
+
+    return SDKError("Service unavailable", httpx.Response(503))
+
+
+def too_many_requests():
+    # The error the SDK raises when the API rate limits a call
+    import httpx
+    from mistralai.models import SDKError
+
+    return SDKError("Too many requests", httpx.Response(429))
+
+
+class FakeMistral:
+    """
+    request_latency: seconds every direct API call takes.
+    queue_latency: seconds a batch job stays QUEUED before it starts running.
+    pages_per_second: rate at which a running batch job (and ocr.process) OCRs pages.
+    failure_rate: probability that an OCR request fails, with a 503 for direct calls and in the error file of a batch.
+    rate_limit: calls accepted per second (over a sliding second), calls beyond it fail with a 429 and are counted in
+        FakeMistral.rate_limited. None for no limit.
+    """
+
+    def __init__(self, request_latency: float = 0.0, queue_latency: float = 1.0, pages_per_second: float = 500.0,
+                 failure_rate: float = 0.0, images_per_page: int = 0, image_kib: int = 16, seed: int = 0,
+                 rate_limit: float = None):
+        self.request_latency = request_latency
+        self.queue_latency = queue_latency
+        self.pages_per_second = pages_per_second
+        self.failure_rate = failure_rate
+        self.images_per_page = images_per_page
+        self.image_kib = image_kib
+        self.rate_limit = rate_limit
+        self.calls = Counter()
+        self.rate_limited = 0
+        self._accepted = deque()  # times of the calls accepted within the last second
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._job_lock = threading.Lock()  # held while the results of a finished job are generated
+        self._files = {}  # file id -> bytes
+        self._jobs = {}  # job id -> {"created_at", "records", "pages"}, and the result files once finished
+        self._ids = 0
+        self._image_base64 = "data:image/jpeg;base64," + base64.b64encode(os.urandom(image_kib * 768)).decode()
+
+        self.files = types.SimpleNamespace(upload=self.upload, upload_async=self.upload_async,
+                                           get_signed_url=self.get_signed_url,
+                                           get_signed_url_async=self.get_signed_url_async, download=self.download)
+        self.ocr = types.SimpleNamespace(process=self.process, process_async=self.process_async)
+        self.batch = types.SimpleNamespace(jobs=types.SimpleNamespace(create=self.create_job, get=self.get_job,
+                                                                      cancel=self.cancel_job))
+
+    def _call(self, endpoint: str):
+        with self._lock:
+            self.calls[endpoint] += 1
+            limited = self._over_rate_limit()
+        if self.request_latency:
+            time.sleep(self.request_latency)
+        if limited:
+            raise too_many_requests()
+
+    def _over_rate_limit(self) -> bool:
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        while self._accepted and self._accepted[0] <= now - 1.0:
+            self._accepted.popleft()
+        if len(self._accepted) >= self.rate_limit:
+            self.rate_limited += 1
+            return True
+        self._accepted.append(now)
+        return False
+
+    def _new_id(self, prefix: str) -> str:
+        with self._lock:
+            self._ids += 1
+            return f"{prefix}-{self._ids}"
+
+    def _fails(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+    def ocr_pages(self, page_numbers) -> list:
+        # Synthetic OCR result: a few paragraphs per page, each image referenced where it appears
+        pages = []
+        for page in page_numbers:
+            images = [{"id": f"img-{page}-{i}.jpeg", "image_base64": self._image_base64}
+                      for i in range(self.images_per_page)]
+            paragraphs = [f"Paragraph {i} of page {page + 1}. " + "Lorem ipsum dolor sit amet. " * 12
+                          for i in range(6)]
+            paragraphs += [f"![{image['id']}]({image['id']})" for image in images]
+            pages.append(FakePage(index=page, markdown="\n\n".join(paragraphs), images=images,
+                                  dimensions={"dpi": 200, "height": 2200, "width": 1700}))
+        return pages
+
+    def document_pages(self, document: dict, pages: list = None) -> list:
+        # Page numbers an OCR request covers: the selected or all pages of an uploaded PDF, or a single image
+        if document["type"] == "image_url":
+            return [0]
+        file_id = document["document_url"].rsplit("/", 1)[1]
+        page_count = len(PDF_PAGE_PATTERN.findall(self._files[file_id]))
+        return list(pages) if pages is not None else list(range(page_count))
+
+    # Files
+
+    def upload(self, file: dict, purpose: str):
+        self._call("files.upload")
+        content = file["content"]
+        # Like the SDK, which rejects in-memory and temporary file objects such as BytesIO or SpooledTemporaryFile
+        if not isinstance(content, (bytes, io.BufferedReader)):
+            raise TypeError(f"Upload content must be bytes or a file opened for reading, not {type(content).__name__}")
+        content = content if isinstance(content, bytes) else content.read()
+        file_id = self._new_id("file")
+        with self._lock:
+            self._files[file_id] = content
+        return types.SimpleNamespace(id=file_id, bytes=len(content), purpose=purpose)
+
+    def get_signed_url(self, file_id: str, expiry: int = 24):
+        self._call("files.get_signed_url")
+        return types.SimpleNamespace(url=f"https://files.fake-mistral.local/{file_id}")
+
+    def download(self, file_id: str):
+        self._call("files.download")
+        return FakeResponse(self._files[file_id])
+
+    async def upload_async(self, file: dict, purpose: str):
+        return await asyncio.to_thread(self.upload, file, purpose)
+
+    async def get_signed_url_async(self, file_id: str, expiry: int = 24):
+        return await asyncio.to_thread(self.get_signed_url, file_id, expiry)
+
+    # OCR
+
+    def process(self, document, model: str, include_image_base64: bool = False, pages: list = None):
+        self._call("ocr.process")
+        document = document if isinstance(document, dict) else document.model_dump()
+        page_numbers = self.document_pages(document, pages)
+        time.sleep(len(page_numbers) / self.pages_per_second)
+        if self._fails():
+            raise service_unavailable()
+        return types.SimpleNamespace(pages=self.ocr_pages(page_numbers), model=model)
+
+    async def process_async(self, document, model: str, include_image_base64: bool = False, pages: list = None):
+        return await asyncio.to_thread(self.process, document, model, include_image_base64, pages)
+
+    # Batch jobs
+
+    def create_job(self, input_files: list, model: str, endpoint: str, metadata: dict = None):
+        self._call("batch.jobs.create")
+        records = [json.loads(line) for file_id in input_files
+                   for line in self._files[file_id].decode("utf-8").splitlines() if line.strip()]
+        job_id = self._new_id("job")
+        with self._lock:
+            self._jobs[job_id] = {"created_at": time.time(), "records": records,
+                                  "pages": sum(len(self.document_pages(record["body"]["document"],
+                                                                       record["body"].get("pages")))
+                                               for record in records)}
+        return self._job_state(job_id)
+
+    def get_job(self, job_id: str):
+        self._call("batch.jobs.get")
+        return self._job_state(job_id)
+
+    def cancel_job(self, job_id: str):
+        self._call("batch.jobs.cancel")
+        with self._lock:
+            self._jobs[job_id]["cancelled"] = True
+        return self._job_state(job_id)
+
+    def _job_state(self, job_id: str):
+        job = self._jobs[job_id]
+        if job.get("cancelled"):
+            return types.SimpleNamespace(id=job_id, status="CANCELLED", total_requests=len(job["records"]),
+                                         succeeded_requests=0, failed_requests=0, output_file=None, error_file=None)
+        elapsed = time.time() - job["created_at"] - self.queue_latency
+        total = len(job["records"])
+        if elapsed < 0:
+            status, done = "QUEUED", 0
+        else:
+            # Records complete in order at the page rate
+            pages_done = elapsed * self.pages_per_second
+            done = min(total, int(total * pages_done / job["pages"])) if job["pages"] else total
+            status = "SUCCESS" if done == total else "RUNNING"
+
+        if status == "SUCCESS":
+            with self._job_lock:
+                if "output_file" not in job:
+                    self._write_job_files(job)
+        failed = job.get("failed_requests", 0) if status == "SUCCESS" else 0
+        return types.SimpleNamespace(id=job_id, status=status, total_requests=total, succeeded_requests=done - failed,
+                                     failed_requests=failed, output_file=job.get("output_file"),
+                                     error_file=job.get("error_file"))
+
+    def _write_job_files(self, job: dict):
+        outputs, errors = [], []
+        for record in job["records"]:
+            if self._fails():
+                errors.append(json.dumps({"custom_id": record["custom_id"],
+                                          "error": {"message": "Service unavailable", "code": 503}}))
+                continue
+            pages = self.ocr_pages(self.document_pages(record["body"]["document"], record["body"].get("pages")))
+            outputs.append(json.dumps({"custom_id": record["custom_id"],
+                                       "response": {"status_code": 200, "body": {"pages": pages}}}))
+
+        job["error_file"] = self._new_file("\n".join(errors)) if errors else None
+        job["failed_requests"] = len(errors)
+        job["output_file"] = self._new_file("\n".join(outputs))
+
+    def _new_file(self, content: str) -> str:
+        file_id = self._new_id("file")
+        with self._lock:
+            self._files[file_id] = content.encode("utf-8")
+        return file_id
@@ -0,0 +1,243 @@
+"""
+Command line interface to the OCR pipeline, for cron jobs and workers without Streamlit.
+
+    python cli.py ocr invoices/ scans/*.pdf --output-dir out --pdf
+    python cli.py ocr invoices/ --batch --no-wait
+    python cli.py ocr invoices/ --bundle --zip invoices.zip
+    python cli.py status
+    python cli.py collect <job id> --output-dir out
+    python cli.py retry <job id> invoices/ --output-dir out
+    python cli.py --metrics-file metrics.prom ocr invoices/
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import ocr_pipeline
+from export import bundle_names, copy_bundle, export_document, inline_markdown, write_zip
+from job_tracker import get_job_tracker
+from metrics import collect_metrics
+from rate_limiter import RateLimits, get_request_budget
+
+
+def write_pdf(markdown_path: str):
+    from pdf_renderer import convert_md_to_pdf
+
+    with open(markdown_path, encoding="utf-8") as f:
+        pdf_bytes = convert_md_to_pdf(f.read(), root=os.path.dirname(markdown_path))
+    with open(f"{os.path.splitext(markdown_path)[0]}.pdf", "wb") as f:
+        f.write(pdf_bytes)
+
+
+def write_document(bundle_markdown: str, name: str, args):
+    # The document's markdown with its images inlined, or with --bundle its bundle folder, in the output directory.
+    # name: the document's name from bundle_names, so outputs are named like the folders of the archive
+    if args.bundle:
+        markdown_path = copy_bundle(name, os.path.dirname(bundle_markdown), args.output_dir)
+    else:
+        markdown_path = os.path.join(args.output_dir, f"{name}.md")
+        with open(markdown_path, "w", encoding="utf-8") as f:
+            f.write(inline_markdown(bundle_markdown))
+    if args.pdf:
+        write_pdf(markdown_path)
+    print(markdown_path)
+
+
+def write_zip_archive(bundles: dict, pdf_names: list, args):
+    # bundles: position of the PDF -> its bundle directory, archived in the order of the PDFs
+    if args.zip:
+        names = bundle_names(pdf_names)
+        write_zip([(names[position], bundles[position]) for position in sorted(bundles)], args.zip)
+        print(args.zip)
+
+
+def write_batch_outputs(manifest: dict, args) -> int:
+    markdown_files = ocr_pipeline.collect(manifest, args.api_key)
+    os.makedirs(args.output_dir, exist_ok=True)
+    for position, name in enumerate(bundle_names(manifest["pdf_names"])):
+        write_document(markdown_files[ocr_pipeline.document_id(position)], name, args)
+    write_zip_archive({position: os.path.dirname(markdown_files[ocr_pipeline.document_id(position)])
+                       for position in range(len(manifest["pdf_names"]))}, manifest["pdf_names"], args)
+    return 1 if ocr_pipeline.load_failed_pages(manifest) else 0
+
+
+def print_progress(manifest: dict):
+    done = manifest["succeeded_requests"] + manifest["failed_requests"]
+    eta = ocr_pipeline.format_duration(manifest["eta"]) if manifest["eta"] is not None else "estimating ..."
+    print(f'{manifest["job_id"]}: {manifest["status"].lower()}, {done}/{manifest["total_requests"]} requests done, '
+          f'ETA {eta}', file=sys.stderr)
+
+
+def run_ocr(args) -> int:
+    pdfs = ocr_pipeline.find_pdfs(args.paths)
+    if not pdfs:
+        print("No PDF files found", file=sys.stderr)
+        return 2
+    page_selections = None
+    if args.pages:
+        try:
+            page_selections = [ocr_pipeline.parse_page_ranges(args.pages, ocr_pipeline.pdf_page_count(pdf.getvalue()))
+                               for pdf in pdfs]
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 2
+
+    if args.batch:
+        manifest = ocr_pipeline.submit(pdfs, args.api_key, args.workers, ocr_pipeline.RENDER_PROFILES[args.profile],
+                                       not args.rasterize, args.perceptual_dedup, args.max_shard_records,
+                                       args.max_shard_mb * 1024 * 1024, page_selections, args.skip_blank_pages,
+                                       args.text_layer)
+        if manifest["job_id"] is not None:
+            if args.no_wait:
+                print(manifest["job_id"])
+                return 0
+            manifest = ocr_pipeline.wait_for_job(manifest["job_id"], args.api_key, print_progress)
+        return write_batch_outputs(manifest, args)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    names = bundle_names([pdf.name for pdf in pdfs])
+    failed = 0
+    bundles = {}
+    results = ocr_pipeline.mistral_ocr_concurrent_pages(pdfs, args.api_key, args.concurrency,
+                                                        page_selections=page_selections,
+                                                        skip_blank=args.skip_blank_pages,
+                                                        use_text_layer=args.text_layer)
+    # Documents are exported to bundles first, the outputs are written from them
+    with tempfile.TemporaryDirectory() as bundles_dir:
+        for position, result in results:
+            pdf = pdfs[position]
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"{pdf.name}: OCR failed: {result}", file=sys.stderr)
+                continue
+            bundles[position] = os.path.join(bundles_dir, ocr_pipeline.document_id(position))
+            bundle_markdown = export_document(result, bundles[position], pdf_name=pdf.name,
+                                              model=ocr_pipeline.OCR_MODEL,
+                                              page_count=ocr_pipeline.pdf_page_count(pdf.getvalue()))
+            write_document(bundle_markdown, names[position], args)
+        write_zip_archive(bundles, [pdf.name for pdf in pdfs], args)
+    return 1 if failed else 0
+
+
+def show_status(args) -> int:
+    manifests = [get_job_tracker().load(args.job_id)] if args.job_id else get_job_tracker().list_jobs()
+    if manifests == [None]:
+        print(f"Unknown job {args.job_id}", file=sys.stderr)
+        return 2
+    for manifest in manifests:
+        done = manifest["succeeded_requests"] + manifest["failed_requests"]
+        print(f'{manifest["job_id"]}\t{manifest["status"]}\t{done}/{manifest["total_requests"]}\t'
+              f'{", ".join(manifest["pdf_names"])}')
+    return 0
+
+
+def collect_job(args) -> int:
+    if get_job_tracker().load(args.job_id) is None:
+        print(f"Unknown job {args.job_id}", file=sys.stderr)
+        return 2
+    manifest = ocr_pipeline.wait_for_job(args.job_id, args.api_key, print_progress)
+    return write_batch_outputs(manifest, args)
+
+
+def retry_job(args) -> int:
+    manifest = ocr_pipeline.wait_for_job(args.job_id, args.api_key, print_progress)
+    ocr_pipeline.collect(manifest, args.api_key)
+    retry_policy = ocr_pipeline.RetryPolicy(args.max_attempts, args.retry_delay, args.max_resubmissions)
+    try:
+        manifest = ocr_pipeline.resubmit_failed_pages(manifest, ocr_pipeline.find_pdfs(args.paths), args.api_key,
+                                                      args.concurrent, ocr_pipeline.RENDER_PROFILES[args.profile],
+                                                      retry_policy, args.concurrency)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 2
+    manifest = ocr_pipeline.wait_for_job(args.job_id, args.api_key, print_progress)
+    return write_batch_outputs(manifest, args)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="OCR PDFs with Mistral OCR")
+    parser.add_argument("--api-key", default=os.environ.get("MISTRAL_API_KEY", ""),
+                        help="Mistral API key, defaults to $MISTRAL_API_KEY")
+    parser.add_argument("--metrics-file", help="write per-stage timings and counters of the run to this file, in the "
+                                               "Prometheus text format for .prom files and as JSON otherwise")
+    parser.add_argument("--requests-per-second", type=float, default=RateLimits().requests_per_second,
+                        help="rate of API calls, 0 for no limit")
+    parser.add_argument("--burst", type=int, default=RateLimits().burst,
+                        help="API calls that can be made at once after a quiet period")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ocr = commands.add_parser("ocr", help="OCR PDF files, directories or glob patterns")
+    ocr.add_argument("paths", nargs="+")
+    ocr.add_argument("--output-dir", default="ocr_output")
+    ocr.add_argument("--pdf", action="store_true", help="also convert every markdown file to PDF")
+    ocr.add_argument("--bundle", action="store_true",
+                     help="write a folder per PDF with the markdown, its image files and a JSON of the pages")
+    ocr.add_argument("--zip", help="also write the folders of all PDFs to this zip archive")
+    ocr.add_argument("--batch", action="store_true", help="use the batch API, at half the cost")
+    ocr.add_argument("--no-wait", action="store_true", help="print the batch job id instead of waiting for it")
+    ocr.add_argument("--concurrency", type=int, default=ocr_pipeline.MAX_CONCURRENT_REQUESTS,
+                     help="documents OCRed at the same time without --batch")
+    ocr.add_argument("--workers", type=int, default=os.cpu_count(), help="rasterization processes")
+    ocr.add_argument("--profile", choices=list(ocr_pipeline.RENDER_PROFILES), default="Default",
+                     help="rendering profile of rasterized pages")
+    ocr.add_argument("--rasterize", action="store_true", help="submit page images instead of the PDFs")
+    ocr.add_argument("--perceptual-dedup", action="store_true",
+                     help="also treat rasterized pages that look the same as duplicates (only with --rasterize or "
+                          "for PDFs over the endpoint limits)")
+    ocr.add_argument("--pages", help="pages to OCR in every PDF, e.g. 1-3,7,10- (default: every page)")
+    ocr.add_argument("--skip-blank-pages", action="store_true", help="leave out pages without any content")
+    ocr.add_argument("--text-layer", action="store_true",
+                     help="convert pages with a complete text layer locally, only OCR scanned and image pages")
+    ocr.add_argument("--max-shard-records", type=int, default=ocr_pipeline.MAX_SHARD_RECORDS,
+                     help="requests per batch job, larger batches are split into several jobs")
+    ocr.add_argument("--max-shard-mb", type=int, default=ocr_pipeline.MAX_SHARD_BYTES // (1024 * 1024),
+                     help="size limit of each batch input file")
+    ocr.set_defaults(run=run_ocr)
+
+    status = commands.add_parser("status", help="list tracked batch jobs")
+    status.add_argument("job_id", nargs="?")
+    status.set_defaults(run=show_status)
+
+    collect = commands.add_parser("collect", help="wait for a batch job and write its results")
+    collect.add_argument("job_id")
+    collect.add_argument("--output-dir", default="ocr_output")
+    collect.add_argument("--pdf", action="store_true", help="also convert every markdown file to PDF")
+    collect.add_argument("--bundle", action="store_true",
+                         help="write a folder per PDF with the markdown, its image files and a JSON of the pages")
+    collect.add_argument("--zip", help="also write the folders of all PDFs to this zip archive")
+    collect.set_defaults(run=collect_job)
+
+    retry = commands.add_parser("retry", help="re-submit the failed pages of a batch job and write its results")
+    retry.add_argument("job_id")
+    retry.add_argument("paths", nargs="+", help="the PDFs of the batch job, in the same order")
+    retry.add_argument("--output-dir", default="ocr_output")
+    retry.add_argument("--pdf", action="store_true", help="also convert every markdown file to PDF")
+    retry.add_argument("--bundle", action="store_true",
+                       help="write a folder per PDF with the markdown, its image files and a JSON of the pages")
+    retry.add_argument("--zip", help="also write the folders of all PDFs to this zip archive")
+    retry.add_argument("--concurrent", action="store_true", help="re-submit as direct requests instead of a batch")
+    retry.add_argument("--concurrency", type=int, default=ocr_pipeline.MAX_CONCURRENT_REQUESTS)
+    retry.add_argument("--profile", choices=list(ocr_pipeline.RENDER_PROFILES), default="Default")
+    retry.add_argument("--max-attempts", type=int, default=ocr_pipeline.MAX_ATTEMPTS,
+                       help="attempts per direct request")
+    retry.add_argument("--retry-delay", type=float, default=ocr_pipeline.RETRY_BASE_DELAY,
+                       help="seconds before the first retry of a direct request, doubled after every attempt")
+    retry.add_argument("--max-resubmissions", type=int, default=ocr_pipeline.RetryPolicy().max_resubmissions)
+    retry.set_defaults(run=retry_job)
+
+    args = parser.parse_args(argv)
+    if args.command != "status" and not args.api_key:
+        parser.error("an API key is required, pass --api-key or set MISTRAL_API_KEY")
+    get_request_budget(args.api_key).configure(RateLimits(requests_per_second=args.requests_per_second or None,
+                                                          burst=args.burst))
+    with collect_metrics() as run_metrics:
+        status = args.run(args)
+    if args.metrics_file:
+        with open(args.metrics_file, "w", encoding="utf-8") as f:
+            f.write(run_metrics.to_prometheus() if args.metrics_file.endswith(".prom") else run_metrics.to_json())
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
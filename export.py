@@ -0,0 +1,213 @@
+"""
+Export of OCR results as per-document bundles and zip archives, instead of a single markdown string with every
+image inlined as base64.
+
+A bundle is a directory holding the document's markdown (document.md) with relative links to its decoded image files
+(images/), and a structured JSON of its pages, images and page dimensions (document.json). Archives of many bundles
+are streamed file chunk by file chunk, so they are never held in memory as a whole.
+"""
+import base64
+import io
+import json
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+
+# Image reference in OCR markdown: ![alt](target), OCR output uses the image id for both
+IMAGE_REFERENCE_PATTERN = re.compile(r"!\[([^\]]*)\]\(([^)]*)\)")
+
+# Files of a bundle, the markdown and JSON are named after the document in archives
+BUNDLE_MARKDOWN = "document.md"
+BUNDLE_JSON = "document.json"
+BUNDLE_IMAGES = "images"
+
+# Bytes read from a bundle file per chunk of a streamed archive
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+# Images are already compressed, only text files are deflated
+STORED_EXTENSIONS = {".jpeg", ".jpg", ".png", ".gif", ".webp"}
+
+
+def replace_images_in_markdown(markdown_str: str, images_dict: dict) -> str:
+    # Single pass over the markdown: every ![id](id) reference is resolved with one dict lookup
+    def substitute(match):
+        img_name, target = match.group(1), match.group(2)
+        if img_name == target and img_name in images_dict:
+            return f"![{img_name}]({images_dict[img_name]})"
+        return match.group(0)
+
+    return IMAGE_REFERENCE_PATTERN.sub(substitute, markdown_str)
+
+
+def write_page_images(page: dict, image_dir: str, prefix: str = "") -> dict:
+    """
+    Decodes the base64 images of an OCR page into image_dir, their file names prefixed with prefix.
+    Returns a dict of image id → link relative to the parent of image_dir.
+    """
+    os.makedirs(image_dir, exist_ok=True)
+    image_links = {}
+    for img in page['images']:
+        if not img.get('image_base64'):
+            continue
+        # Images come as data URIs ("data:image/jpeg;base64,...") or as bare base64
+        _, _, data = img['image_base64'].rpartition(',')
+        image_name = f"{prefix}{os.path.basename(img['id'])}"
+        with open(os.path.join(image_dir, image_name), "wb") as f:
+            f.write(base64.b64decode(data))
+        image_links[img['id']] = f"{os.path.basename(os.path.normpath(image_dir))}/{image_name}"
+    return image_links
+
+
+def text_layer_page(page: int, markdown: str) -> dict:
+    # Page dict of a page converted from the text layer, in the shape of an OCR page
+    return {"index": page, "source": "text_layer", "markdown": markdown, "images": [], "dimensions": None}
+
+
+def export_page(page: dict, bundle_dir: str, index: int = None) -> dict:
+    """
+    Writes the images of an OCR page into the bundle and returns the page's entry of document.json: the page without
+    the base64 payloads, its markdown linking the image files and every image with the path of its file.
+    index: 0-based page number in the document, when it differs from the page's own (e.g. a rasterized page).
+    """
+    entry = {key: value for key, value in page.items() if key not in ("markdown", "images")}
+    if index is not None:
+        entry["index"] = index
+    # Image ids are only unique within a request, a rasterized page's images are numbered from 0 again
+    image_links = (write_page_images(page, os.path.join(bundle_dir, BUNDLE_IMAGES), f"page{entry['index'] + 1}-")
+                   if page["images"] else {})
+    entry.setdefault("source", "ocr")
+    entry["markdown"] = replace_images_in_markdown(page["markdown"], image_links)
+    entry["images"] = [dict({key: value for key, value in image.items() if key != "image_base64"},
+                            file=image_links.get(image["id"])) for image in page["images"]]
+    return entry
+
+
+def write_bundle(bundle_dir: str, pages: list, **metadata) -> str:
+    """
+    Writes document.md and document.json of the exported pages (see export_page), in page order. metadata is added
+    to the top level of the JSON. Returns the path of the markdown file.
+    """
+    os.makedirs(bundle_dir, exist_ok=True)
+    markdown_path = os.path.join(bundle_dir, BUNDLE_MARKDOWN)
+    with open(markdown_path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(page["markdown"] for page in pages))
+    with open(os.path.join(bundle_dir, BUNDLE_JSON), "w", encoding="utf-8") as f:
+        json.dump({**metadata, "pages": pages}, f, ensure_ascii=False, indent=2)
+    return markdown_path
+
+
+def export_document(pages: list, bundle_dir: str, **metadata) -> str:
+    # Bundle of the OCR page dicts of a whole document, returns the path of its markdown file
+    return write_bundle(bundle_dir, [export_page(page, bundle_dir) for page in pages], **metadata)
+
+
+def inline_markdown(markdown_path: str) -> str:
+    # Markdown of a bundle with its image files inlined as base64 data URIs, for a self-contained single file
+    bundle_dir = os.path.dirname(markdown_path)
+
+    def substitute(match):
+        img_name, target = match.group(1), match.group(2)
+        directory, _, image_name = target.partition("/")
+        path = os.path.join(bundle_dir, BUNDLE_IMAGES, image_name)
+        # Only links to the bundle's own images, the OCRed markdown may contain any path
+        if directory != BUNDLE_IMAGES or os.path.basename(image_name) != image_name or not os.path.isfile(path):
+            return match.group(0)
+        mime_type = mimetypes.guess_type(image_name)[0] or "application/octet-stream"
+        with open(path, "rb") as f:
+            return f"![{img_name}](data:{mime_type};base64,{base64.b64encode(f.read()).decode()})"
+
+    with open(markdown_path, encoding="utf-8") as f:
+        return IMAGE_REFERENCE_PATTERN.sub(substitute, f.read())
+
+
+def bundle_names(pdf_names: list) -> list:
+    # Folder names of the documents in an archive: the PDF names without extension, numbered when they clash
+    names, used = [], set()
+    for pdf_name in pdf_names:
+        stem = os.path.splitext(pdf_name)[0]
+        candidate, n = stem, 1
+        while candidate in used:
+            n += 1
+            candidate = f"{stem}_{n}"
+        used.add(candidate)
+        names.append(candidate)
+    return names
+
+
+def bundle_files(name: str, bundle_dir: str):
+    # (file path, name in the archive) of every file of a bundle, under the folder name
+    for directory, _, files in os.walk(bundle_dir):
+        for file_name in sorted(files):
+            path = os.path.join(directory, file_name)
+            relative_path = os.path.relpath(path, bundle_dir).replace(os.sep, "/")
+            if relative_path in (BUNDLE_MARKDOWN, BUNDLE_JSON):
+                relative_path = f"{name}{os.path.splitext(relative_path)[1]}"
+            yield path, f"{name}/{relative_path}"
+
+
+def copy_bundle(name: str, bundle_dir: str, output_dir: str) -> str:
+    # Copy a bundle to <output_dir>/<name>/ laid out as in archives, returns the path of its markdown file
+    for path, archive_name in bundle_files(name, bundle_dir):
+        target = os.path.join(output_dir, *archive_name.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target)
+    return os.path.join(output_dir, name, f"{name}.md")
+
+
+class _ZipStream(io.RawIOBase):
+    # Write-only, unseekable target of a ZipFile that hands out what has been written so far
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip_chunks(bundles, chunk_size: int = ZIP_CHUNK_SIZE):
+    """
+    bundles: iterable of (folder name in the archive, bundle directory).
+    Yields the bytes of a zip archive of the bundles while it is written, at most about chunk_size bytes at a time,
+    so archives of any size are produced in constant memory.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w") as archive:
+        for name, bundle_dir in bundles:
+            for path, archive_name in bundle_files(name, bundle_dir):
+                info = zipfile.ZipInfo.from_file(path, archive_name)
+                stored = os.path.splitext(path)[1].lower() in STORED_EXTENSIONS
+                info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+                with open(path, "rb") as source, archive.open(info, "w") as target:
+                    while chunk := source.read(chunk_size):
+                        target.write(chunk)
+                        yield stream.take()
+                yield stream.take()
+    yield stream.take()
+
+
+def write_zip(bundles, path: str) -> str:
+    # Stream the archive of the bundles to a file, written under a temporary name first, returns the path
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile("wb", dir=directory, suffix=".tmp", delete=False) as f:
+        for chunk in iter_zip_chunks(bundles):
+            f.write(chunk)
+    os.replace(f.name, path)
+    return path
+
+
+def zip_bytes(bundles) -> bytes:
+    # The whole archive in memory, for single documents
+    return b"".join(iter_zip_chunks(bundles))
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from metrics import count
+
+# Batch job states in which the job can still make progress
+ACTIVE_JOB_STATUSES = {"QUEUED", "RUNNING", "CANCELLATION_REQUESTED"}
+
+# Counters summed over the jobs of a sharded submission
+JOB_COUNTERS = ("total_requests", "succeeded_requests", "failed_requests")
+
+# Where job manifests are persisted, so jobs survive closed tabs and server restarts
+DEFAULT_JOBS_DIR = ".ocr_jobs"
+
+# Bounds of the adaptive polling interval in seconds
+MIN_POLL_INTERVAL = 2.0
+MAX_POLL_INTERVAL = 60.0
+
+# Consecutive failed polls after which a job is given up on, e.g. while the API is unreachable
+MAX_POLL_FAILURES = 8
+
+# Responses to a poll that no retry will change: the key was revoked or lacks access, or the job is unknown to it
+FATAL_POLL_STATUS_CODES = {401, 403, 404}
+
+
+def read_json(path: str, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def write_json(path: str, data):
+    # Write to a temporary file first so readers never see a partially written file
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def api_key_hash(api_key: str) -> str:
+    # Stored in the manifests instead of the key, to list only the jobs submitted with the same key
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def next_poll_interval(interval: float, progressed: bool, rate: float, total_requests: int) -> float:
+    """
+    Without progress since the last poll the interval doubles. Otherwise it is set to the time the job needs,
+    at its observed rate (requests per second), to advance by 1% of its requests.
+    """
+    if not progressed or not rate:
+        return min(interval * 2, MAX_POLL_INTERVAL)
+    return min(max(0.01 * total_requests / rate, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+
+
+def aggregate_status(statuses: list) -> str:
+    # Status of a submission split into several batch jobs: active while any job is, otherwise the first failure
+    for status in ("RUNNING", "QUEUED", "CANCELLATION_REQUESTED"):
+        if status in statuses:
+            return status
+    return next((status for status in statuses if status != "SUCCESS"), "SUCCESS")
+
+
+class JobTracker:
+    """
+    Persists a manifest per submission (uploaded file names plus whatever is needed to assemble the results) as JSON
+    and keeps it up to date from a background polling thread, independent of Streamlit script reruns.
+    A submission runs as one batch job per shard of its input. The manifest is keyed by the id of the first job and
+    holds the state of every job under "jobs", with status and counters aggregated over all of them.
+    """
+
+    def __init__(self, directory: str = DEFAULT_JOBS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._pollers = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def save(self, manifest: dict):
+        with self._lock:
+            write_json(self._path(manifest["job_id"]), manifest)
+
+    def load(self, job_id: str):
+        return read_json(self._path(job_id))
+
+    def list_jobs(self, api_key: str = None) -> list:
+        # Manifests of every tracked job, or with api_key of the jobs submitted with it, newest first
+        manifests = [self.load(file_name[:-len(".json")]) for file_name in os.listdir(self.directory)
+                     if file_name.endswith(".json")]
+        manifests = [m for m in manifests if m is not None]
+        if api_key is not None:
+            manifests = [m for m in manifests if m.get("api_key_hash") == api_key_hash(api_key)]
+        return sorted(manifests, key=lambda m: m["created_at"], reverse=True)
+
+    def track(self, client, jobs: list, manifest: dict) -> dict:
+        # Start tracking the newly created batch jobs of a submission
+        manifest.update(job_id=jobs[0].id, created_at=time.time(), first_progress=None, eta=None, jobs={})
+        for job in jobs:
+            self._update_job(manifest, job)
+        self._update_manifest(manifest)
+        self.save(manifest)
+        self.attach(client, manifest["job_id"])
+        return manifest
+
+    def extend(self, client, job_id: str, jobs: list, update=None) -> dict:
+        """
+        Adds batch jobs (e.g. re-submissions of failed pages) to a finished submission and resumes polling it.
+        update(manifest) is called before the manifest is saved, to record anything else that belongs to the jobs.
+        """
+        manifest = self.load(job_id)
+        for job in jobs:
+            self._update_job(manifest, job)
+        if update is not None:
+            update(manifest)
+
+        # The ETA is extrapolated from the progress of the new jobs only, which are polled again after a failure
+        manifest["first_progress"] = None
+        manifest.pop("error", None)
+        self._update_manifest(manifest)
+        self.save(manifest)
+        self.attach(client, job_id)
+        return manifest
+
+    def attach(self, client, job_id: str):
+        # (Re)start polling a job unless it is finished or already being polled by this process
+        manifest = self.load(job_id)
+        with self._lock:
+            poller = self._pollers.get(job_id)
+            if manifest is None or manifest["status"] not in ACTIVE_JOB_STATUSES or (poller and poller.is_alive()):
+                return
+            poller = threading.Thread(target=self._poll, args=(client, job_id), name=f"poll-{job_id}", daemon=True)
+            self._pollers[job_id] = poller
+        poller.start()
+
+    def _poll(self, client, job_id: str):
+        interval = MIN_POLL_INTERVAL
+        failures = 0
+        manifest = self.load(job_id)
+        while manifest["status"] in ACTIVE_JOB_STATUSES:
+            time.sleep(interval)
+            done_before = manifest["succeeded_requests"] + manifest["failed_requests"]
+            try:
+                for shard_job_id, shard_job in manifest["jobs"].items():
+                    if shard_job["status"] in ACTIVE_JOB_STATUSES:
+                        count("api_calls")
+                        self._update_job(manifest, client.batch.jobs.get(job_id=shard_job_id))
+            except Exception as error:
+                failures += 1
+                if failures >= MAX_POLL_FAILURES or getattr(error, "status_code", None) in FATAL_POLL_STATUS_CODES:
+                    # Stop polling for good, the jobs may still finish but this process cannot follow them
+                    manifest.update(status="FAILED", error=f"Polling the batch job failed: {error}",
+                                    updated_at=time.time())
+                    self.save(manifest)
+                    return
+                # Transient API failures only slow polling down
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+                continue
+            failures = 0
+
+            self._update_manifest(manifest)
+            self.save(manifest)
+
+            done = manifest["succeeded_requests"] + manifest["failed_requests"]
+            interval = next_poll_interval(interval, done > done_before, self.progress_rate(manifest),
+                                          manifest["total_requests"])
+
+    @staticmethod
+    def _update_job(manifest: dict, job):
+        manifest["jobs"][job.id] = {"status": job.status, "total_requests": job.total_requests,
+                                    "succeeded_requests": job.succeeded_requests,
+                                    "failed_requests": job.failed_requests, "output_file": job.output_file,
+                                    "error_file": job.error_file}
+
+    def _update_manifest(self, manifest: dict):
+        jobs = manifest["jobs"].values()
+        manifest.update({counter: sum(job[counter] for job in jobs) for counter in JOB_COUNTERS})
+        manifest.update(status=aggregate_status([job["status"] for job in jobs]), updated_at=time.time())
+
+        # Remember when the jobs started making progress, the ETA is extrapolated from the rate since then
+        done = manifest["succeeded_requests"] + manifest["failed_requests"]
+        if manifest["first_progress"] is None and manifest["status"] == "RUNNING":
+            manifest["first_progress"] = [manifest["updated_at"], done]
+        # Unlike first_progress, kept when failed pages are re-submitted, to time the wait in the batch queue
+        if manifest["status"] == "RUNNING":
+            manifest.setdefault("started_at", manifest["updated_at"])
+        rate = self.progress_rate(manifest)
+        manifest["eta"] = (manifest["total_requests"] - done) / rate if rate else None
+
+    @staticmethod
+    def progress_rate(manifest: dict) -> float:
+        # Completed (succeeded or failed) requests per second since the job started running
+        if manifest["first_progress"] is None:
+            return 0.0
+        started_at, done_at_start = manifest["first_progress"]
+        elapsed = manifest["updated_at"] - started_at
+        done = manifest["succeeded_requests"] + manifest["failed_requests"]
+        return (done - done_at_start) / elapsed if elapsed > 0 else 0.0
+
+
+_job_tracker = None
+_job_tracker_lock = threading.Lock()
+
+
+def get_job_tracker() -> JobTracker:
+    # Process-wide tracker shared by every Streamlit session, so each job is polled by a single thread
+    global _job_tracker
+    with _job_tracker_lock:
+        if _job_tracker is None:
+            _job_tracker = JobTracker()
+        return _job_tracker
@@ -0,0 +1,165 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Throughput is reported per second of stage time for these quantities, in this order of preference
+THROUGHPUT_UNITS = ("pages", "records", "bytes")
+
+
+class Metrics:
+    """
+    Thread-safe timers and counters of one OCR run. Stage timers record how often a stage ran, its total, minimum and
+    maximum duration, and the quantities (pages, records, bytes) it processed. Every observation is also added to
+    the parent, so the process-wide totals cover all runs.
+    """
+
+    def __init__(self, parent: "Metrics" = None):
+        self.parent = parent
+        self._lock = threading.Lock()
+        self.stages = {}  # stage -> {"count", "seconds", "min", "max", quantity -> total}
+        self.counters = {}  # counter -> total
+
+    @contextmanager
+    def timer(self, stage: str, **quantities):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **quantities)
+
+    def observe(self, stage: str, seconds: float, **quantities):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0, "min": seconds, "max": seconds})
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["min"] = min(entry["min"], seconds)
+            entry["max"] = max(entry["max"], seconds)
+            for quantity, value in quantities.items():
+                entry[quantity] = entry.get(quantity, 0) + value
+        if self.parent is not None:
+            self.parent.observe(stage, seconds, **quantities)
+
+    def count(self, counter: str, value: int = 1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+        if self.parent is not None:
+            self.parent.count(counter, value)
+
+    def merge(self, snapshot: dict):
+        # Add the snapshot of metrics recorded elsewhere, e.g. in a worker process
+        for stage, entry in snapshot["stages"].items():
+            quantities = {k: v for k, v in entry.items() if k not in ("count", "seconds", "min", "max")}
+            with self._lock:
+                own = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0, "min": entry["min"],
+                                                     "max": entry["max"]})
+                own["count"] += entry["count"]
+                own["seconds"] += entry["seconds"]
+                own["min"] = min(own["min"], entry["min"])
+                own["max"] = max(own["max"], entry["max"])
+                for quantity, value in quantities.items():
+                    own[quantity] = own.get(quantity, 0) + value
+        for counter, value in snapshot["counters"].items():
+            with self._lock:
+                self.counters[counter] = self.counters.get(counter, 0) + value
+        if self.parent is not None:
+            self.parent.merge(snapshot)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"stages": {stage: dict(entry) for stage, entry in self.stages.items()},
+                    "counters": dict(self.counters)}
+
+    def stage_rows(self) -> list:
+        # One row per stage with latency and throughput, for display
+        rows = []
+        for stage, entry in self.snapshot()["stages"].items():
+            unit = next((unit for unit in THROUGHPUT_UNITS if entry.get(unit)), None)
+            rows.append({
+                "stage": stage,
+                "calls": entry["count"],
+                "total_s": round(entry["seconds"], 3),
+                "mean_ms": round(1000 * entry["seconds"] / entry["count"], 1),
+                "max_ms": round(1000 * entry["max"], 1),
+                "throughput": f'{entry[unit] / entry["seconds"]:,.1f} {unit}/s'
+                if unit and entry["seconds"] > 0 else "",
+            })
+        return rows
+
+    def to_json(self) -> str:
+        # Structured log line of the run
+        return json.dumps({"timestamp": time.time(), **self.snapshot()})
+
+    def to_prometheus(self, prefix: str = "mistral_ocr") -> str:
+        # Prometheus text exposition format
+        snapshot = self.snapshot()
+        lines = [f"# TYPE {prefix}_stage_seconds summary"]
+        for stage, entry in snapshot["stages"].items():
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {entry["seconds"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+        lines.append(f"# TYPE {prefix}_stage_quantity_total counter")
+        for stage, entry in snapshot["stages"].items():
+            for unit in THROUGHPUT_UNITS:
+                if unit in entry:
+                    lines.append(f'{prefix}_stage_quantity_total{{stage="{stage}",unit="{unit}"}} {entry[unit]}')
+        for counter, value in snapshot["counters"].items():
+            lines.append(f"# TYPE {prefix}_{counter}_total counter")
+            lines.append(f"{prefix}_{counter}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Totals of every run in this process
+process_metrics = Metrics()
+
+# Metrics of the run in progress in the current thread or task, process_metrics when no run is active
+_current_metrics = contextvars.ContextVar("current_metrics", default=None)
+
+
+def current_metrics() -> Metrics:
+    return _current_metrics.get() or process_metrics
+
+
+def new_run_metrics() -> Metrics:
+    return Metrics(parent=process_metrics)
+
+
+def use_metrics(metrics: Metrics):
+    # Make metrics the active run for the rest of the current thread, e.g. a Streamlit script run
+    _current_metrics.set(metrics)
+
+
+@contextmanager
+def collect_metrics(metrics: Metrics = None):
+    # Activate metrics (a new run by default) within the block
+    metrics = metrics or new_run_metrics()
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+def timer(stage: str, **quantities):
+    return current_metrics().timer(stage, **quantities)
+
+
+def count(counter: str, value: int = 1):
+    current_metrics().count(counter, value)
+
+
+def bind_metrics(fn):
+    # Wrap fn to record into the active run when it is called from another thread, e.g. an executor
+    metrics = current_metrics()
+
+    def run_with_metrics(*args, **kwargs):
+        with collect_metrics(metrics):
+            return fn(*args, **kwargs)
+
+    return run_with_metrics
+
+
+async def run_with_metrics(metrics: Metrics, coroutine):
+    # Await the coroutine with metrics active, for coroutines scheduled on the background event loop
+    with collect_metrics(metrics):
+        return await coroutine
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+# Location and size limit of the persistent OCR result cache
+DEFAULT_CACHE_PATH = os.path.join(".ocr_cache", "ocr_results.sqlite3")
+DEFAULT_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
+
+def document_cache_key(pdf_bytes: bytes, model: str, profile=None, pages: list = None) -> str:
+    """
+    Content address of an OCR result: SHA-256 of the PDF bytes, the OCR model, the rendering profile used to
+    rasterize the pages (None when the PDF itself was submitted) and the 0-based pages OCRed (None for every page).
+    """
+    digest = hashlib.sha256(pdf_bytes)
+    digest.update(f"\0{model}\0{profile!r}".encode("utf-8"))
+    if pages is not None:
+        digest.update(f"\0{pages!r}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class OCRCache:
+    """
+    SQLite backed store of OCR pages (markdown and images) keyed by document_cache_key.
+    Entries are zlib compressed JSON, and the least recently used ones are evicted once the total size exceeds
+    max_size bytes.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_size: int = DEFAULT_CACHE_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS ocr_results ("
+                         "key TEXT PRIMARY KEY, pages BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ocr_results_last_access ON ocr_results (last_access)")
+
+    @contextmanager
+    def _connect(self):
+        # Streamlit runs every session in its own thread, so each operation opens a short-lived connection
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str):
+        # Returns the cached list of page dicts, or None on a miss
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT pages FROM ocr_results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE ocr_results SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def contains(self, key: str) -> bool:
+        with self._lock, self._connect() as conn:
+            return conn.execute("SELECT 1 FROM ocr_results WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key: str, pages: list):
+        blob = zlib.compress(json.dumps(pages).encode("utf-8"))
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO ocr_results (key, pages, size, last_access) VALUES (?, ?, ?, ?)",
+                         (key, blob, len(blob), time.time()))
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_results").fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        for key, size in conn.execute("SELECT key, size FROM ocr_results ORDER BY last_access").fetchall():
+            conn.execute("DELETE FROM ocr_results WHERE key = ?", (key,))
+            total_size -= size
+            if total_size <= self.max_size:
+                break
+
+    def size(self) -> int:
+        with self._lock, self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_results").fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM ocr_results")
+
+
+_ocr_cache = None
+_ocr_cache_lock = threading.Lock()
+
+
+def get_ocr_cache() -> OCRCache:
+    # Process-wide cache instance shared by every Streamlit session, sessions starting at once must not create two
+    global _ocr_cache
+    with _ocr_cache_lock:
+        if _ocr_cache is None:
+            _ocr_cache = OCRCache()
+        return _ocr_cache
@@ -0,0 +1,1273 @@
+"""
+OCR pipeline without any Streamlit dependency, shared by the Streamlit views and the command line (cli.py).
+PIL, pdf2image and the Mistral SDK are imported on first use, so commands that do not need them start fast.
+"""
+import asyncio
+import base64
+import glob
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+from ocr_cache import document_cache_key, get_ocr_cache
+from page_dedup import PageDeduplicator, page_signature, perceptual_hash
+from job_tracker import ACTIVE_JOB_STATUSES, api_key_hash, get_job_tracker, read_json, write_json
+from batch_index import ResultIndex, document_id, document_position, make_custom_id, parse_custom_id
+from metrics import Metrics, bind_metrics, collect_metrics, count, current_metrics, run_with_metrics, timer
+from text_layer import extract_text_pages
+from rate_limiter import RateLimitedClient, current_session, get_request_budget
+from export import (BUNDLE_JSON, BUNDLE_MARKDOWN, export_page, replace_images_in_markdown, text_layer_page,
+                    write_bundle, write_page_images)
+
+if TYPE_CHECKING:
+    from mistralai import Mistral
+    from mistralai.models import OCRResponse
+    from PIL import Image
+
+# Model used for both single document and batch OCR
+OCR_MODEL = "mistral-ocr-latest"
+
+# Concurrent (non-batch) OCR: documents in flight at once, and retry policy for rate limited or failed requests
+MAX_CONCURRENT_REQUESTS = 4
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Downloaded batch results are written to a directory per submission below this one
+BATCH_OUTPUTS_DIR = ".ocr_outputs"
+
+# Markdown of the pages converted from the text layer of a submission, in its output directory
+TEXT_PAGES_FILE = "text_pages.json"
+
+# Shared API clients and the event loop their async HTTP connections live on
+_clients = {}
+_clients_lock = threading.Lock()
+_event_loop = None
+
+# Number of pages each rasterization worker renders per task
+PAGES_PER_CHUNK = 8
+
+# A single document is OCRed in requests of this many pages, so its first pages can be shown while the rest run
+PAGES_PER_REQUEST = 8
+
+# Blank page detection: pages are looked at BLANK_DETECTION_WIDTH pixels wide (rendered at BLANK_DETECTION_DPI when
+# the PDF is not rasterized anyway) and are blank when less than BLANK_PAGE_INK_RATIO of their pixels are at least
+# BLANK_PAGE_INK_CONTRAST shades darker than the page background
+BLANK_DETECTION_DPI = 36
+BLANK_DETECTION_WIDTH = 306
+BLANK_PAGE_INK_RATIO = 0.0005
+BLANK_PAGE_INK_CONTRAST = 48
+
+# PDFs within these limits are submitted to batch jobs as documents instead of rasterized page images
+MAX_DIRECT_PDF_SIZE = 50 * 1024 * 1024
+MAX_DIRECT_PDF_PAGES = 1000
+
+# Batch jobs can wait in the queue for a long time, so signed document URLs must outlive them
+SIGNED_URL_EXPIRY_HOURS = 24
+
+# Batch inputs are split into shards within these limits, each shard is uploaded and run as its own batch job
+MAX_SHARD_RECORDS = 10000
+MAX_SHARD_BYTES = 256 * 1024 * 1024
+MAX_CONCURRENT_UPLOADS = 4
+
+class PdfFile(NamedTuple):
+    """
+    PDF on disk, read on demand. Has the same name/getvalue() interface as a Streamlit upload, so both can be passed
+    to the OCR functions.
+    """
+    name: str
+    path: str
+
+    def getvalue(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+def find_pdfs(patterns) -> list:
+    # PdfFiles for a list of PDF paths, directories (searched recursively) and glob patterns, in a stable order
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(glob.glob(os.path.join(pattern, "**", "*.pdf"), recursive=True)))
+        else:
+            paths.extend(sorted(glob.glob(pattern, recursive=True)))
+    unique_paths = list(dict.fromkeys(os.path.normpath(path) for path in paths))
+    return [PdfFile(os.path.basename(path), path) for path in unique_paths]
+
+def get_combined_markdown(ocr_response: "OCRResponse", image_dir: str = None) -> str:
+  return combine_pages_markdown([page.model_dump() for page in ocr_response.pages], image_dir)
+
+def combine_pages_markdown(pages: list, image_dir: str = None) -> str:
+  """
+  pages: OCR page dicts as returned by the API (markdown and images with their base64 data)
+  image_dir: when given, images are written to this directory and referenced by relative links instead of being
+      inlined as base64, for markdown saved next to image_dir.
+  """
+  return "\n\n".join(page_markdown(page, image_dir) for page in pages)
+
+def page_markdown(page: dict, image_dir: str = None) -> str:
+  # Markdown of a single OCR page with its images inlined, or linked from image_dir
+  if image_dir is not None:
+    image_data = write_page_images(page, image_dir)
+  else:
+    image_data = {img['id']: img['image_base64'] for img in page['images']}
+  return replace_images_in_markdown(page['markdown'], image_data)
+
+def get_mistral_client(api_key: str) -> "Mistral":
+    """
+    One client per API key for the whole process, so HTTP connections are pooled and reused across sessions.
+    Its calls are admitted by the request budget of the key, queued under the current session (see rate_limiter).
+    """
+    from mistralai import Mistral
+
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = Mistral(api_key=api_key)
+        client = _clients[api_key]
+    return RateLimitedClient(client, get_request_budget(api_key), current_session())
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    # The async HTTP connection pool is bound to one event loop, which runs forever in a background thread
+    global _event_loop
+    with _clients_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_event_loop.run_forever, name="mistral-ocr-async", daemon=True).start()
+        return _event_loop
+
+# Function to perform OCR using Mistral model
+def mistral_ocr(uploaded_pdf, api_key, pages: list = None, skip_blank: bool = False):
+    # Only the given 0-based pages are OCRed when pages is set, and blank pages are left out when skip_blank is set
+    pdf_bytes = uploaded_pdf.getvalue()
+    pages = select_pages(pdf_bytes, pages, skip_blank) if pages is not None or skip_blank else None
+    if pages == []:
+        return ""
+
+    # Serve identical documents from the cache instead of paying for OCR again
+    cache_key = document_cache_key(pdf_bytes, OCR_MODEL, pages=pages)
+    cached_pages = get_ocr_cache().get(cache_key)
+    if cached_pages is not None:
+        count("cache_hits")
+        return combine_pages_markdown(cached_pages)
+
+    from mistralai import DocumentURLChunk
+
+    client = get_mistral_client(api_key)
+
+    document_url = upload_pdf_for_ocr(client, uploaded_pdf.name, pdf_bytes)
+    page_selection = {"pages": pages} if pages is not None else {}
+    with timer("ocr_request", bytes=len(pdf_bytes)):
+        count("api_calls")
+        pdf_response = client.ocr.process(document=DocumentURLChunk(document_url=document_url),
+                                          model=OCR_MODEL, include_image_base64=True, **page_selection)
+
+    pages = [page.model_dump() for page in pdf_response.pages]
+    count("pages_ocred", len(pages))
+    get_ocr_cache().put(cache_key, pages)
+
+    return combine_pages_markdown(pages)
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How failed OCR requests are retried: concurrent requests up to max_attempts times with exponential backoff from
+    base_delay seconds, and failed batch pages re-submitted at most max_resubmissions times per submission.
+    """
+    max_attempts: int = MAX_ATTEMPTS
+    base_delay: float = RETRY_BASE_DELAY
+    max_resubmissions: int = 3
+
+async def call_with_retries(call, max_attempts: int = MAX_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY):
+    # Await call(), retrying rate limited (429), server side (5xx) and connection failures with exponential backoff
+    import httpx
+    from mistralai.models import SDKError
+
+    for attempt in range(1, max_attempts + 1):
+        if attempt > 1:
+            count("retries")
+        count("api_calls")
+        try:
+            return await call()
+        except SDKError as error:
+            if error.status_code not in RETRYABLE_STATUS_CODES or attempt == max_attempts:
+                raise
+        except httpx.TransportError:
+            if attempt == max_attempts:
+                raise
+        await asyncio.sleep(base_delay * 2 ** (attempt - 1) + random.uniform(0, base_delay))
+
+async def mistral_ocr_async(client, pdf_name: str, pdf_bytes: bytes, semaphore: asyncio.Semaphore,
+                            retry_policy: RetryPolicy = RetryPolicy(), pages: list = None) -> list:
+    """
+    Async counterpart of mistral_ocr returning the OCR pages (only the given 0-based pages when pages is set), at
+    most `semaphore` documents are in flight.
+    """
+    from mistralai import DocumentURLChunk
+
+    def retry(call):
+        return call_with_retries(call, retry_policy.max_attempts, retry_policy.base_delay)
+
+    async with semaphore:
+        with timer("upload", bytes=len(pdf_bytes)):
+            uploaded_file = await retry(lambda: client.files.upload_async(
+                file={
+                    "file_name": pdf_name,
+                    "content": pdf_bytes,
+                },
+                purpose="ocr",
+            ))
+            signed_url = await retry(lambda: client.files.get_signed_url_async(file_id=uploaded_file.id, expiry=1))
+        page_selection = {"pages": pages} if pages is not None else {}
+        with timer("ocr_request", bytes=len(pdf_bytes)):
+            pdf_response = await retry(lambda: client.ocr.process_async(
+                document=DocumentURLChunk(document_url=signed_url.url), model=OCR_MODEL, include_image_base64=True,
+                **page_selection))
+
+    count("pages_ocred", len(pdf_response.pages))
+    return [page.model_dump() for page in pdf_response.pages]
+
+async def mistral_ocr_url_async(client, document_url: str, semaphore: asyncio.Semaphore,
+                                retry_policy: RetryPolicy = RetryPolicy(), pages: list = None) -> list:
+    # OCR pages of an uploaded document (only the given 0-based pages when pages is set)
+    from mistralai import DocumentURLChunk
+
+    page_selection = {"pages": pages} if pages is not None else {}
+    async with semaphore:
+        with timer("ocr_request", pages=len(pages or [])):
+            pdf_response = await call_with_retries(lambda: client.ocr.process_async(
+                document=DocumentURLChunk(document_url=document_url), model=OCR_MODEL, include_image_base64=True,
+                **page_selection), retry_policy.max_attempts, retry_policy.base_delay)
+
+    count("pages_ocred", len(pdf_response.pages))
+    return [page.model_dump() for page in pdf_response.pages]
+
+async def mistral_ocr_image_async(client, image_url: str, semaphore: asyncio.Semaphore,
+                                  retry_policy: RetryPolicy = RetryPolicy()) -> list:
+    # OCR pages of a single rasterized page image (base64 data URI)
+    from mistralai import ImageURLChunk
+
+    async with semaphore:
+        with timer("ocr_request", bytes=len(image_url)):
+            image_response = await call_with_retries(lambda: client.ocr.process_async(
+                document=ImageURLChunk(image_url=image_url), model=OCR_MODEL, include_image_base64=True),
+                retry_policy.max_attempts, retry_policy.base_delay)
+
+    count("pages_ocred", len(image_response.pages))
+    return [page.model_dump() for page in image_response.pages]
+
+def iter_mistral_ocr_pages(uploaded_pdf, api_key, pages_per_request: int = PAGES_PER_REQUEST,
+                           max_concurrency: int = MAX_CONCURRENT_REQUESTS, retry_policy: RetryPolicy = RetryPolicy(),
+                           pages: list = None, skip_blank: bool = False):
+    """
+    Progressive counterpart of mistral_ocr for displaying a document while it is OCRed. The PDF is uploaded once and
+    its page ranges of pages_per_request pages (of the selected pages, see select_pages) are requested concurrently.
+    Yields the OCR page dicts of each range in page order, as soon as the range and all ranges before it have arrived.
+    The document is cached once all of its pages have arrived.
+    """
+    pdf_bytes = uploaded_pdf.getvalue()
+    selection = select_pages(pdf_bytes, pages, skip_blank) if pages is not None or skip_blank else None
+    if selection == []:
+        return
+
+    cache_key = document_cache_key(pdf_bytes, OCR_MODEL, pages=selection)
+    cached_pages = get_ocr_cache().get(cache_key)
+    if cached_pages is not None:
+        count("cache_hits")
+        yield cached_pages
+        return
+
+    client = get_mistral_client(api_key)
+    loop = get_event_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    document_url = upload_pdf_for_ocr(client, uploaded_pdf.name, pdf_bytes)
+
+    futures = []
+    page_ranges = (split_page_ranges(pdf_page_count(pdf_bytes), pages_per_request) if selection is None else
+                   split_selected_pages(selection, pages_per_request))
+    for first_page, last_page in page_ranges:
+        coroutine = mistral_ocr_url_async(client, document_url, semaphore, retry_policy,
+                                          list(range(first_page - 1, last_page)))
+        futures.append(asyncio.run_coroutine_threadsafe(run_with_metrics(current_metrics(), coroutine), loop))
+
+    pages = []
+    try:
+        for future in futures:
+            range_pages = future.result()
+            pages.extend(range_pages)
+            yield range_pages
+    finally:
+        # Stop requesting pages nobody will see when the caller stops early or a range failed
+        for future in futures:
+            future.cancel()
+    get_ocr_cache().put(cache_key, pages)
+
+def mistral_ocr_concurrent(uploaded_pdfs, api_key, max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+                           retry_policy: RetryPolicy = RetryPolicy(), page_selections: list = None,
+                           skip_blank: bool = False, use_text_layer: bool = False):
+    """
+    OCRs many PDFs concurrently without the batch API, see mistral_ocr_concurrent_pages.
+    Yields (file name, markdown or the exception raised) as each document finishes, cache hits first.
+    """
+    results = mistral_ocr_concurrent_pages(uploaded_pdfs, api_key, max_concurrency, retry_policy, page_selections,
+                                           skip_blank, use_text_layer)
+    for position, result in results:
+        yield uploaded_pdfs[position].name, result if isinstance(result, Exception) else combine_pages_markdown(result)
+
+def mistral_ocr_concurrent_pages(uploaded_pdfs, api_key, max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+                                 retry_policy: RetryPolicy = RetryPolicy(), page_selections: list = None,
+                                 skip_blank: bool = False, use_text_layer: bool = False):
+    """
+    OCRs many PDFs concurrently without the batch API.
+    page_selections: 0-based pages to OCR per PDF, in the same order, None for every page.
+    use_text_layer: convert pages with a usable text layer locally, only the remaining pages are OCRed.
+    Yields (position of the PDF, its page dicts in page order or the exception raised) as each document finishes,
+    cache hits first.
+    """
+    client = get_mistral_client(api_key)
+    cache = get_ocr_cache()
+    loop = get_event_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    futures = {}
+    for position, pdf in enumerate(uploaded_pdfs):
+        pdf_bytes = pdf.getvalue()
+        pages = page_selections[position] if page_selections else None
+        text_pages = extract_text_pages(pdf_bytes, pages) if use_text_layer else {}
+        if text_pages:
+            pages = [page for page in (range(pdf_page_count(pdf_bytes)) if pages is None else pages)
+                     if page not in text_pages]
+        selection = select_pages(pdf_bytes, pages, skip_blank) if pages is not None or skip_blank else None
+        if selection == []:
+            yield position, merge_text_pages([], text_pages)
+            continue
+
+        cache_key = document_cache_key(pdf_bytes, OCR_MODEL, pages=selection)
+        pages = cache.get(cache_key)
+        if pages is not None:
+            count("cache_hits")
+            yield position, merge_text_pages(pages, text_pages)
+            continue
+
+        # Coroutines run on the background loop, hand them the metrics of this run
+        future = asyncio.run_coroutine_threadsafe(
+            run_with_metrics(current_metrics(), mistral_ocr_async(client, pdf.name, pdf_bytes, semaphore,
+                                                                  retry_policy, selection)), loop)
+        futures[future] = (position, cache_key, text_pages)
+
+    for future in as_completed(futures):
+        position, cache_key, text_pages = futures[future]
+        try:
+            pages = future.result()
+        except Exception as error:
+            yield position, error
+            continue
+
+        cache.put(cache_key, pages)
+        yield position, merge_text_pages(pages, text_pages)
+
+def merge_text_pages(ocr_pages: list, text_pages: dict) -> list:
+    # OCR page dicts and the pages converted from the text layer (page → markdown), in page order
+    pages = ocr_pages + [text_layer_page(page, markdown) for page, markdown in text_pages.items()]
+    return sorted(pages, key=lambda page: page["index"])
+
+@dataclass(frozen=True)
+class RenderProfile:
+    """
+    Controls how PDF pages are rasterized and JPEG encoded before being uploaded for batch OCR.
+    The defaults reproduce pdf2image's and PIL's own defaults.
+    """
+    dpi: int = 200
+    grayscale: bool = False
+    max_dimension: Optional[int] = None  # Longest edge in pixels, None keeps the rendered size
+    jpeg_quality: int = 75
+    optimize: bool = False
+    progressive: bool = False
+
+# Profiles offered on the Configuration page, from largest to smallest payload
+RENDER_PROFILES = {
+    'Default': RenderProfile(),
+    'Balanced': RenderProfile(dpi=150, max_dimension=2000, jpeg_quality=70, optimize=True, progressive=True),
+    'Text Documents': RenderProfile(dpi=150, grayscale=True, max_dimension=1600, jpeg_quality=60, optimize=True,
+                                    progressive=True),
+}
+
+def encode_image_to_base64(image: "Image.Image", profile: RenderProfile = RenderProfile()) -> str:
+    from PIL import Image
+
+    if profile.max_dimension and max(image.size) > profile.max_dimension:
+        image.thumbnail((profile.max_dimension, profile.max_dimension), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=profile.jpeg_quality, optimize=profile.optimize,
+               progressive=profile.progressive)
+    base64_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return f"data:image/jpeg;base64,{base64_image}"
+
+def is_blank_page(image: "Image.Image") -> bool:
+    # Cheap histogram check of a downscaled grayscale copy: hardly any pixel clearly darker than the background
+    from PIL import Image
+
+    small = image.convert("L")
+    if small.width > BLANK_DETECTION_WIDTH:
+        small = small.resize((BLANK_DETECTION_WIDTH, max(1, small.height * BLANK_DETECTION_WIDTH // small.width)),
+                             Image.Resampling.BOX)
+    histogram = small.histogram()
+    background = max(range(256), key=histogram.__getitem__)
+    ink = sum(histogram[:max(background - BLANK_PAGE_INK_CONTRAST, 0)])
+    return ink < BLANK_PAGE_INK_RATIO * small.width * small.height
+
+class RenderedPage(NamedTuple):
+    image_base64: str
+    perceptual_hash: str = None  # only computed for perceptual deduplication, like the signature
+    blank: bool = False
+    signature: bytes = None  # grayscale thumbnail confirming perceptual duplicates, see page_dedup
+
+def rasterize_page_range(pdf_bytes: bytes, first_page: int, last_page: int,
+                         profile: RenderProfile = RenderProfile(), perceptual: bool = False,
+                         detect_blank: bool = False) -> list:
+    # Runs inside a worker process: render and encode a contiguous range of pages (1-based, inclusive). The
+    # perceptual hash and signature are only computed with perceptual and blank pages only detected with
+    # detect_blank, together they cost more than the encoding
+    from pdf2image import convert_from_bytes
+
+    with timer("rasterize", pages=last_page - first_page + 1):
+        images = convert_from_bytes(pdf_bytes, dpi=profile.dpi, grayscale=profile.grayscale,
+                                    first_page=first_page, last_page=last_page)
+    with timer("encode", pages=len(images)):
+        rendered_pages = [RenderedPage(encode_image_to_base64(img, profile),
+                                       perceptual_hash(img) if perceptual else None,
+                                       detect_blank and is_blank_page(img),
+                                       page_signature(img) if perceptual else None) for img in images]
+    for img in images:
+        img.close()
+    return rendered_pages
+
+def rasterize_page_range_in_worker(pdf_bytes: bytes, first_page: int, last_page: int,
+                                   profile: RenderProfile = RenderProfile(), perceptual: bool = False,
+                                   detect_blank: bool = False) -> tuple:
+    # Worker process entry point: the rendered pages and the timings recorded while rendering them
+    with collect_metrics(Metrics()) as worker_metrics:
+        rendered_pages = rasterize_page_range(pdf_bytes, first_page, last_page, profile, perceptual, detect_blank)
+    return rendered_pages, worker_metrics.snapshot()
+
+def pdf_page_count(pdf_bytes: bytes) -> int:
+    from pdf2image import pdfinfo_from_bytes
+
+    return pdfinfo_from_bytes(pdf_bytes)["Pages"]
+
+def split_page_ranges(page_count: int, pages_per_chunk: int = PAGES_PER_CHUNK) -> list:
+    return [(first, min(first + pages_per_chunk - 1, page_count))
+            for first in range(1, page_count + 1, pages_per_chunk)]
+
+def split_selected_pages(pages: list, pages_per_chunk: int = PAGES_PER_CHUNK) -> list:
+    # split_page_ranges of a selection of 0-based pages: 1-based (first, last) chunks of its contiguous runs
+    return [(first + chunk_first, first + chunk_last) for first, last in contiguous_ranges(pages)
+            for chunk_first, chunk_last in split_page_ranges(last - first + 1, pages_per_chunk)]
+
+def parse_page_ranges(spec: str, page_count: int) -> Optional[list]:
+    """
+    Pages of a range specification such as "1-3, 7, 10-" (1-based and inclusive, open ended ranges run to the last
+    page) as sorted 0-based page numbers. Returns None for an empty specification, i.e. every page.
+    Raises ValueError for malformed ranges and pages beyond page_count.
+    """
+    if not spec or not spec.strip():
+        return None
+    pages = set()
+    for part in spec.split(","):
+        first, separator, last = part.strip().partition("-")
+        try:
+            first = int(first)
+            last = (int(last) if last.strip() else page_count) if separator else first
+        except ValueError:
+            raise ValueError(f"Invalid page range {part.strip()!r}, expected e.g. 1-3, 7, 10-") from None
+        if not 1 <= first <= last <= page_count:
+            raise ValueError(f"Page range {part.strip()!r} is outside pages 1-{page_count}")
+        pages.update(range(first - 1, last))
+    return sorted(pages)
+
+def detect_blank_pages(pdf_bytes: bytes, pages: list) -> set:
+    # 0-based pages among the given ones that are blank, rendered at a low resolution just for the check
+    from pdf2image import convert_from_bytes
+
+    blank_pages = set()
+    with timer("blank_detection", pages=len(pages)):
+        for first_page, last_page in split_selected_pages(pages, 4 * PAGES_PER_CHUNK):
+            images = convert_from_bytes(pdf_bytes, dpi=BLANK_DETECTION_DPI, grayscale=True,
+                                        first_page=first_page, last_page=last_page)
+            for page, image in zip(range(first_page - 1, last_page), images):
+                if is_blank_page(image):
+                    blank_pages.add(page)
+                image.close()
+    return blank_pages
+
+def select_pages(pdf_bytes: bytes, pages: list = None, skip_blank: bool = False) -> Optional[list]:
+    """
+    0-based pages of the PDF to OCR: the given pages (every page when None), less the blank ones when skip_blank is
+    set. Returns None when that is every page of the PDF.
+    """
+    page_count = pdf_page_count(pdf_bytes)
+    selection = list(range(page_count)) if pages is None else pages
+    if skip_blank:
+        blank_pages = detect_blank_pages(pdf_bytes, selection)
+        selection = [page for page in selection if page not in blank_pages]
+    return None if len(selection) == page_count else selection
+
+def iter_rendered_pages(pdf_bytes: bytes, executor=None, max_in_flight: int = 2,
+                        profile: RenderProfile = RenderProfile(), pages_per_chunk: int = PAGES_PER_CHUNK,
+                        pages: list = None, perceptual: bool = False, detect_blank: bool = False):
+    """
+    Rasterizes the PDF (only the given 0-based pages when pages is set) in page ranges and yields a RenderedPage
+    (base64 JPEG data URI, perceptual hash, whether the page is blank and its signature) per page in page order.
+    The perceptual hash and signature are None unless perceptual is set, pages are only checked for being blank with
+    detect_blank.
+    Without an executor pages are rendered one at a time so only a single page is alive at once. With a process
+    pool executor the ranges are rendered in parallel, keeping at most max_in_flight ranges rendered ahead.
+    """
+    def page_ranges(pages_per_range):
+        if pages is None:
+            return split_page_ranges(pdf_page_count(pdf_bytes), pages_per_range)
+        return split_selected_pages(pages, pages_per_range)
+
+    if executor is None:
+        for first_page, last_page in page_ranges(1):
+            yield from rasterize_page_range(pdf_bytes, first_page, last_page, profile, perceptual, detect_blank)
+        return
+
+    def collect_range(future):
+        rendered_pages, snapshot = future.result()
+        current_metrics().merge(snapshot)
+        return rendered_pages
+
+    pending = deque()
+    for first_page, last_page in page_ranges(pages_per_chunk):
+        pending.append(executor.submit(rasterize_page_range_in_worker, pdf_bytes, first_page, last_page, profile,
+                                       perceptual, detect_blank))
+        if len(pending) >= max_in_flight:
+            yield from collect_range(pending.popleft())
+    while pending:
+        yield from collect_range(pending.popleft())
+
+def iter_pdf_pages_as_base64(pdf_bytes: bytes, executor=None, max_in_flight: int = 2,
+                             profile: RenderProfile = RenderProfile()):
+    for rendered_page in iter_rendered_pages(pdf_bytes, executor, max_in_flight, profile):
+        yield rendered_page.image_base64
+
+def convert_pdf_to_base64_images(pdf_bytes: bytes, max_workers: int = None,
+                                 profile: RenderProfile = RenderProfile()) -> list:
+    max_workers = max_workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(iter_pdf_pages_as_base64(pdf_bytes, executor, 2 * max_workers, profile))
+
+def upload_pdf_for_ocr(client, pdf_name: str, pdf_bytes: bytes, expiry: int = 1) -> str:
+    # Upload the PDF once and return a signed URL (valid for `expiry` hours) that the OCR endpoint can read
+    with timer("upload", bytes=len(pdf_bytes)):
+        uploaded_file = client.files.upload(
+            file={
+                "file_name": pdf_name,
+                "content": pdf_bytes,
+            },
+            purpose="ocr",
+        )
+        signed_url = client.files.get_signed_url(file_id=uploaded_file.id, expiry=expiry)
+    count("api_calls", 2)
+    return signed_url.url
+
+def needs_rasterization(pdf_bytes: bytes) -> bool:
+    # PDFs over the OCR endpoint's document limits can only be submitted as individual page images
+    return (len(pdf_bytes) > MAX_DIRECT_PDF_SIZE or
+            pdf_page_count(pdf_bytes) > MAX_DIRECT_PDF_PAGES)
+
+def iter_document_records(client, doc_id: str, pdf_name: str, pdf_bytes: bytes, pages_per_record: int = None,
+                          pages: list = None):
+    # Yield document_url records for a directly submitted PDF (only its given 0-based pages when pages is set),
+    # optionally split into page ranges
+    document_url = upload_pdf_for_ocr(client, pdf_name, pdf_bytes, expiry=SIGNED_URL_EXPIRY_HOURS)
+    page_count = pdf_page_count(pdf_bytes)
+
+    page_ranges = (split_page_ranges(page_count, pages_per_record or page_count) if pages is None else
+                   split_selected_pages(pages, pages_per_record or page_count))
+    for first_page, last_page in page_ranges:
+        body = {
+            "document": {
+                "type": "document_url",
+                "document_url": document_url
+            },
+            "include_image_base64": True
+        }
+        if pages_per_record is not None or pages is not None:
+            # The OCR endpoint numbers pages from 0
+            body["pages"] = list(range(first_page - 1, last_page))
+        custom_id = make_custom_id(doc_id, first_page - 1, last_page - 1)
+        yield custom_id, json.dumps({"custom_id": custom_id, "body": body}) + "\n"
+
+def iter_batch_entries(pdfs, max_workers: int = None, profile: RenderProfile = RenderProfile(),
+                       client=None, pages_per_record: int = None, deduplicator: PageDeduplicator = None,
+                       page_selections: dict = None, skip_blank_pages: bool = False, skipped_pages: dict = None,
+                       use_text_layer: bool = False, text_pages: dict = None):
+    """
+    pdfs: iterable of tuples → [(document_id, file_name, file_bytes), ...]
+    max_workers: number of rasterization processes, defaults to the number of CPUs. 1 renders serially.
+    profile: rendering profile applied to every rasterized page.
+    client: when given, each PDF is uploaded once and submitted as a single document_url record (or one record per
+        `pages_per_record` pages). Only PDFs exceeding the direct submission limits fall back to rasterization.
+    deduplicator: when given, duplicate PDFs and pages (and pages cached from earlier submissions) are left out of
+        the batch and recorded on it so their results can be fanned out afterwards.
+    page_selections: document id → 0-based pages to submit, documents without an entry are submitted in full.
+    skip_blank_pages: leave blank pages out, see is_blank_page.
+    skipped_pages: when given, filled with document id → 0-based pages left out by the selection or as blank.
+    use_text_layer: convert the (selected) pages with a usable text layer locally instead of submitting them, see
+        text_layer.extract_text_pages.
+    text_pages: when given, filled with document id → {0-based page: markdown} of the pages converted locally.
+    Yields (custom_id, JSONL record terminated by a newline) per document, page range or rasterized page. Every
+    custom_id carries the document id and the range of pages it covers (see batch_index.make_custom_id).
+    """
+    max_workers = max_workers or os.cpu_count()
+    executor = None
+    try:
+        for doc_id, pdf_name, pdf_bytes in pdfs:
+            pages = (page_selections or {}).get(doc_id)
+            # Only whole PDFs are deduplicated, the same PDF with another page selection yields other results
+            if pages is None and deduplicator is not None and not deduplicator.submit_document(doc_id, pdf_bytes):
+                deduplicator.document_pages_saved += pdf_page_count(pdf_bytes)
+                if skipped_pages is not None and deduplicator.duplicate_documents[doc_id] in skipped_pages:
+                    skipped_pages[doc_id] = skipped_pages[deduplicator.duplicate_documents[doc_id]]
+                continue
+
+            # Born-digital pages are converted here, only the remaining pages are OCRed
+            extracted = extract_text_pages(pdf_bytes, pages) if use_text_layer else {}
+            if extracted:
+                if text_pages is not None:
+                    text_pages[doc_id] = extracted
+                all_pages = range(pdf_page_count(pdf_bytes)) if pages is None else pages
+                pages = [page for page in all_pages if page not in extracted]
+
+            if client is not None and not needs_rasterization(pdf_bytes):
+                if pages is not None or skip_blank_pages:
+                    pages = select_pages(pdf_bytes, pages, skip_blank_pages)
+                    if pages is not None and skipped_pages is not None:
+                        skipped = set(range(pdf_page_count(pdf_bytes))) - set(pages) - set(extracted)
+                        if skipped:
+                            skipped_pages[doc_id] = sorted(skipped)
+                    if pages == []:
+                        continue
+                yield from iter_document_records(client, doc_id, pdf_name, pdf_bytes, pages_per_record, pages)
+                continue
+
+            # The process pool is only started once a PDF actually needs to be rasterized
+            if executor is None and max_workers > 1 and pages != []:
+                executor = ProcessPoolExecutor(max_workers=max_workers)
+
+            rendered_pages = iter_rendered_pages(pdf_bytes, executor, 2 * max_workers, profile, pages=pages,
+                                                 perceptual=deduplicator is not None and deduplicator.perceptual,
+                                                 detect_blank=skip_blank_pages)
+            page_count = pdf_page_count(pdf_bytes)
+            page_numbers = range(page_count) if pages is None else pages
+            skipped = [] if pages is None else sorted(set(range(page_count)) - set(pages) - set(extracted))
+            for page, rendered_page in zip(page_numbers, rendered_pages):
+                if skip_blank_pages and rendered_page.blank:
+                    skipped.append(page)
+                    continue
+                custom_id = make_custom_id(doc_id, page)
+                if deduplicator is not None and not deduplicator.submit_page(custom_id, rendered_page.image_base64,
+                                                                             rendered_page.perceptual_hash,
+                                                                             rendered_page.signature):
+                    continue
+
+                entry = {
+                    "custom_id": custom_id,
+                    "body": {
+                        "document": {
+                            "type": "image_url",
+                            "image_url": rendered_page.image_base64
+                        },
+                        "include_image_base64": True
+                    }
+                }
+                yield custom_id, json.dumps(entry) + "\n"
+            if skipped and skipped_pages is not None:
+                skipped_pages[doc_id] = sorted(skipped)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+def iter_jsonl_batch_records(pdfs, **batch_options):
+    # The JSONL records of iter_batch_entries without their custom_ids
+    for _, record in iter_batch_entries(pdfs, **batch_options):
+        yield record
+
+def write_jsonl_batch(pdfs, f, **batch_options):
+    # Write the records to a binary file object as they are produced
+    for record in iter_jsonl_batch_records(pdfs, **batch_options):
+        f.write(record.encode("utf-8"))
+
+def create_jsonl_batch_file(pdfs, output_path: str = "ocr_batch_input.jsonl", **batch_options):
+    """
+    pdfs: iterable of tuples → [(document_id, file_name, file_bytes), ...]
+    batch_options: forwarded to iter_jsonl_batch_records.
+    """
+    with open(output_path, "wb") as f:
+        write_jsonl_batch(pdfs, f, **batch_options)
+
+def new_batch_file():
+    # Temporary JSONL file on disk, deleted when closed. The SDK only uploads bytes or a file opened from disk, so
+    # create_batch_job uploads it reopened by name
+    return tempfile.NamedTemporaryFile(mode="w+b", suffix=".jsonl")
+
+def create_jsonl_batch(pdfs, **batch_options):
+    """
+    pdfs: iterable of tuples → [(document_id, file_name, file_bytes), ...]
+    batch_options: forwarded to iter_jsonl_batch_records.
+    Returns a temporary file (see new_batch_file) positioned at the start of the JSONL content.
+    """
+    batch_file = new_batch_file()
+    write_jsonl_batch(pdfs, batch_file, **batch_options)
+    batch_file.seek(0)
+    return batch_file
+
+def iter_jsonl_shards(entries, max_records: int = MAX_SHARD_RECORDS, max_bytes: int = MAX_SHARD_BYTES):
+    """
+    entries: (custom_id, JSONL record) pairs as yielded by iter_batch_entries.
+    Yields (batch file, custom_ids of its records) per shard of at most max_records records and max_bytes bytes. Each
+    batch file is a temporary file (see new_batch_file) positioned at the start of its content, to be closed by the
+    caller.
+    """
+    batch_file, custom_ids, size = None, [], 0
+    try:
+        for custom_id, record in entries:
+            data = record.encode("utf-8")
+            if batch_file is not None and (len(custom_ids) >= max_records or size + len(data) > max_bytes):
+                batch_file.seek(0)
+                shard, batch_file = batch_file, None
+                yield shard, custom_ids
+            if batch_file is None:
+                batch_file, custom_ids, size = new_batch_file(), [], 0
+            batch_file.write(data)
+            custom_ids.append(custom_id)
+            size += len(data)
+    except BaseException:
+        # The shard being built when the entries failed, or the consumer stopped, is never handed over
+        if batch_file is not None:
+            batch_file.close()
+        raise
+    if batch_file is not None:
+        batch_file.seek(0)
+        yield batch_file, custom_ids
+
+def create_batch_job(client, batch_file, shard: int):
+    # Upload one shard and start its batch job, closes (and so deletes) the batch file
+    with batch_file:
+        size = batch_file.seek(0, os.SEEK_END)
+        batch_file.flush()
+        with timer("upload", bytes=size), open(batch_file.name, "rb") as content:
+            batch_data = client.files.upload(
+                file={
+                    "file_name": f"batch_file_{shard}.jsonl",
+                    "content": content},
+                purpose="batch"
+            )
+
+    count("api_calls", 2)
+    return client.batch.jobs.create(
+        input_files=[batch_data.id],
+        model=OCR_MODEL,
+        endpoint="/v1/ocr",
+        metadata={"job_type": "insuragi_ocr"}
+    )
+
+def cancel_batch_jobs(client, futures):
+    # Cancel the batch jobs created by the futures, the uploader has finished them all. Best effort, a failure to
+    # cancel must not hide the error the submission failed with
+    for future in futures:
+        if future.cancelled() or future.exception() is not None:
+            continue
+        try:
+            count("api_calls")
+            client.batch.jobs.cancel(job_id=future.result().id)
+        except Exception:
+            pass
+
+def document_dependencies(page_counts: dict, record_jobs: dict, batch_dedup: PageDeduplicator) -> dict:
+    """
+    record_jobs: custom_id → id of the batch job the record was submitted in.
+    Returns document id → ids of the batch jobs that must have finished before the document can be assembled: the
+    jobs holding its records and those holding the submitted originals of its duplicate pages or of the whole PDF.
+    """
+    dependencies = {doc_id: set() for doc_id in page_counts}
+    for custom_id, job_id in record_jobs.items():
+        dependencies[parse_custom_id(custom_id)[0]].add(job_id)
+    for custom_id, submitted_id in batch_dedup.duplicate_pages.items():
+        dependencies[parse_custom_id(custom_id)[0]].add(record_jobs[submitted_id])
+    for doc_id, submitted_doc_id in batch_dedup.duplicate_documents.items():
+        dependencies[doc_id] |= dependencies[submitted_doc_id]
+    return {doc_id: sorted(job_ids) for doc_id, job_ids in dependencies.items()}
+
+def ready_documents(manifest: dict) -> list:
+    # Documents whose batch jobs have all finished, in submission order
+    finished = {job_id for job_id, job in manifest["jobs"].items() if job["status"] not in ACTIVE_JOB_STATUSES}
+    return [doc_id for doc_id, job_ids in manifest["document_jobs"].items() if finished.issuperset(job_ids)]
+
+def submit(pdfs, api_key, max_workers: int = None, profile: RenderProfile = RenderProfile(),
+           submit_pdfs: bool = True, perceptual_dedup: bool = False, max_shard_records: int = MAX_SHARD_RECORDS,
+           max_shard_bytes: int = MAX_SHARD_BYTES, page_selections: list = None,
+           skip_blank_pages: bool = False, use_text_layer: bool = False) -> dict:
+    """
+    Builds the batch input for the PDFs, shards it by max_shard_records and max_shard_bytes, and submits one batch
+    job per shard. Shards are uploaded concurrently while the next one is being built.
+    pdfs: objects with a name and a getvalue() method returning the PDF bytes, e.g. PdfFile or Streamlit uploads.
+    page_selections: 0-based pages to submit per PDF, in the same order, None for every page. Only the selected
+        pages (less the blank ones with skip_blank_pages) are rasterized, uploaded and billed.
+    use_text_layer: pages with a usable text layer are converted locally and interleaved with the OCRed pages when
+        the documents are assembled, only scanned and image pages are submitted.
+    Returns the manifest of the submission, which is handed over to the job tracker and is also what a later session
+    needs to reattach to the jobs. Its status is CACHED when nothing had to be submitted.
+    """
+    client = get_mistral_client(api_key)
+    cache = get_ocr_cache()
+    deduplicator = PageDeduplicator(OCR_MODEL, profile, cache, perceptual=perceptual_dedup)
+    manifest = {
+        "job_id": None,
+        "api_key_hash": api_key_hash(api_key),  # only sessions with the same key list the job to reattach to it
+        "pdf_names": [pdf.name for pdf in pdfs],  # the document id of a PDF is its position in this list
+        "page_counts": {},  # document id -> number of pages
+        "cached_documents": {},  # document id -> cache key of documents served from the cache
+        "batch_cache_keys": {},  # document id -> cache key to store the OCRed document under
+        "skipped_pages": {},  # document id -> pages left out by the page selection or as blank
+        "text_pages": {},  # document id -> pages converted from the text layer, their markdown is in TEXT_PAGES_FILE
+        "output_dir": os.path.join(BATCH_OUTPUTS_DIR, uuid.uuid4().hex),
+    }
+
+    # Look every document up in the cache, only the misses are submitted to the batch job
+    pending_pdfs = []
+    selections = {}
+    for position, pdf in enumerate(pdfs):
+        doc_id = document_id(position)
+        pdf_bytes = pdf.getvalue()
+        manifest["page_counts"][doc_id] = pdf_page_count(pdf_bytes)
+        if page_selections and page_selections[position] is not None:
+            # Only whole documents are cached
+            selections[doc_id] = page_selections[position]
+            pending_pdfs.append((doc_id, pdf))
+            continue
+        rasterized = not submit_pdfs or needs_rasterization(pdf_bytes)
+        cache_key = document_cache_key(pdf_bytes, OCR_MODEL, profile if rasterized else None)
+        if cache.contains(cache_key):
+            manifest["cached_documents"][doc_id] = cache_key
+        else:
+            manifest["batch_cache_keys"][doc_id] = cache_key
+            pending_pdfs.append((doc_id, pdf))
+
+    # Read PDF contents lazily so the batch builder only holds one PDF at a time
+    text_pages = {}
+    pdf_contents = ((doc_id, pdf.name, pdf.getvalue()) for doc_id, pdf in pending_pdfs)
+
+    entries = iter_batch_entries(pdf_contents, max_workers=max_workers, profile=profile,
+                                 client=client if submit_pdfs else None, deduplicator=deduplicator,
+                                 page_selections=selections, skip_blank_pages=skip_blank_pages,
+                                 skipped_pages=manifest["skipped_pages"], use_text_layer=use_text_layer,
+                                 text_pages=text_pages)
+    shards = []  # (future of the created batch job, custom_ids of the shard)
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPLOADS) as uploader:
+            # Building a shard includes rasterizing its pages, both are also timed on their own
+            build_start = time.perf_counter()
+            for batch_file, custom_ids in iter_jsonl_shards(entries, max_shard_records, max_shard_bytes):
+                current_metrics().observe("batch_build", time.perf_counter() - build_start, records=len(custom_ids))
+                shards.append((uploader.submit(bind_metrics(create_batch_job), client, batch_file, len(shards)),
+                               custom_ids))
+                # Bound the number of built shards waiting for their upload
+                if len(shards) >= MAX_CONCURRENT_UPLOADS:
+                    shards[-MAX_CONCURRENT_UPLOADS][0].result()
+                build_start = time.perf_counter()
+            jobs = [future.result() for future, _ in shards]
+    except BaseException:
+        # Nothing of a failed submission is tracked, so the jobs of the shards created so far would run unrecorded
+        cancel_batch_jobs(client, [future for future, _ in shards])
+        raise
+
+    manifest["dedup"] = deduplicator.to_dict()
+    if text_pages:
+        manifest["text_pages"] = {doc_id: sorted(pages) for doc_id, pages in text_pages.items()}
+        os.makedirs(manifest["output_dir"], exist_ok=True)
+        write_json(os.path.join(manifest["output_dir"], TEXT_PAGES_FILE), text_pages)
+    record_jobs = {custom_id: job.id for job, (_, custom_ids) in zip(jobs, shards) for custom_id in custom_ids}
+    manifest["submitted_pages"] = sum(last_page - first_page + 1
+                                      for _, first_page, last_page in map(parse_custom_id, record_jobs))
+    manifest["document_jobs"] = document_dependencies(manifest["page_counts"], record_jobs, deduplicator)
+
+    # Every document or page was a duplicate, already cached or skipped, nothing left to OCR
+    if not jobs:
+        manifest.update(status="CACHED", total_requests=0, succeeded_requests=0, failed_requests=0, jobs={})
+        return manifest
+
+    # Progress is polled in the background, the script run does not wait for the jobs
+    return get_job_tracker().track(client, jobs, manifest)
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h {minutes:02d}m' if hours else f'{minutes}m {seconds:02d}s'
+
+def document_file_name(pdf_name: str) -> str:
+    # Name of the markdown file offered for download, e.g. "report.v2.pdf" -> "report.v2.md"
+    return f'{os.path.splitext(pdf_name)[0]}.md'
+
+def describe_batch_error(obj: dict) -> str:
+    # Error message of a failed record from a batch output or error file
+    response = obj.get('response') or {}
+    error = obj.get('error') or response.get('body') or f"HTTP {response.get('status_code')}"
+    if isinstance(error, dict):
+        error = error.get('message') or error.get('detail') or json.dumps(error)
+    return str(error)
+
+def iter_job_records(client, job: dict, file_key: str = "output_file"):
+    """
+    Yields the JSON records of a batch job's output or error file one at a time. Local jobs (failed pages
+    re-submitted as concurrent requests) keep their files on disk.
+    """
+    if job[file_key] is None:
+        return
+    if job.get("local"):
+        with open(job[file_key], encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    # Time spent waiting for the download and parsing it, not the consumer's time between records
+    metrics = current_metrics()
+    download_seconds = parse_seconds = 0.0
+    size = records = 0
+    count("api_calls")
+    start = time.perf_counter()
+    response = client.files.download(file_id=job[file_key])
+    try:
+        for line in response.iter_lines():
+            parse_start = time.perf_counter()
+            download_seconds += parse_start - start
+            size += len(line)
+            if line.strip():
+                record = json.loads(line)
+                records += 1
+                parse_seconds += time.perf_counter() - parse_start
+                yield record
+            start = time.perf_counter()
+    finally:
+        response.close()
+        metrics.observe("download", download_seconds, bytes=size)
+        metrics.observe("parse", parse_seconds, records=records)
+
+def download_markdown_files(client, manifest: dict, documents: list = None, failed_pages: dict = None) -> dict:
+    """
+    Assembles the given documents (by default every document) from the output files of the batch jobs they depend
+    on, which must have finished. Outputs are streamed record by record into a ResultIndex and every document is
+    exported as a bundle (see export.py) to <manifest output_dir>/<document id>/ as soon as all of its pages have
+    arrived (documents with failed pages are written once the outputs have been read). Image payloads are decoded
+    into the bundle right away and only kept long enough to cache the record.
+    failed_pages: when given, filled with document id → [[page, error message], ...] of the pages without a result.
+    Returns a dict of document id → markdown file path of its bundle.
+    """
+    documents = set(manifest["page_counts"] if documents is None else documents)
+    output_dir = manifest["output_dir"]
+    os.makedirs(output_dir, exist_ok=True)
+    cache = get_ocr_cache()
+    index = ResultIndex(manifest["page_counts"])
+    for doc_id, pages in manifest.get("skipped_pages", {}).items():
+        if doc_id in documents:
+            index.skip(doc_id, pages)
+    # Pages converted from the text layer take their place among the OCRed pages
+    if manifest.get("text_pages"):
+        for doc_id, pages in read_json(os.path.join(output_dir, TEXT_PAGES_FILE), {}).items():
+            if doc_id in documents:
+                for page, markdown in pages.items():
+                    index.add(make_custom_id(doc_id, int(page)), [text_layer_page(int(page), markdown)])
+    markdown_files = {}
+
+    def bundle_dir(doc_id):
+        return os.path.join(output_dir, doc_id)
+
+    def write_document(doc_id):
+        missing_pages = index.missing_pages(doc_id)
+        if failed_pages is not None and missing_pages:
+            failed_pages[doc_id] = [[page, page_errors.get((doc_id, page), "No result")] for page in missing_pages]
+        markdown_files[doc_id] = write_bundle(bundle_dir(doc_id), index.document_pages(doc_id),
+                                              **bundle_metadata(manifest, doc_id, missing_pages))
+        index.release(doc_id)
+
+    def add_result(custom_id, pages):
+        doc_id, first_page, last_page = parse_custom_id(custom_id)
+        if doc_id not in documents or doc_id in markdown_files:
+            return
+        # Image records OCR a single page, numbered 0 in their result
+        index.add(custom_id, [export_page(page, bundle_dir(doc_id), page_number)
+                              for page_number, page in zip(range(first_page, last_page + 1), pages)])
+        if index.is_complete(doc_id):
+            write_document(doc_id)
+
+    # Error message of every page of a failed record
+    page_errors = {}
+
+    def add_error(custom_id, message):
+        doc_id, first_page, last_page = parse_custom_id(custom_id)
+        for page in range(first_page, last_page + 1):
+            page_errors[doc_id, page] = message
+
+    # Results of deduplicated pages are fanned out to every page that referenced them
+    batch_dedup = PageDeduplicator.from_dict(OCR_MODEL, manifest["dedup"])
+    duplicates_of = {}
+    for custom_id, submitted_id in batch_dedup.duplicate_pages.items():
+        duplicates_of.setdefault(submitted_id, []).append(custom_id)
+    for custom_id, cache_key in batch_dedup.cached_page_keys.items():
+        if parse_custom_id(custom_id)[0] in documents:
+            add_result(custom_id, cache.get(cache_key) or [])
+    for doc_id, cache_key in manifest["cached_documents"].items():
+        if doc_id in documents:
+            add_result(make_custom_id(doc_id, 0, manifest["page_counts"][doc_id] - 1), cache.get(cache_key) or [])
+
+    # Only the outputs of the jobs the documents depend on are read
+    job_ids = sorted({job_id for doc_id in documents for job_id in manifest["document_jobs"][doc_id]})
+    for job_id in job_ids:
+        job = manifest["jobs"][job_id]
+        for obj in iter_job_records(client, job, "error_file"):
+            for referencing_id in [obj['custom_id'], *duplicates_of.get(obj['custom_id'], [])]:
+                add_error(referencing_id, describe_batch_error(obj))
+
+        for obj in iter_job_records(client, job, "output_file"):
+            custom_id = obj['custom_id']
+            if (obj.get('response') or {}).get('status_code') != 200:
+                for referencing_id in [custom_id, *duplicates_of.get(custom_id, [])]:
+                    add_error(referencing_id, describe_batch_error(obj))
+                continue
+
+            # Document records return every page of the PDF (or of a page range), image records a single page
+            pages = obj['response']['body']['pages']
+            doc_id, first_page, last_page = parse_custom_id(custom_id)
+            if custom_id in batch_dedup.page_keys:
+                cache.put(batch_dedup.page_keys[custom_id], pages)
+            elif (first_page, last_page) == (0, manifest["page_counts"][doc_id] - 1) and \
+                    doc_id in manifest["batch_cache_keys"]:
+                cache.put(manifest["batch_cache_keys"][doc_id], pages)
+
+            for referencing_id in [custom_id, *duplicates_of.get(custom_id, [])]:
+                add_result(referencing_id, pages)
+
+    # Documents with pages that failed or never arrived are written with the pages available
+    for doc_id in sorted(documents):
+        if doc_id not in markdown_files and doc_id not in batch_dedup.duplicate_documents:
+            write_document(doc_id)
+
+    # Identical PDFs under another name get a copy of the submitted document
+    for doc_id, submitted_id in batch_dedup.duplicate_documents.items():
+        if doc_id in documents:
+            shutil.copytree(bundle_dir(submitted_id), bundle_dir(doc_id), dirs_exist_ok=True)
+            json_path = os.path.join(bundle_dir(doc_id), BUNDLE_JSON)
+            pdf_name = manifest["pdf_names"][document_position(doc_id)]
+            write_json(json_path, {**read_json(json_path), "pdf_name": pdf_name})
+            markdown_files[doc_id] = os.path.join(bundle_dir(doc_id), BUNDLE_MARKDOWN)
+            if failed_pages is not None and submitted_id in failed_pages:
+                failed_pages[doc_id] = failed_pages[submitted_id]
+
+    return markdown_files
+
+def bundle_metadata(manifest: dict, doc_id: str, missing_pages: list) -> dict:
+    # Top level of the document.json of a batch document
+    return {"pdf_name": manifest["pdf_names"][document_position(doc_id)], "model": OCR_MODEL,
+            "page_count": manifest["page_counts"][doc_id], "missing_pages": missing_pages,
+            "skipped_pages": manifest.get("skipped_pages", {}).get(doc_id, [])}
+
+def poll(job_id: str, api_key) -> dict:
+    # Current manifest of a tracked job, (re)starting its background polling in this process if needed
+    get_job_tracker().attach(get_mistral_client(api_key), job_id)
+    return get_job_tracker().load(job_id)
+
+def wait_for_job(job_id: str, api_key, on_progress=None, interval: float = 2.0) -> dict:
+    # Block until the job has finished, on_progress(manifest) is called after every check
+    manifest = poll(job_id, api_key)
+    while manifest["status"] in ACTIVE_JOB_STATUSES:
+        if on_progress is not None:
+            on_progress(manifest)
+        time.sleep(interval)
+        manifest = get_job_tracker().load(job_id)
+    return manifest
+
+def load_failed_pages(manifest: dict) -> dict:
+    # document id → [[page, error message], ...] of the collected documents with pages that failed
+    return read_json(os.path.join(manifest["output_dir"], "failed_pages.json"), {})
+
+def collect(manifest: dict, api_key) -> dict:
+    """
+    Markdown file paths of the documents of a submission whose batch jobs have finished, so documents of finished
+    shards are available while other shards are still running. Every document is only downloaded once, the paths are
+    recorded in <manifest output_dir>/markdown_files.json and the pages that failed in failed_pages.json, for later
+    calls from any process.
+    Returns a dict of document id → markdown file path.
+    """
+    index_path = os.path.join(manifest["output_dir"], "markdown_files.json")
+    markdown_files = {doc_id: path for doc_id, path in read_json(index_path, {}).items() if os.path.exists(path)}
+
+    missing = [doc_id for doc_id in ready_documents(manifest) if doc_id not in markdown_files]
+    if missing:
+        client = get_mistral_client(api_key) if manifest["jobs"] else None
+        failed_pages = {doc_id: pages for doc_id, pages in load_failed_pages(manifest).items()
+                        if doc_id not in missing}
+        markdown_files.update(download_markdown_files(client, manifest, missing, failed_pages))
+        write_json(os.path.join(manifest["output_dir"], "failed_pages.json"), failed_pages)
+        write_json(index_path, markdown_files)
+        if manifest["jobs"] and len(markdown_files) == len(manifest["page_counts"]):
+            record_job_timings(manifest)
+    return markdown_files
+
+def record_job_timings(manifest: dict):
+    # Time the submission spent queued and processing on Mistral's side, as seen by the job tracker
+    started_at = manifest.get("started_at", manifest["updated_at"])
+    current_metrics().observe("queue_wait", started_at - manifest["created_at"])
+    current_metrics().observe("processing", manifest["updated_at"] - started_at, records=manifest["total_requests"])
+
+def contiguous_ranges(pages: list) -> list:
+    # Sorted page numbers as (first, last) runs, e.g. [1, 2, 3, 7] -> [(1, 3), (7, 7)]
+    ranges = []
+    for page in sorted(pages):
+        if ranges and ranges[-1][1] == page - 1:
+            ranges[-1] = (ranges[-1][0], page)
+        else:
+            ranges.append((page, page))
+    return ranges
+
+def iter_retry_entries(client, retry_pages: dict, doc_pdfs: dict, profile: RenderProfile = RenderProfile()):
+    """
+    Yields (custom_id, JSONL record) re-submitting the failed pages of every document: a page selection of the
+    uploaded document per contiguous run of pages, or rasterized page images for PDFs over the direct limits.
+    """
+    for doc_id, pages in retry_pages.items():
+        pdf = doc_pdfs[doc_id]
+        pdf_bytes = pdf.getvalue()
+        if not needs_rasterization(pdf_bytes):
+            document_url = upload_pdf_for_ocr(client, pdf.name, pdf_bytes, expiry=SIGNED_URL_EXPIRY_HOURS)
+            for first_page, last_page in contiguous_ranges(pages):
+                custom_id = make_custom_id(doc_id, first_page, last_page)
+                body = {
+                    "document": {
+                        "type": "document_url",
+                        "document_url": document_url
+                    },
+                    "include_image_base64": True,
+                    "pages": list(range(first_page, last_page + 1))
+                }
+                yield custom_id, json.dumps({"custom_id": custom_id, "body": body}) + "\n"
+            continue
+
+        for page in pages:
+            image_str = rasterize_page_range(pdf_bytes, page + 1, page + 1, profile)[0].image_base64
+            custom_id = make_custom_id(doc_id, page)
+            body = {"document": {"type": "image_url", "image_url": image_str}, "include_image_base64": True}
+            yield custom_id, json.dumps({"custom_id": custom_id, "body": body}) + "\n"
+
+def run_retry_requests(client, retry_pages: dict, doc_pdfs: dict, output_dir: str,
+                       profile: RenderProfile = RenderProfile(), retry_policy: RetryPolicy = RetryPolicy(),
+                       max_concurrency: int = MAX_CONCURRENT_REQUESTS) -> tuple:
+    """
+    OCRs the failed pages with concurrent direct requests and writes the results in the format of batch output and
+    error files, so they are merged like any other batch job. Returns (job id, job state) of that local job.
+    """
+    loop = get_event_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    metrics = current_metrics()
+    futures = {}
+    for doc_id, pages in retry_pages.items():
+        pdf = doc_pdfs[doc_id]
+        pdf_bytes = pdf.getvalue()
+        if not needs_rasterization(pdf_bytes):
+            coroutine = mistral_ocr_async(client, pdf.name, pdf_bytes, semaphore, retry_policy, sorted(pages))
+            futures[asyncio.run_coroutine_threadsafe(run_with_metrics(metrics, coroutine), loop)] = (doc_id, sorted(pages))
+            continue
+        for page in pages:
+            image_str = rasterize_page_range(pdf_bytes, page + 1, page + 1, profile)[0].image_base64
+            coroutine = mistral_ocr_image_async(client, image_str, semaphore, retry_policy)
+            futures[asyncio.run_coroutine_threadsafe(run_with_metrics(metrics, coroutine), loop)] = (doc_id, [page])
+
+    job_name = f"local-{uuid.uuid4().hex}"
+    job = {"status": "SUCCESS", "total_requests": len(futures), "succeeded_requests": 0, "failed_requests": 0,
+           "output_file": os.path.join(output_dir, f"{job_name}_output.jsonl"),
+           "error_file": os.path.join(output_dir, f"{job_name}_error.jsonl"), "local": True}
+    os.makedirs(output_dir, exist_ok=True)
+    with open(job["output_file"], "w", encoding="utf-8") as output, \
+            open(job["error_file"], "w", encoding="utf-8") as errors:
+        for future in as_completed(futures):
+            doc_id, pages = futures[future]
+            try:
+                result_pages = future.result()
+            except Exception as error:
+                job["failed_requests"] += 1
+                for first_page, last_page in contiguous_ranges(pages):
+                    errors.write(json.dumps({"custom_id": make_custom_id(doc_id, first_page, last_page),
+                                             "error": {"message": str(error)}}) + "\n")
+                continue
+
+            # One record per page, so the results line up with their page numbers
+            job["succeeded_requests"] += 1
+            for page, result_page in zip(pages, result_pages):
+                output.write(json.dumps({"custom_id": make_custom_id(doc_id, page),
+                                         "response": {"status_code": 200, "body": {"pages": [result_page]}}}) + "\n")
+    return job_name, job
+
+def resubmit_failed_pages(manifest: dict, pdfs, api_key, concurrent: bool = False,
+                          profile: RenderProfile = RenderProfile(), retry_policy: RetryPolicy = RetryPolicy(),
+                          max_concurrency: int = MAX_CONCURRENT_REQUESTS) -> dict:
+    """
+    Re-submits only the pages that failed in a collected submission, as batch jobs or, when concurrent is set, as
+    direct requests. The new jobs are added to the submission and its documents are assembled again from all of their
+    jobs once they finish, so the retried pages are merged into the existing documents.
+    pdfs: the PDFs of the submission, in the same order.
+    Returns the updated manifest.
+    """
+    if manifest["job_id"] is None:
+        raise ValueError("Only batch submissions can be re-submitted")
+    if [pdf.name for pdf in pdfs] != manifest["pdf_names"]:
+        raise ValueError("The PDFs do not match the submission")
+    if manifest.get("resubmissions", 0) >= retry_policy.max_resubmissions:
+        raise ValueError(f"Failed pages were already re-submitted {retry_policy.max_resubmissions} times")
+
+    failed_pages = load_failed_pages(manifest)
+    if not failed_pages:
+        return manifest
+
+    # Copies of identical PDFs are assembled from the document they duplicate
+    duplicate_documents = manifest["dedup"]["duplicate_documents"]
+    retry_pages = {doc_id: [page for page, _ in pages] for doc_id, pages in failed_pages.items()
+                   if doc_id not in duplicate_documents}
+    doc_pdfs = {document_id(position): pdf for position, pdf in enumerate(pdfs)}
+    client = get_mistral_client(api_key)
+
+    if concurrent:
+        local_jobs = [run_retry_requests(client, retry_pages, doc_pdfs, manifest["output_dir"], profile,
+                                         retry_policy, max_concurrency)]
+        jobs = []
+    else:
+        entries = iter_retry_entries(client, retry_pages, doc_pdfs, profile)
+        jobs = [create_batch_job(client, batch_file, f"retry_{shard}")
+                for shard, (batch_file, _) in enumerate(iter_jsonl_shards(entries))]
+        local_jobs = []
+
+    def add_retry_jobs(tracked_manifest):
+        job_ids = [job.id for job in jobs] + [job_name for job_name, _ in local_jobs]
+        tracked_manifest["jobs"].update(local_jobs)
+        for doc_id in failed_pages:
+            tracked_manifest["document_jobs"][doc_id] = sorted({*tracked_manifest["document_jobs"][doc_id], *job_ids})
+        tracked_manifest["resubmissions"] = tracked_manifest.get("resubmissions", 0) + 1
+        tracked_manifest["submitted_pages"] = (tracked_manifest.get("submitted_pages", 0) +
+                                               sum(len(pages) for pages in retry_pages.values()))
+
+    manifest = get_job_tracker().extend(client, manifest["job_id"], jobs, add_retry_jobs)
+
+    # The retried documents are collected again once their new jobs have finished
+    index_path = os.path.join(manifest["output_dir"], "markdown_files.json")
+    markdown_files = read_json(index_path, {})
+    write_json(index_path, {doc_id: path for doc_id, path in markdown_files.items() if doc_id not in failed_pages})
+    return manifest
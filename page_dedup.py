@@ -0,0 +1,167 @@
+import hashlib
+import io
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Perceptual matching: pages whose difference hashes differ in at most MAX_HASH_DISTANCE bits are only candidate
+# duplicates. A candidate is confirmed by comparing grayscale thumbnails SIGNATURE_WIDTH pixels wide: the pages are
+# duplicates when no pixel of the thumbnails differs by more than MAX_PIXEL_DIFFERENCE shades, which rendering and
+# compression noise stays below, but a changed word or figure does not.
+PERCEPTUAL_HASH_SIZE = 16
+MAX_HASH_DISTANCE = 24
+SIGNATURE_WIDTH = 512
+MAX_PIXEL_DIFFERENCE = 40
+
+
+def content_hash(data) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(image: "Image.Image", hash_size: int = PERCEPTUAL_HASH_SIZE) -> str:
+    """
+    Difference hash of a rendered page: compares the brightness of horizontally adjacent cells of a downscaled
+    grayscale copy. Pages that only differ by rendering or compression noise get the same or a nearby hash.
+    """
+    from PIL import Image
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def page_signature(image: "Image.Image") -> bytes:
+    # Grayscale thumbnail of a rendered page as PNG, to confirm perceptual matches with
+    from PIL import Image
+
+    gray = image.convert("L")
+    thumbnail = gray.resize((SIGNATURE_WIDTH, round(gray.height * SIGNATURE_WIDTH / gray.width)),
+                            Image.Resampling.BOX)
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def same_page(signature: bytes, other_signature: bytes) -> bool:
+    # Whether two page signatures only differ by noise, see MAX_PIXEL_DIFFERENCE
+    from PIL import Image, ImageChops
+
+    with Image.open(io.BytesIO(signature)) as image, Image.open(io.BytesIO(other_signature)) as other:
+        if image.size != other.size:
+            return False
+        difference = ImageChops.difference(image, other)
+    return difference.getextrema()[1] <= MAX_PIXEL_DIFFERENCE
+
+
+def hash_bands(page_hash: str, bands: int = MAX_HASH_DISTANCE + 1) -> list:
+    # (band, bits) of the hash split into bands, hashes at most bands - 1 bits apart share at least one band
+    bits, size = int(page_hash, 16), len(page_hash) * 4
+    return [(band, bits >> (size * band // bands) & ((1 << (size * (band + 1) // bands - size * band // bands)) - 1))
+            for band in range(bands)]
+
+
+def page_cache_key(page_hash: str, model: str, profile=None) -> str:
+    # Cache key of a single page result, namespaced so it can never collide with a document key
+    return content_hash(f"page\0{page_hash}\0{model}\0{profile!r}")
+
+
+class PageDeduplicator:
+    """
+    Tracks the pages (and whole PDFs) of one batch submission so every unique page is only submitted once.
+    Duplicates within the batch are mapped to the custom_id of their first occurrence, and pages already OCRed by an
+    earlier submission are served from the OCR cache. After the job finishes the results are fanned back out to
+    every referencing page.
+    Pages are duplicates when their rendered images are identical, or with perceptual set, when they look the same
+    (see MAX_HASH_DISTANCE). Only identical pages are served from the cache.
+    """
+
+    def __init__(self, model: str, profile=None, cache=None, perceptual: bool = False):
+        self.model = model
+        self.profile = profile
+        self.cache = cache
+        self.perceptual = perceptual
+
+        self.seen_pages = {}  # page hash -> custom_id of the submitted page
+        self.seen_documents = {}  # PDF hash -> file name of the first occurrence
+        self.duplicate_pages = {}  # custom_id -> custom_id of the submitted page
+        self.duplicate_documents = {}  # file name -> file name of the submitted document
+        self.cached_page_keys = {}  # custom_id -> cache key of the page result from an earlier submission
+        self.page_keys = {}  # custom_id of a submitted page -> cache key to store its result under
+        self.document_pages_saved = 0
+        self.hash_index = {}  # (band, bits) of a perceptual hash -> custom_ids of the submitted pages
+        self.signatures = {}  # custom_id of a submitted page -> (perceptual hash, page signature)
+
+    def find_similar_page(self, page_phash: str, signature: bytes):
+        # custom_id of a submitted page that looks the same, None if there is none
+        bits = int(page_phash, 16)
+        candidates = {custom_id for band in hash_bands(page_phash) for custom_id in self.hash_index.get(band, ())}
+        for custom_id in sorted(candidates):
+            submitted_phash, submitted_signature = self.signatures[custom_id]
+            if ((bits ^ int(submitted_phash, 16)).bit_count() <= MAX_HASH_DISTANCE and
+                    same_page(signature, submitted_signature)):
+                return custom_id
+        return None
+
+    def submit_page(self, custom_id: str, image_str: str, page_phash: str = None, signature: bytes = None) -> bool:
+        # Returns whether the page has to be submitted, page_phash and signature are needed for perceptual matching
+        page_hash = content_hash(image_str)
+        submitted_id = self.seen_pages.get(page_hash)
+        if submitted_id is None and self.perceptual:
+            submitted_id = self.find_similar_page(page_phash, signature)
+        if submitted_id is not None:
+            self.duplicate_pages[custom_id] = submitted_id
+            return False
+
+        key = page_cache_key(page_hash, self.model, self.profile)
+        if self.cache is not None and self.cache.contains(key):
+            self.cached_page_keys[custom_id] = key
+            return False
+
+        self.seen_pages[page_hash] = custom_id
+        self.page_keys[custom_id] = key
+        if self.perceptual:
+            self.signatures[custom_id] = (page_phash, signature)
+            for band in hash_bands(page_phash):
+                self.hash_index.setdefault(band, []).append(custom_id)
+        return True
+
+    def submit_document(self, file_name: str, pdf_bytes: bytes) -> bool:
+        # Returns whether the PDF has to be submitted, identical PDFs under another name are only OCRed once.
+        # The caller adds the page count of skipped PDFs to document_pages_saved.
+        pdf_hash = content_hash(pdf_bytes)
+        if pdf_hash in self.seen_documents:
+            self.duplicate_documents[file_name] = self.seen_documents[pdf_hash]
+            return False
+
+        self.seen_documents[pdf_hash] = file_name
+        return True
+
+    @property
+    def pages_saved(self) -> int:
+        return len(self.duplicate_pages) + len(self.cached_page_keys) + self.document_pages_saved
+
+    def to_dict(self) -> dict:
+        # What is needed to fan results out after the job finishes, in a JSON serializable form
+        return {
+            "duplicate_pages": self.duplicate_pages,
+            "duplicate_documents": self.duplicate_documents,
+            "cached_page_keys": self.cached_page_keys,
+            "page_keys": self.page_keys,
+            "document_pages_saved": self.document_pages_saved,
+        }
+
+    @classmethod
+    def from_dict(cls, model: str, data: dict) -> "PageDeduplicator":
+        deduplicator = cls(model)
+        for name, value in data.items():
+            setattr(deduplicator, name, value)
+        return deduplicator
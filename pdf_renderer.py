@@ -0,0 +1,104 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import bind_metrics, timer
+
+# Rendered PDFs kept in memory, least recently used ones are dropped beyond this size
+PDF_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+# Number of PDFs rendered at the same time
+PDF_RENDER_WORKERS = 2
+
+
+def convert_md_to_pdf(md_contents, root: str = "."):
+    # markdown_pdf is slow to import and only needed once a PDF is requested. Relative image links resolve from root.
+    from markdown_pdf import MarkdownPdf, Section
+
+    with timer("pdf_render", bytes=len(md_contents)):
+        # Generate PDF from markdown content
+        pdf = MarkdownPdf(toc_level=2, optimize=True)
+        pdf.add_section(Section(md_contents, root=root))
+
+        # Save PDF to bytes buffer
+        pdf_buffer = io.BytesIO()
+        pdf.save(pdf_buffer)
+        pdf_bytes = pdf_buffer.getvalue()
+
+    return pdf_bytes
+
+
+class PdfRenderer:
+    """
+    Renders markdown to PDF on background threads, memoized by the SHA-256 of the markdown and the directory its
+    relative image links resolve from. Identical documents requested from several sessions are rendered once.
+    """
+
+    def __init__(self, max_workers: int = PDF_RENDER_WORKERS, max_cache_size: int = PDF_CACHE_MAX_SIZE):
+        self.max_cache_size = max_cache_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdf-render")
+        self._lock = threading.Lock()
+        self._rendered = OrderedDict()  # markdown hash -> PDF bytes, in least recently used order
+        self._rendered_size = 0
+        self._pending = {}  # markdown hash -> future of a render in progress
+
+    def submit(self, markdown: str, root: str = ".") -> str:
+        # Start rendering unless the PDF is cached or already being rendered, returns the key to poll
+        digest = hashlib.sha256(markdown.encode("utf-8"))
+        digest.update(f"\0{root}".encode("utf-8"))
+        key = digest.hexdigest()
+        with self._lock:
+            if key not in self._rendered and key not in self._pending:
+                # Timed as part of the run that asked for the PDF
+                self._pending[key] = self._executor.submit(bind_metrics(self._render), key, markdown, root)
+        return key
+
+    def result(self, key: str):
+        """
+        Returns the PDF bytes, or None while the render is still in progress.
+        Re-raises the exception of a failed render.
+        """
+        with self._lock:
+            if key in self._rendered:
+                self._rendered.move_to_end(key)
+                return self._rendered[key]
+            future = self._pending.get(key)
+        if future is None:
+            raise KeyError(f"No PDF rendered or pending for {key}")
+        if future.done():
+            with self._lock:
+                self._pending.pop(key, None)
+            return future.result()
+        return None
+
+    def pending(self, key: str) -> bool:
+        # Whether the render is still in progress, unlike result this leaves a failed render to be reported
+        with self._lock:
+            future = self._pending.get(key)
+        return future is not None and not future.done()
+
+    def _render(self, key: str, markdown: str, root: str) -> bytes:
+        pdf_bytes = convert_md_to_pdf(markdown, root)
+        with self._lock:
+            self._rendered[key] = pdf_bytes
+            self._rendered_size += len(pdf_bytes)
+            self._pending.pop(key, None)
+            while self._rendered_size > self.max_cache_size and len(self._rendered) > 1:
+                _, evicted = self._rendered.popitem(last=False)
+                self._rendered_size -= len(evicted)
+        return pdf_bytes
+
+
+_pdf_renderer = None
+_pdf_renderer_lock = threading.Lock()
+
+
+def get_pdf_renderer() -> PdfRenderer:
+    # Process-wide renderer shared by every Streamlit session
+    global _pdf_renderer
+    with _pdf_renderer_lock:
+        if _pdf_renderer is None:
+            _pdf_renderer = PdfRenderer()
+        return _pdf_renderer
@@ -0,0 +1,302 @@
+"""
+Process-wide request budget for the Mistral API, shared by every Streamlit session, the job tracker and the CLI.
+
+Every API call takes a token from a bucket refilled at a fixed number of requests per second, and file uploads and
+batch job polls also hold one of a limited number of slots while they run. Calls that have to wait are admitted round
+robin across sessions, so a session queueing hundreds of uploads delays the calls of every other session by at most
+one of its own.
+"""
+import asyncio
+import contextvars
+import inspect
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+from metrics import count, current_metrics
+
+# Calls that hold a slot of their kind while they run, by SDK method without the _async suffix, all others are
+# "request" calls, which only take a token
+CALL_KINDS = {"files.upload": "upload", "batch.jobs.get": "poll"}
+
+# Session of the calls made outside of any Streamlit session, e.g. by the command line
+DEFAULT_SESSION = "default"
+
+# Waiting calls check at least this often (seconds) whether they can be admitted, e.g. when a slot was freed while
+# the bucket was empty
+MAX_ADMISSION_WAIT = 0.5
+
+# Seconds over which the request rate shown as utilization is measured
+UTILIZATION_WINDOW = 10.0
+
+
+@dataclass(frozen=True)
+class RateLimits:
+    """
+    requests_per_second and burst: refill rate and capacity of the token bucket, no rate limit when
+    requests_per_second is None.
+    max_concurrent_uploads and max_concurrent_polls: file uploads and batch job polls in flight at once.
+    """
+    requests_per_second: Optional[float] = 5.0
+    burst: int = 5
+    max_concurrent_uploads: int = 4
+    max_concurrent_polls: int = 2
+
+    def slots(self, kind: str) -> Optional[int]:
+        # Calls of the kind that may run at once, None when they are not capped
+        return {"upload": self.max_concurrent_uploads, "poll": self.max_concurrent_polls}.get(kind)
+
+
+class _Waiter:
+    # A call waiting for admission, wake() is called once from whichever thread admits it
+    __slots__ = ("kind", "wake", "admitted", "since")
+
+    def __init__(self, kind: str, wake):
+        self.kind = kind
+        self.wake = wake
+        self.admitted = False
+        self.since = time.monotonic()
+
+
+class RequestBudget:
+    """
+    Token bucket and concurrency caps (see RateLimits) with a queue of waiting calls per session. Whenever a token
+    and a slot are free, the first waiting call of the next session in turn that can run is admitted.
+    """
+
+    def __init__(self, limits: RateLimits = RateLimits()):
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._tokens = float(limits.burst)
+        self._refilled_at = time.monotonic()
+        self._in_flight = Counter()  # kind -> admitted calls still running
+        self._queues = OrderedDict()  # session -> deque of waiters, sessions in round robin order
+        self._admissions = deque()  # times of the admissions within UTILIZATION_WINDOW
+        self._stats = Counter()  # admitted, wait_seconds, throttled
+
+    def configure(self, limits: RateLimits):
+        with self._lock:
+            self.limits = limits
+            self._tokens = min(self._tokens, limits.burst)
+            self._dispatch()
+
+    def _refill(self, now: float):
+        if self.limits.requests_per_second is not None:
+            elapsed = now - self._refilled_at
+            self._tokens = min(self._tokens + elapsed * self.limits.requests_per_second, self.limits.burst)
+        self._refilled_at = now
+
+    def _can_run(self, kind: str) -> bool:
+        slots = self.limits.slots(kind)
+        return slots is None or self._in_flight[kind] < slots
+
+    def _dispatch(self) -> Optional[float]:
+        """
+        Admits waiting calls round robin across sessions while tokens and slots last. Returns the seconds until the
+        next token when a call is waiting for one, None when calls only wait for slots or nothing waits.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        while self._queues:
+            session, waiter = next(((session, waiter) for session, queue in self._queues.items()
+                                    for waiter in queue if self._can_run(waiter.kind)), (None, None))
+            if waiter is None:
+                return None
+            if self.limits.requests_per_second is not None:
+                if self._tokens < 1:
+                    return (1 - self._tokens) / self.limits.requests_per_second
+                self._tokens -= 1
+
+            queue = self._queues.pop(session)
+            queue.remove(waiter)
+            if queue:
+                # The session's remaining calls wait for every other session's turn
+                self._queues[session] = queue
+            self._in_flight[waiter.kind] += 1
+            self._admissions.append(now)
+            self._stats["admitted"] += 1
+            self._stats["wait_seconds"] += now - waiter.since
+            waiter.admitted = True
+            waiter.wake()
+        return None
+
+    def _enqueue(self, session: str, waiter: _Waiter) -> Optional[float]:
+        with self._lock:
+            self._queues.setdefault(session, deque()).append(waiter)
+            return self._dispatch()
+
+    def _redispatch(self) -> Optional[float]:
+        with self._lock:
+            return self._dispatch()
+
+    def _withdraw(self, session: str, waiter: _Waiter):
+        # A waiting call was cancelled: give up its place in the queue, or its slot when it was just admitted
+        with self._lock:
+            if waiter.admitted:
+                self._in_flight[waiter.kind] -= 1
+            else:
+                queue = self._queues.get(session)
+                queue.remove(waiter)
+                if not queue:
+                    del self._queues[session]
+            self._dispatch()
+
+    @staticmethod
+    def _record_wait(waiter: _Waiter):
+        waited = time.monotonic() - waiter.since
+        if waited > 0.001:
+            current_metrics().observe("rate_limit_wait", waited)
+
+    def acquire(self, kind: str, session: str = DEFAULT_SESSION):
+        # Block until a call of the kind may start, every acquire must be followed by a release
+        event = threading.Event()
+        waiter = _Waiter(kind, event.set)
+        try:
+            delay = self._enqueue(session, waiter)
+            while not event.wait(min(delay or MAX_ADMISSION_WAIT, MAX_ADMISSION_WAIT)):
+                delay = self._redispatch()
+        except BaseException:
+            self._withdraw(session, waiter)
+            raise
+        self._record_wait(waiter)
+
+    async def acquire_async(self, kind: str, session: str = DEFAULT_SESSION):
+        # acquire for coroutines, waits without blocking the event loop
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: admitted.done() or admitted.set_result(None))
+
+        waiter = _Waiter(kind, wake)
+        try:
+            delay = self._enqueue(session, waiter)
+            while not admitted.done():
+                try:
+                    await asyncio.wait_for(asyncio.shield(admitted),
+                                           min(delay or MAX_ADMISSION_WAIT, MAX_ADMISSION_WAIT))
+                except asyncio.TimeoutError:
+                    delay = self._redispatch()
+        except BaseException:
+            self._withdraw(session, waiter)
+            raise
+        self._record_wait(waiter)
+
+    def release(self, kind: str):
+        with self._lock:
+            self._in_flight[kind] -= 1
+            self._dispatch()
+
+    @contextmanager
+    def admit(self, kind: str, session: str = DEFAULT_SESSION):
+        self.acquire(kind, session)
+        try:
+            yield
+        finally:
+            self.release(kind)
+
+    @asynccontextmanager
+    async def admit_async(self, kind: str, session: str = DEFAULT_SESSION):
+        await self.acquire_async(kind, session)
+        try:
+            yield
+        finally:
+            self.release(kind)
+
+    def throttled(self):
+        # The API rate limited a call anyway (e.g. the key is also used elsewhere): empty the bucket, so every
+        # session backs off instead of retrying into the limit
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0)
+            self._stats["throttled"] += 1
+        count("rate_limited")
+
+    def utilization(self) -> dict:
+        # Snapshot of the budget for display
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            while self._admissions and self._admissions[0] < now - UTILIZATION_WINDOW:
+                self._admissions.popleft()
+            return {
+                "limits": self.limits,
+                "requests_per_second": len(self._admissions) / UTILIZATION_WINDOW,
+                "tokens": self._tokens if self.limits.requests_per_second is not None else None,
+                "in_flight": {kind: self._in_flight[kind] for kind in ("upload", "poll", "request")},
+                "waiting": sum(len(queue) for queue in self._queues.values()),
+                "waiting_sessions": len(self._queues),
+                "admitted": self._stats["admitted"],
+                "throttled": self._stats["throttled"],
+                "mean_wait": self._stats["wait_seconds"] / self._stats["admitted"] if self._stats["admitted"] else 0.0,
+            }
+
+
+class RateLimitedClient:
+    """
+    Proxy of a Mistral client, or of one of its namespaces such as client.files, whose API calls are admitted by a
+    RequestBudget on behalf of a session. Rate limited (429) responses are reported to the budget.
+    """
+
+    def __init__(self, target, budget: RequestBudget, session: str = DEFAULT_SESSION, path: str = ""):
+        self._target = target
+        self._budget = budget
+        self._session = session
+        self._path = path
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._target, name)
+        path = f"{self._path}.{name}" if self._path else name
+        kind = CALL_KINDS.get(path.removesuffix("_async"), "request")
+        budget, session = self._budget, self._session
+
+        if inspect.iscoroutinefunction(attribute):
+            async def call_async(*args, **kwargs):
+                async with budget.admit_async(kind, session):
+                    try:
+                        return await attribute(*args, **kwargs)
+                    except Exception as error:
+                        if getattr(error, "status_code", None) == 429:
+                            budget.throttled()
+                        raise
+            return call_async
+
+        if callable(attribute):
+            def call(*args, **kwargs):
+                with budget.admit(kind, session):
+                    try:
+                        return attribute(*args, **kwargs)
+                    except Exception as error:
+                        if getattr(error, "status_code", None) == 429:
+                            budget.throttled()
+                        raise
+            return call
+
+        return RateLimitedClient(attribute, budget, session, path)
+
+
+# Session the API calls of the current thread or task are made for
+_current_session = contextvars.ContextVar("current_session", default=DEFAULT_SESSION)
+
+
+def current_session() -> str:
+    return _current_session.get()
+
+
+def use_session(session: str):
+    # Queue the API calls of the rest of the current thread under session, e.g. a Streamlit script run
+    _current_session.set(session)
+
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def get_request_budget(api_key: str) -> RequestBudget:
+    # One budget per API key for the whole process, since the API rate limits each key on its own
+    with _budgets_lock:
+        if api_key not in _budgets:
+            _budgets[api_key] = RequestBudget()
+        return _budgets[api_key]
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules live at the top of the repository, the offline Mistral client with the benchmarks
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
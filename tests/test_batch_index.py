@@ -0,0 +1,39 @@
+import pytest
+
+from batch_index import ResultIndex, document_id, document_position, make_custom_id, parse_custom_id
+
+
+def test_custom_id_round_trip():
+    assert make_custom_id("doc3", 4) == "doc3:p4-4"
+    assert parse_custom_id(make_custom_id("doc3", 4, 9)) == ("doc3", 4, 9)
+    assert document_position(document_id(12)) == 12
+
+
+@pytest.mark.parametrize("custom_id", ["doc1", "doc1:p2", "doc1:p2-x", "file.pdf:p0-0", "doc1:p0-0 "])
+def test_parse_custom_id_rejects_other_ids(custom_id):
+    with pytest.raises(ValueError):
+        parse_custom_id(custom_id)
+
+
+def test_result_index_assembles_pages_arriving_out_of_order():
+    index = ResultIndex({"doc0": 5, "doc1": 1})
+    index.add("doc0:p3-4", ["p3", "p4"])
+    index.add("doc1:p0-0", ["only"])
+    index.add("doc0:p0-1", ["p0", "p1"])
+    assert not index.is_complete("doc0")
+    assert index.missing_pages("doc0") == [2]
+
+    index.skip("doc0", [2])
+    assert index.is_complete("doc0")
+    assert index.document_pages("doc0") == ["p0", "p1", "p3", "p4"]
+    assert index.document_pages("doc1") == ["only"]
+
+
+def test_result_index_leaves_out_missing_pages():
+    index = ResultIndex({"doc0": 3})
+    index.add("doc0:p1-1", ["p1"])
+    assert index.missing_pages("doc0") == [0, 2]
+    assert index.document_pages("doc0") == ["p1"]
+
+    index.release("doc0")
+    assert index.document_pages("doc0") == []
@@ -0,0 +1,69 @@
+import io
+import json
+import os
+
+import pytest
+
+import ocr_pipeline
+from fake_mistral import FakeMistral
+from ocr_pipeline import create_batch_job, create_jsonl_batch, iter_jsonl_shards
+
+
+def records(count: int):
+    # (custom_id, JSONL record) pairs of rasterized pages, as iter_batch_entries yields them
+    body = {"document": {"type": "image_url", "image_url": "data:image/jpeg;base64,"}}
+    return [(f"doc0:p{page}-{page}", json.dumps({"custom_id": f"doc0:p{page}-{page}", "body": body}) + "\n")
+            for page in range(count)]
+
+
+def test_fake_client_rejects_upload_content_the_sdk_rejects():
+    client = FakeMistral()
+    with pytest.raises(TypeError):
+        client.files.upload(file={"file_name": "batch.jsonl", "content": io.BytesIO(b"{}")}, purpose="batch")
+
+
+def test_shards_are_uploaded_and_deleted():
+    client = FakeMistral()
+    shards = list(iter_jsonl_shards(iter(records(5)), max_records=2))
+    assert [custom_ids for _, custom_ids in shards] == [["doc0:p0-0", "doc0:p1-1"], ["doc0:p2-2", "doc0:p3-3"],
+                                                        ["doc0:p4-4"]]
+    paths = [batch_file.name for batch_file, _ in shards]
+    jobs = [create_batch_job(client, batch_file, shard) for shard, (batch_file, _) in enumerate(shards)]
+
+    assert [job.total_requests for job in jobs] == [2, 2, 1]
+    assert not any(os.path.exists(path) for path in paths)
+
+
+def test_shards_stay_below_max_bytes():
+    shards = list(iter_jsonl_shards(iter(records(6)), max_bytes=2 * len(records(1)[0][1])))
+    assert [len(custom_ids) for _, custom_ids in shards] == [2, 2, 2]
+    for batch_file, _ in shards:
+        batch_file.close()
+
+
+def test_shard_being_built_is_deleted_when_the_entries_fail(monkeypatch):
+    created = []
+
+    def new_batch_file():
+        created.append(ocr_pipeline.tempfile.NamedTemporaryFile(mode="w+b", suffix=".jsonl"))
+        return created[-1]
+
+    def failing_entries():
+        yield from records(3)
+        raise RuntimeError("rasterization failed")
+
+    monkeypatch.setattr(ocr_pipeline, "new_batch_file", new_batch_file)
+    shards = iter_jsonl_shards(failing_entries(), max_records=2)
+    batch_file, _ = next(shards)
+    batch_file.close()
+    with pytest.raises(RuntimeError):
+        next(shards)
+    assert len(created) == 2
+    assert not any(os.path.exists(batch_file.name) for batch_file in created)
+
+
+def test_create_jsonl_batch_can_be_uploaded():
+    client = FakeMistral()
+    batch_file = create_jsonl_batch([])
+    job = create_batch_job(client, batch_file, 0)
+    assert job.total_requests == 0
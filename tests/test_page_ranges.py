@@ -0,0 +1,36 @@
+import pytest
+
+from ocr_pipeline import contiguous_ranges, parse_page_ranges, split_page_ranges, split_selected_pages
+
+
+@pytest.mark.parametrize("spec, pages", [
+    ("", None),
+    ("  ", None),
+    ("1", [0]),
+    ("1-3, 7, 10-", [0, 1, 2, 6, 9, 10, 11]),
+    ("3-4,1-4", [0, 1, 2, 3]),
+    (" 12 - 12 ", [11]),
+])
+def test_parse_page_ranges(spec, pages):
+    assert parse_page_ranges(spec, 12) == pages
+
+
+@pytest.mark.parametrize("spec", ["0", "13", "5-3", "1-13", "a", "1-2-3", "-4", "1,,2"])
+def test_parse_page_ranges_rejects_invalid_ranges(spec):
+    with pytest.raises(ValueError):
+        parse_page_ranges(spec, 12)
+
+
+def test_contiguous_ranges():
+    assert contiguous_ranges([7, 1, 3, 2]) == [(1, 3), (7, 7)]
+    assert contiguous_ranges([]) == []
+
+
+def test_split_page_ranges():
+    assert split_page_ranges(10, 4) == [(1, 4), (5, 8), (9, 10)]
+    assert split_page_ranges(0, 4) == []
+
+
+def test_split_selected_pages_chunks_every_run():
+    # 0-based selection, 1-based inclusive chunks
+    assert split_selected_pages([0, 1, 2, 5, 6, 7, 8, 9], 3) == [(1, 3), (6, 8), (9, 10)]
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+
+from rate_limiter import RateLimitedClient, RateLimits, RequestBudget
+
+
+def test_waiting_calls_are_admitted_round_robin_across_sessions():
+    # One upload slot, held while a heavy session and a light one queue behind it
+    budget = RequestBudget(RateLimits(requests_per_second=None, max_concurrent_uploads=1))
+    budget.acquire("upload", "heavy")
+    admitted = []
+
+    def upload(session, call):
+        budget.acquire("upload", session)
+        admitted.append((session, call))
+
+    threads = []
+    for session, call in [("heavy", 1), ("heavy", 2), ("heavy", 3), ("light", 1)]:
+        threads.append(threading.Thread(target=upload, args=(session, call)))
+        threads[-1].start()
+        # Queue in this order
+        while budget.utilization()["waiting"] < len(threads):
+            time.sleep(0.001)
+
+    for count in range(1, 5):
+        budget.release("upload")
+        while len(admitted) < count:
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    assert admitted == [("heavy", 1), ("light", 1), ("heavy", 2), ("heavy", 3)]
+
+
+def test_calls_beyond_the_burst_wait_for_a_token():
+    budget = RequestBudget(RateLimits(requests_per_second=20, burst=2))
+    start = time.monotonic()
+    for _ in range(4):
+        with budget.admit("request"):
+            pass
+    # Two calls from the full bucket, the other two a token (50 ms) apart
+    assert time.monotonic() - start >= 0.09
+    assert budget.utilization()["admitted"] == 4
+
+
+def test_uncapped_kinds_do_not_hold_slots():
+    budget = RequestBudget(RateLimits(requests_per_second=None, max_concurrent_polls=1))
+    budget.acquire("request")
+    budget.acquire("request")
+    budget.acquire("poll")
+    assert budget.utilization()["in_flight"] == {"upload": 0, "poll": 1, "request": 2}
+
+
+def test_client_reports_rate_limited_calls():
+    class TooManyRequests(Exception):
+        status_code = 429
+
+    class Files:
+        def upload(self, **kwargs):
+            raise TooManyRequests()
+
+        async def upload_async(self, **kwargs):
+            raise TooManyRequests()
+
+    class Client:
+        files = Files()
+
+    budget = RequestBudget(RateLimits(requests_per_second=None))
+    client = RateLimitedClient(Client(), budget, "session")
+    for call in (client.files.upload, lambda: asyncio.run(client.files.upload_async())):
+        try:
+            call()
+        except TooManyRequests:
+            pass
+    utilization = budget.utilization()
+    assert utilization["throttled"] == 2
+    assert utilization["in_flight"]["upload"] == 0
@@ -0,0 +1,111 @@
+"""
+Text layer fast path: pages of born-digital PDFs whose embedded text is complete enough are converted to markdown
+locally, so only scanned and image pages have to be OCRed. PyMuPDF is imported on first use.
+"""
+from collections import Counter
+from typing import TYPE_CHECKING
+
+from metrics import count, timer
+
+if TYPE_CHECKING:
+    import pymupdf
+
+# A page is converted locally when it has at least this many visible characters, at most this share of them could
+# not be mapped to Unicode (fonts without a ToUnicode map), and images cover at most this share of the page.
+# Scans with an invisible OCR layer fail the image check.
+MIN_TEXT_CHARS = 100
+MAX_UNMAPPED_CHAR_RATIO = 0.02
+MAX_IMAGE_COVERAGE = 0.1
+
+# Blocks set this much larger than the body text become headings, the largest ones level 1
+HEADING_SIZE_RATIOS = ((1.8, "#"), (1.4, "##"), (1.15, "###"))
+MAX_HEADING_CHARS = 200
+BULLETS = "•◦▪‣–-*"
+
+
+def text_blocks(page: "pymupdf.Page") -> list:
+    # Visible text blocks in reading order, hyphenated line breaks joined
+    import pymupdf
+
+    flags = pymupdf.TEXTFLAGS_TEXT | pymupdf.TEXT_DEHYPHENATE
+    blocks = page.get_text("dict", sort=True, flags=flags)["blocks"]
+    for block in blocks:
+        for line in block["lines"]:
+            line["spans"] = [span for span in line["spans"] if span.get("alpha", 255) and span["text"].strip()]
+    return [block for block in blocks if block["type"] == 0 and any(line["spans"] for line in block["lines"])]
+
+
+def image_coverage(page: "pymupdf.Page") -> float:
+    # Share of the page area covered by images, overlapping images are not merged
+    page_area = abs(page.rect) or 1
+    covered = sum(abs(page.rect & image["bbox"]) for image in page.get_image_info())
+    return min(covered / page_area, 1.0)
+
+
+def is_list_item(line: str) -> bool:
+    return line[:1] in BULLETS and line[1:2] in ("", " ", "\t")
+
+
+def has_text_layer(page: "pymupdf.Page", blocks: list) -> bool:
+    text = "".join(span["text"] for block in blocks for line in block["lines"] for span in line["spans"])
+    chars = [char for char in text if not char.isspace()]
+    if len(chars) < MIN_TEXT_CHARS:
+        return False
+    unmapped = sum(char == "\ufffd" or "\ue000" <= char <= "\uf8ff" for char in chars)
+    return unmapped / len(chars) <= MAX_UNMAPPED_CHAR_RATIO and image_coverage(page) <= MAX_IMAGE_COVERAGE
+
+
+def blocks_markdown(blocks: list) -> str:
+    """
+    Markdown of the text blocks: one paragraph per block, headings from font sizes relative to the body text (the
+    size most characters are set in) and list items from leading bullets.
+    """
+    sizes = Counter()
+    for block in blocks:
+        for line in block["lines"]:
+            for span in line["spans"]:
+                sizes[round(span["size"])] += len(span["text"])
+    body_size = sizes.most_common(1)[0][0]
+
+    paragraphs = []
+    for block in blocks:
+        lines = ["".join(span["text"] for span in line["spans"]).strip() for line in block["lines"] if line["spans"]]
+        size = max(span["size"] for line in block["lines"] for span in line["spans"])
+        text = " ".join(lines)
+        heading = next((marker for ratio, marker in HEADING_SIZE_RATIOS if size >= body_size * ratio), None)
+        if heading is not None and len(text) <= MAX_HEADING_CHARS:
+            paragraphs.append(f"{heading} {text}")
+        elif is_list_item(lines[0]):
+            # A bulleted block keeps one item per bulleted line, continuation lines are joined to their item
+            items = []
+            for line in lines:
+                if is_list_item(line):
+                    items.append(f"- {line[1:].strip()}")
+                else:
+                    items[-1] += f" {line}"
+            paragraphs.append("\n".join(items))
+        else:
+            paragraphs.append(text)
+    return "\n\n".join(paragraphs)
+
+
+def extract_text_pages(pdf_bytes: bytes, pages: list = None) -> dict:
+    """
+    Markdown of the given 0-based pages (every page when None) that have a usable text layer, see has_text_layer.
+    Returns a dict of page → markdown, empty for PDFs PyMuPDF cannot open, so they are OCRed as before.
+    """
+    import pymupdf
+
+    text_pages = {}
+    try:
+        document = pymupdf.open(stream=pdf_bytes, filetype="pdf")
+    except pymupdf.FileDataError:
+        return text_pages
+    with document, timer("text_layer", pages=document.page_count if pages is None else len(pages)):
+        for page_number in range(document.page_count) if pages is None else pages:
+            page = document[page_number]
+            blocks = text_blocks(page)
+            if has_text_layer(page, blocks):
+                text_pages[page_number] = blocks_markdown(blocks)
+    count("text_layer_pages", len(text_pages))
+    return text_pages
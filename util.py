@@ -1,15 +1,26 @@
 import streamlit as st
-from mistralai import Mistral
-from mistralai import DocumentURLChunk, ImageURLChunk, TextChunk
-from mistralai.models import OCRResponse
-from markdown_pdf import MarkdownPdf, Section
-from pdf2image import convert_from_bytes
-from PIL import Image
-import base64
-import io
-import json
-import time
-import pandas as pd
+from datetime import datetime
+import os
+import tempfile
+import uuid
+from ocr_pipeline import *
+from export import bundle_names, export_document, inline_markdown, write_zip, zip_bytes
+from job_tracker import ACTIVE_JOB_STATUSES, get_job_tracker
+from pdf_renderer import get_pdf_renderer
+from metrics import collect_metrics, new_run_metrics, process_metrics, use_metrics
+from rate_limiter import get_request_budget, use_session
+
+# Seconds between redraws of the batch job progress bar
+PROGRESS_REFRESH_INTERVAL = 2
+
+# Seconds between checks whether a PDF requested for download has been rendered
+PDF_REFRESH_INTERVAL = 1
+
+# Seconds between redraws of the request budget utilization on the Configuration page
+BUDGET_REFRESH_INTERVAL = 2
+
+# Choices of how many OCR pages the single document view shows at once
+PAGES_PER_VIEW_OPTIONS = [1, 5, 10]
 
 # Function for selecting LLM Model
 def check_api_key_status():
@@ -22,216 +33,392 @@ def check_api_key_status():
 
     return api_key_status, st.session_state.mistral_api_key
 
-def replace_images_in_markdown(markdown_str: str, images_dict: dict) -> str:
-    for img_name, base64_str in images_dict.items():
-        markdown_str = markdown_str.replace(f"![{img_name}]({img_name})", f"![{img_name}]({base64_str})")
-    return markdown_str
-
-def get_combined_markdown(ocr_response: OCRResponse) -> str:
-  markdowns: list[str] = []
-  for page in ocr_response.pages:
-    image_data = {}
-    for img in page.images:
-      image_data[img.id] = img.image_base64
-    markdowns.append(replace_images_in_markdown(page.markdown, image_data))
-
-  return "\n\n".join(markdowns)
-
-def convert_md_to_pdf(md_contents):
-    # Generate PDF from markdown content
-    pdf = MarkdownPdf(toc_level=2, optimize=True)
-    pdf.add_section(Section(md_contents))
-
-    # Save PDF to bytes buffer
-    pdf_buffer = io.BytesIO()
-    pdf.save(pdf_buffer)
-    pdf_bytes = pdf_buffer.getvalue()
-
-    return pdf_bytes
-
+def start_run_metrics():
+    # Time the OCR run that is about to start separately from earlier runs of the session
+    st.session_state.run_metrics = new_run_metrics()
+    use_metrics(st.session_state.run_metrics)
 
-# Function to perform OCR using Mistral model
-def mistral_ocr(uploaded_pdf, api_key):
+def count_finished_jobs(manifest: dict) -> int:
+    return sum(job["status"] not in ACTIVE_JOB_STATUSES for job in manifest["jobs"].values())
 
-    client = Mistral(api_key=api_key)
-
-    uploaded_file = client.files.upload(
-        file={
-            "file_name": uploaded_pdf.name,
-            "content": uploaded_pdf.getvalue(),
-        },
-        purpose="ocr",
-    )
-    signed_url = client.files.get_signed_url(file_id=uploaded_file.id, expiry=1)
-    pdf_response = client.ocr.process(document=DocumentURLChunk(document_url=signed_url.url),
-                                      model="mistral-ocr-latest", include_image_base64=True)
-
-    return get_combined_markdown(pdf_response)
-
-def encode_image_to_base64(image: Image.Image) -> str:
-    buffer = io.BytesIO()
-    image.save(buffer, format="JPEG")
-    base64_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
-    return f"data:image/jpeg;base64,{base64_image}"
-
-def convert_pdf_to_base64_images(pdf_bytes: bytes) -> list:
-    images = convert_from_bytes(pdf_bytes)
-    base64_images = [encode_image_to_base64(img) for img in images]
-    return base64_images
-
-def create_jsonl_batch_file(pdfs: list):
+@st.fragment(run_every=PROGRESS_REFRESH_INTERVAL)
+def display_ocr_progress(job_id: str, finished_jobs: int = 0):
     """
-    pdfs: list of tuples → [(file_name, file_bytes), ...]
+    Redrawn periodically from the tracked manifest. The whole app reruns once the submission has finished, or when
+    another of its batch jobs (finished_jobs when the app last ran) finishes so its documents can be downloaded.
     """
-    output_path = "ocr_batch_input.jsonl"
-    with open(output_path, "w") as f:
-        idx = 0
-        for pdf_name, pdf_bytes in pdfs:
-            base64_images = convert_pdf_to_base64_images(pdf_bytes)
-            for image_str in base64_images:
-                entry = {
-                    "custom_id": f"{pdf_name}_page_{idx}",
-                    "body": {
-                        "document": {
-                            "type": "image_url",
-                            "image_url": image_str
-                        },
-                        "include_image_base64": True
-                    }
-                }
-                f.write(json.dumps(entry) + "\n")
-                idx += 1
-
-def create_jsonl_batch(pdfs: list) -> str:
+    manifest = get_job_tracker().load(job_id)
+    if manifest["status"] not in ACTIVE_JOB_STATUSES or count_finished_jobs(manifest) != finished_jobs:
+        st.rerun()
+
+    done = manifest["succeeded_requests"] + manifest["failed_requests"]
+    percent_done = round(done / manifest["total_requests"], 4) if manifest["total_requests"] else 0.0
+    eta = format_duration(manifest["eta"]) if manifest["eta"] is not None else 'estimating ...'
+    st.progress(percent_done, text=f'OCR {manifest["status"].lower()}: {done}/{manifest["total_requests"]} '
+                                   f'requests done, ETA {eta}')
+
+    # Progress of every shard when the submission was split into several batch jobs
+    if len(manifest["jobs"]) > 1:
+        st.caption(' · '.join(f'Job {i + 1}: {job["status"].lower()} '
+                              f'{job["succeeded_requests"] + job["failed_requests"]}/{job["total_requests"]}'
+                              for i, job in enumerate(manifest["jobs"].values())))
+
+@st.fragment(run_every=PDF_REFRESH_INTERVAL)
+def display_pdf_rendering(pdf_key: str, key: str):
+    # Only shown while the PDF is being rendered, reruns the app once it is done to offer the download
+    if not get_pdf_renderer().pending(pdf_key):
+        st.rerun()
+    st.button("Rendering PDF ...", key=key, disabled=True, icon=':material/hourglass_top:')
+
+@st.fragment
+def display_pdf_download(source_id: str, load_markdown, file_name: str, key: str, root: str = "."):
     """
-    pdfs: list of tuples → [(file_name, file_bytes), ...]
-    Returns a JSONL string.
+    PDF download that is only rendered once asked for, on a background thread. load_markdown is called on request,
+    and the rendered PDF is remembered per source_id for the session. Relative image links resolve from root.
     """
-    output_lines = []
-    idx = 0
-    for pdf_name, pdf_bytes in pdfs:
-        base64_images = convert_pdf_to_base64_images(pdf_bytes)
-        for image_str in base64_images:
-            entry = {
-                "custom_id": f"{pdf_name}_page_{idx}",
-                "body": {
-                    "document": {
-                        "type": "image_url",
-                        "image_url": image_str
-                    },
-                    "include_image_base64": True
-                }
-            }
-            output_lines.append(json.dumps(entry) + "\n")
-            idx += 1
-
-    output_jsonl = "\n".join(output_lines)
-    return output_jsonl
-
-def mistral_ocr_batch(uploaded_pdfs, api_key):
-    client = Mistral(api_key=api_key)
-
-    pdf_contents = []
-    for pdf in uploaded_pdfs:
-        pdf_contents.append((pdf.name, pdf.getvalue()))
-
-    with st.spinner('Processing ...'):
-        # Create the batch file
-        output_jsonl = create_jsonl_batch(pdf_contents)
-
-        # Upload the batch file to the API
-        batch_data = client.files.upload(
-            file={
-                "file_name": "batch_file.jsonl",
-                "content": output_jsonl},
-            purpose="batch"
-        )
-
-        # Create a Batch Job
-        created_job = client.batch.jobs.create(
-            input_files=[batch_data.id],
-            model='mistral-ocr-latest',
-            endpoint="/v1/ocr",
-            metadata={"job_type": "insuragi_ocr"}
-        )
-
-        # Retrieve the job information
-        retrieved_job = client.batch.jobs.get(job_id=created_job.id)
-
-        # Display OCR progress
-        retrieved_job = display_ocr_progress(client, retrieved_job, created_job)
-
-    st.session_state.retrieved_job = retrieved_job
-
-def display_ocr_progress(client, retrieved_job, created_job):
-    # Display OCR progress
-    ocr_bar = st.progress(0, text='OCR in progress. Please wait.')
-
-    while retrieved_job.status in ["QUEUED", "RUNNING"]:
-        retrieved_job = client.batch.jobs.get(job_id=created_job.id)
-        percent_done = round(
-            (retrieved_job.succeeded_requests + retrieved_job.failed_requests) / retrieved_job.total_requests, 4)
-        ocr_bar.progress(percent_done, text='OCR in progress...')
-        time.sleep(1)
-
-    ocr_bar.empty()
-
-    return retrieved_job
-
-def display_ocr_statistics(retrieved_job, uploaded_pdfs):
+    if "pdf_renders" not in st.session_state:
+        st.session_state.pdf_renders = {}
+
+    def request_pdf():
+        # Callbacks and fragment reruns do not run the page script, which activates the run metrics
+        with collect_metrics(st.session_state.run_metrics):
+            st.session_state.pdf_renders[source_id] = get_pdf_renderer().submit(load_markdown(), root)
+
+    pdf_key = st.session_state.pdf_renders.get(source_id)
+    if pdf_key is None:
+        st.button("Render PDF", type='primary', key=key, icon=':material/picture_as_pdf:',
+                  help='Convert the Markdown to PDF for download', on_click=request_pdf)
+        return
+
+    try:
+        pdf_data = get_pdf_renderer().result(pdf_key)
+    except KeyError:
+        # Evicted from the renderer cache, render it again
+        request_pdf()
+        pdf_data = None
+    except Exception as e:
+        del st.session_state.pdf_renders[source_id]
+        st.error(f'PDF conversion failed: {e}', icon=':material/error:')
+        return
+
+    if pdf_data is None:
+        display_pdf_rendering(pdf_key, key)
+        return
+
+    st.download_button("Download PDF", data=pdf_data, file_name=file_name, mime="application/pdf", key=key,
+                       type='primary', icon=':material/picture_as_pdf:', help='Download in PDF Format',
+                       on_click="ignore")
+
+def display_page_selection(uploaded_pdfs, key: str) -> tuple:
+    """
+    Per document page ranges and blank page skipping, so only the pages needed are OCRed and billed.
+    Returns (0-based pages per PDF, None for every page; whether blank pages are skipped), or (None, skip_blank) when
+    a page range is invalid.
+    """
+    with st.expander('Page Selection', icon=':material/filter_list:'):
+        # Keyed by the uploads, so the ranges entered for other PDFs are not carried over
+        edited = st.data_editor({'PDF': [pdf.name for pdf in uploaded_pdfs], 'Pages': [''] * len(uploaded_pdfs)},
+                                key=f'{key}_{"|".join(pdf.file_id for pdf in uploaded_pdfs)}', hide_index=True,
+                                disabled=['PDF'],
+                                column_config={'Pages': st.column_config.TextColumn(
+                                    'Pages', help='e.g. 1-3, 7, 10- (empty for every page)')})
+        skip_blank = st.checkbox('Skip blank pages', key=f'{key}_skip_blank',
+                                 help='Leave out pages without any content, detected from a low resolution render.')
+
+    page_selections = []
+    for pdf, spec in zip(uploaded_pdfs, edited['Pages']):
+        try:
+            page_selections.append(parse_page_ranges(spec, pdf_page_count(pdf.getvalue())) if spec else None)
+        except ValueError as e:
+            st.error(f'{pdf.name}: {e}', icon=':material/error:')
+            return None, skip_blank
+    return page_selections, skip_blank
+
+def display_ocr_pages(pages: list, key: str):
+    """
+    Paginated OCR result. Only the pages in view are sent to the browser, each with just its own images inlined, so
+    large documents with many images stay responsive.
+    """
+    if not pages:
+        st.info('No pages were OCRed, every selected page is blank.', icon=':material/info:')
+        return
+
+    col1, col2 = st.columns([3, 1], vertical_alignment="bottom")
+    pages_per_view = col2.selectbox('Pages per view:', PAGES_PER_VIEW_OPTIONS, key=f'{key}_pages_per_view')
+    view_count = -(-len(pages) // pages_per_view)
+    view = 1
+    if view_count > 1:
+        # Keyed by the page size, so switching it starts again from the first view instead of an invalid one
+        view = col1.number_input(f'View (of {view_count}):', min_value=1, max_value=view_count,
+                                 key=f'{key}_view_{pages_per_view}')
+
+    first_page = (view - 1) * pages_per_view
+    container = st.container(height=1000, key=f'{key}-container')
+    for number, page in enumerate(pages[first_page:first_page + pages_per_view], start=first_page + 1):
+        # The page number in the PDF, which differs from the position when only some pages were OCRed
+        container.caption(f'Page {page.get("index", number - 1) + 1} · {number} of {len(pages)}')
+        container.markdown(page_markdown(page), unsafe_allow_html=True)
+
+def read_text_file(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+def display_job_reattach(api_key):
+    # Reattach this session to a batch job submitted earlier with its API key, e.g. from a tab that has been closed
+    # since. Jobs of other keys are not listed, the server is shared by every visitor
+    tracked_jobs = get_job_tracker().list_jobs(api_key)
+    if not tracked_jobs:
+        return
+
+    with st.expander('Batch Jobs', icon=':material/history:'):
+        labels = {manifest["job_id"]: f'{datetime.fromtimestamp(manifest["created_at"]):%Y-%m-%d %H:%M} · '
+                                      f'{manifest["status"]} · {", ".join(manifest["pdf_names"])}'
+                  for manifest in tracked_jobs}
+        job_id = st.selectbox('Batch Job:', list(labels), format_func=labels.get)
+        if st.button('Reattach', icon=':material/link:'):
+            st.session_state.batch_manifest = poll(job_id, api_key)
+
+def display_ocr_statistics(manifest: dict):
     st.subheader('OCR Statistics:', divider='gray')
+
     # Display statistics
+    # Pages billed: the pages of every submitted record, including re-submitted ones
+    submitted_pages = manifest.get("submitted_pages", manifest["total_requests"])
+
     col1, col2, col3 = st.columns(3)
-    col1.metric('Status', f'{retrieved_job.status}', border=True)
-    col2.metric('PDF(s) Processed', f'{len(uploaded_pdfs)}', border=True)
-    col3.metric('Total Number of Pages OCRed', f'{retrieved_job.total_requests}', border=True)
+    jobs = f' ({len(manifest["jobs"])} jobs)' if len(manifest["jobs"]) > 1 else ''
+    col1.metric('Status', f'{manifest["status"]}{jobs}', border=True)
+    col2.metric('PDF(s) Processed', f'{len(manifest["pdf_names"])}', border=True)
+    col3.metric('Total Number of Pages Submitted', f'{submitted_pages}', border=True)
+
+    # Pages converted locally from their text layer instead of being OCRed
+    text_layer_pages = sum(len(pages) for pages in manifest.get("text_pages", {}).values())
+
+    col4, col5, col6, col7 = st.columns(4)
+    col4.metric('Requests OCRed Successfully', f'{manifest["succeeded_requests"]}', border=True)
+    col5.metric('Requests Unable to OCRed', f'{manifest["failed_requests"]}', border=True)
+    col6.metric('Pages from Text Layer', f'{text_layer_pages}', border=True)
+    col7.metric('Total Cost', f'${submitted_pages / 1000}', border=True)
+
+    # Pages left out of the batch because they were duplicates or cached from an earlier submission, and pages
+    # outside the page selection or blank
+    pages_saved = PageDeduplicator.from_dict(OCR_MODEL, manifest["dedup"]).pages_saved
+    pages_skipped = sum(len(pages) for pages in manifest.get("skipped_pages", {}).values())
+
+    col8, col9, col10, col11 = st.columns(4)
+    col8.metric('PDF(s) Served from Cache', f'{len(manifest["cached_documents"])}', border=True)
+    col9.metric('Duplicate/Cached Pages Skipped', f'{pages_saved}', border=True)
+    col10.metric('Unselected/Blank Pages Skipped', f'{pages_skipped}', border=True)
+    col11.metric('Cost Saved', f'${(pages_saved + pages_skipped + text_layer_pages) / 1000}', border=True)
+
+def load_batch_results(manifest: dict) -> dict:
+    """
+    Markdown file paths of the documents whose batch jobs have finished, collected again only once more jobs of the
+    submission have finished. Only the paths are kept in the session.
+    """
+    results_key = (manifest["job_id"] or manifest["output_dir"], len(manifest["jobs"]), count_finished_jobs(manifest))
+    if "batch_results" not in st.session_state:
+        st.session_state.batch_results = {}
+
+    if results_key not in st.session_state.batch_results:
+        with st.spinner('Downloading ...'):
+            st.session_state.batch_results[results_key] = collect(manifest, st.session_state.mistral_api_key)
+
+    return st.session_state.batch_results[results_key]
+
+def display_bundle_downloads(name: str, markdown_path: str, key: str, md_column, zip_column):
+    # The markdown with its images inlined, and the document bundle as a zip archive, both built on request
+    md_column.download_button(
+        label="Download MD",
+        type='primary',
+        data=lambda: inline_markdown(markdown_path),
+        file_name=f"{name}.md",
+        mime="text/markdown",
+        key=f"download_btn_{key}",
+        icon=":material/markdown:",
+        on_click="ignore"
+    )
+    zip_column.download_button(
+        label="Download ZIP",
+        data=lambda: zip_bytes([(name, os.path.dirname(markdown_path))]),
+        file_name=f"{name}.zip",
+        mime="application/zip",
+        key=f"zip_btn_{key}",
+        icon=":material/folder_zip:",
+        help="Markdown with relative links to the image files, the images and a JSON of the pages",
+        on_click="ignore"
+    )
 
-    col4, col5, col6 = st.columns(3)
-    col4.metric('Pages OCRed Successfully', f'{retrieved_job.succeeded_requests}', border=True)
-    col5.metric('Pages Unable to OCRed', f'{retrieved_job.failed_requests}', border=True)
-    col6.metric('Total Cost', f'${retrieved_job.total_requests / 1000}', border=True)
+def display_archive_download(bundles: list, archive_path: str, key: str):
+    # One zip archive of every document bundle, streamed to disk when it is requested
+    def load_archive():
+        with open(write_zip(bundles, archive_path), "rb") as f:
+            return f.read()
 
-def download_markdown_files(client, retrieved_job, uploaded_pdfs):
+    st.download_button("Download All (ZIP)", data=load_archive, file_name="ocr_results.zip", mime="application/zip",
+                       key=key, type='primary', icon=':material/folder_zip:', on_click="ignore",
+                       help='Markdown, image files and JSON of every document, one folder per document')
 
-    response = client.files.download(file_id=retrieved_job.output_file)
+def document_zip(pages: list, name: str, **metadata) -> bytes:
+    # Zip archive of the bundle of a document held in memory as OCR page dicts
+    with tempfile.TemporaryDirectory() as bundle_dir:
+        export_document(pages, bundle_dir, **metadata)
+        return zip_bytes([(name, bundle_dir)])
 
-    file_content = response.read()
-    decoded_string = file_content.decode('utf-8')
-    lines = decoded_string.strip().split('\n')
-    parsed_objects = [json.loads(line) for line in lines]
+def display_download_table(manifest: dict):
+    st.subheader('Download Markdown File(s):', divider='gray')
 
-    file_names = [pdf.name.split('.')[0] for pdf in uploaded_pdfs]
-    st.session_state.markdown_mistral = {file_name: [] for file_name in file_names}
+    markdown_files = load_batch_results(manifest)
+    names = bundle_names(manifest["pdf_names"])
+
+    for i, pdf_name in enumerate(manifest["pdf_names"]):
+        col1, col2, col3, col4 = st.columns([3, 1, 1, 1], border=True)
+        col1.write(document_file_name(pdf_name))
+        markdown_path = markdown_files.get(document_id(i))
+        if markdown_path is None:
+            # Still waiting for a batch job of the document
+            col2.button("Pending", key=f"download_btn_{i}", disabled=True, icon=":material/hourglass_top:")
+            continue
+        display_bundle_downloads(names[i], markdown_path, str(i), col2, col3)
+        with col4:
+            # The path is unique per submission, so it identifies the rendered PDF
+            display_pdf_download(markdown_path, lambda path=markdown_path: read_text_file(path),
+                                 f'{os.path.splitext(document_file_name(pdf_name))[0]}.pdf', f"pdf_btn_{i}",
+                                 root=os.path.dirname(markdown_path))
+
+    if len(markdown_files) == len(manifest["pdf_names"]):
+        display_archive_download([(names[i], os.path.dirname(markdown_files[document_id(i)]))
+                                  for i in range(len(names))],
+                                 os.path.join(manifest["output_dir"], "ocr_results.zip"), "batch_zip_btn")
+
+def display_failed_pages(manifest: dict, uploaded_pdfs, api_key):
+    # Pages without a result, with a one-click re-submission of only those pages
+    failed_pages = load_failed_pages(manifest)
+    if not failed_pages:
+        return
+
+    st.subheader('Failed Pages:', divider='gray')
+    page_count = sum(len(pages) for pages in failed_pages.values())
+    st.warning(f'{page_count} page(s) of {len(failed_pages)} PDF(s) could not be OCRed. They are missing from the '
+               f'downloaded Markdown.', icon=':material/warning:')
+    with st.expander('Details', icon=':material/error:'):
+        st.dataframe([{'PDF': manifest["pdf_names"][document_position(doc_id)], 'Page': page + 1, 'Error': error}
+                      for doc_id, pages in failed_pages.items() for page, error in pages], hide_index=True)
+
+    if manifest["job_id"] is None:
+        return
+    retry_policy = st.session_state.retry_policy
+    resubmissions = manifest.get("resubmissions", 0)
+    pdfs_match = bool(uploaded_pdfs) and [pdf.name for pdf in uploaded_pdfs] == manifest["pdf_names"]
+    if not pdfs_match:
+        st.info('Upload the same PDF(s) to re-submit the failed pages.', icon=':material/info:')
+
+    col1, col2 = st.columns([2, 1], vertical_alignment="bottom")
+    retry_mode = col1.radio('Re-submit via:', ['Batch Inference', 'Concurrent Inference'], horizontal=True,
+                            help='Batch inference costs half, concurrent inference returns the pages right away.')
+    retry = col2.button(f'Retry Failed Pages ({resubmissions}/{retry_policy.max_resubmissions})', type='primary',
+                        icon=':material/refresh:', disabled=not pdfs_match or
+                                                          resubmissions >= retry_policy.max_resubmissions)
+    if retry:
+        with st.spinner('Re-submitting ...'):
+            st.session_state.batch_manifest = resubmit_failed_pages(
+                manifest, uploaded_pdfs, api_key, retry_mode == 'Concurrent Inference',
+                st.session_state.render_profile, retry_policy, st.session_state.max_concurrent_requests)
+        st.rerun()
+
+def display_concurrent_ocr(uploaded_pdfs, api_key, max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+                           retry_policy: RetryPolicy = RetryPolicy(), page_selections: list = None,
+                           skip_blank: bool = False, use_text_layer: bool = False):
+    # Run concurrent OCR and add a download row for each document as soon as it finishes
+    st.subheader('Download Markdown File(s):', divider='gray')
+    ocr_bar = st.progress(0, text='OCR in progress. Please wait.')
 
-    for obj in parsed_objects:
-        file_name = obj['custom_id'].split('.')[0]
-        if file_name in file_names:
-            st.session_state.markdown_mistral[file_name].append(obj['response']['body']['pages'][0]['markdown'])
+    # Every document is exported as a bundle on disk, only the paths are kept in the session
+    st.session_state.concurrent_results = {}
+    st.session_state.concurrent_output_dir = os.path.join(BATCH_OUTPUTS_DIR, uuid.uuid4().hex)
+    results = mistral_ocr_concurrent_pages(uploaded_pdfs, api_key, max_concurrency, retry_policy, page_selections,
+                                           skip_blank, use_text_layer)
+    for i, (position, result) in enumerate(results):
+        pdf = uploaded_pdfs[position]
+        if not isinstance(result, Exception):
+            bundle_dir = os.path.join(st.session_state.concurrent_output_dir, document_id(position))
+            result = export_document(result, bundle_dir, pdf_name=pdf.name, model=OCR_MODEL,
+                                     page_count=pdf_page_count(pdf.getvalue()))
+        st.session_state.concurrent_results[pdf.name] = result
+        display_concurrent_result(pdf.name, result, i)
+        ocr_bar.progress((i + 1) / len(uploaded_pdfs), text='OCR in progress...')
 
-def display_download_table(uploaded_pdfs):
-    st.subheader('Download Markdown File(s):', divider='gray')
+    ocr_bar.empty()
+    display_concurrent_archive()
 
-    client = Mistral(api_key=st.session_state.mistral_api_key)
-
-    with st.spinner('Downloading ...'):
-        # Download Markdown Files
-        download_markdown_files(client, st.session_state.retrieved_job, uploaded_pdfs)
-
-    file_names = [pdf.name.split('.')[0] for pdf in uploaded_pdfs]
-
-    for i in range(len(file_names)):
-        col1, col2 = st.columns([3, 1], border=True)
-        col1.write(f'{file_names[i]}.md')
-        col2.download_button(
-            label="Download MD",
-            type='primary',
-            data=st.session_state.markdown_mistral[file_names[i]][0],
-            file_name=f'{file_names[i]}.md',
-            mime="text/markdown",
-            key=f"download_btn_{i}",
-            icon=":material/markdown:",
-            on_click="ignore"
-        )
+def display_concurrent_results():
+    # Redraw the results of the last concurrent OCR run
+    st.subheader('Download Markdown File(s):', divider='gray')
+    for i, (pdf_name, result) in enumerate(st.session_state.concurrent_results.items()):
+        display_concurrent_result(pdf_name, result, i)
+    display_concurrent_archive()
+
+def display_concurrent_result(pdf_name, result, i):
+    # result: markdown path of the document's bundle, or the exception its OCR raised
+    col1, col2, col3 = st.columns([3, 1, 1], border=True)
+    col1.write(document_file_name(pdf_name))
+    if isinstance(result, Exception):
+        col2.error('OCR failed', icon=':material/error:', help=str(result))
+        return
+    display_bundle_downloads(os.path.splitext(pdf_name)[0], result, str(i), col2, col3)
+
+def display_concurrent_archive():
+    # Zip archive of the documents that were OCRed successfully
+    bundles = {pdf_name: os.path.dirname(result) for pdf_name, result in st.session_state.concurrent_results.items()
+               if not isinstance(result, Exception)}
+    if bundles:
+        display_archive_download(list(zip(bundle_names(list(bundles)), bundles.values())),
+                                 os.path.join(st.session_state.concurrent_output_dir, "ocr_results.zip"),
+                                 "concurrent_zip_btn")
+
+def display_performance_panel():
+    # Per-stage timings and counters of the last OCR run, exportable for offline analysis
+    run_metrics = st.session_state.run_metrics
+    with st.expander('Performance', expanded=False, icon=':material/speed:'):
+        rows = run_metrics.stage_rows()
+        if not rows:
+            st.caption('Timings appear here once OCR has run.')
+            return
+        st.dataframe(rows, hide_index=True)
+
+        counters = run_metrics.snapshot()["counters"]
+        if counters:
+            columns = st.columns(len(counters))
+            for column, (counter, value) in zip(columns, sorted(counters.items())):
+                column.metric(counter.replace('_', ' ').capitalize(), f'{value:,}', border=True)
+
+        left, right = st.columns(2)
+        left.download_button('Download JSON', data=run_metrics.to_json(), file_name='ocr_metrics.json',
+                             mime='application/json', icon=':material/data_object:', on_click="ignore",
+                             help='Timings and counters of the last run')
+        right.download_button('Download Prometheus', data=process_metrics.to_prometheus(),
+                              file_name='ocr_metrics.prom', mime='text/plain', icon=':material/monitoring:',
+                              on_click="ignore", help='Totals of every run since the app started, in the Prometheus '
+                                                      'text format')
+
+@st.fragment(run_every=BUDGET_REFRESH_INTERVAL)
+def display_request_budget(api_key: str):
+    # Live utilization of the request budget shared by every session using the API key
+    usage = get_request_budget(api_key).utilization()
+    limits = usage["limits"]
+    rate_limit = f' of {limits.requests_per_second:g}' if limits.requests_per_second is not None else ''
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric('Requests / s', f'{usage["requests_per_second"]:.1f}{rate_limit}', border=True,
+                help='API calls admitted per second over the last few seconds')
+    col2.metric('Uploads', f'{usage["in_flight"]["upload"]} of {limits.max_concurrent_uploads}', border=True,
+                help='File uploads in flight')
+    col3.metric('Job Polls', f'{usage["in_flight"]["poll"]} of {limits.max_concurrent_polls}', border=True,
+                help='Batch job status requests in flight')
+    col4.metric('Waiting Calls', f'{usage["waiting"]:,}', border=True,
+                help=f'Calls waiting for their turn, from {usage["waiting_sessions"]} session(s)')
+    col5.metric('Rate Limited', f'{usage["throttled"]:,}', border=True,
+                help='Calls the API rejected with 429 Too Many Requests')
+    st.caption(f'{usage["admitted"]:,} calls admitted so far, after waiting {usage["mean_wait"]:.2f} s on average.')
 
 def display_footer():
     footer = """
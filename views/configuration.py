@@ -1,5 +1,36 @@
 import streamlit as st
-from util import display_footer
+import os
+from util import (display_footer, display_request_budget, RenderProfile, RENDER_PROFILES, MAX_CONCURRENT_REQUESTS,
+                  MAX_SHARD_RECORDS, MAX_SHARD_BYTES, RetryPolicy)
+from ocr_cache import get_ocr_cache
+from rate_limiter import RateLimits, get_request_budget
+
+if "rasterize_workers" not in st.session_state:
+    st.session_state.rasterize_workers = os.cpu_count()
+
+if "submit_pdfs" not in st.session_state:
+    st.session_state.submit_pdfs = True
+
+if "perceptual_dedup" not in st.session_state:
+    st.session_state.perceptual_dedup = False
+
+if "max_concurrent_requests" not in st.session_state:
+    st.session_state.max_concurrent_requests = MAX_CONCURRENT_REQUESTS
+
+if "render_profile" not in st.session_state:
+    st.session_state.render_profile = RenderProfile()
+
+if "retry_policy" not in st.session_state:
+    st.session_state.retry_policy = RetryPolicy()
+
+if "max_shard_records" not in st.session_state:
+    st.session_state.max_shard_records = MAX_SHARD_RECORDS
+
+if "max_shard_mb" not in st.session_state:
+    st.session_state.max_shard_mb = MAX_SHARD_BYTES // (1024 * 1024)
+
+if "use_text_layer" not in st.session_state:
+    st.session_state.use_text_layer = False
 
 st.title("Configuration")
 
@@ -16,5 +47,140 @@ with st.form('Mistral API Key Configuration'):
         st.session_state.mistral_api_key = api_key
         st.success('API has been configured successfully', icon=":material/check_circle:")
 
+# Concurrent inference configuration
+st.subheader('Concurrent Inference:', divider='gray')
+st.session_state.max_concurrent_requests = st.number_input("Concurrent Requests:", min_value=1, max_value=32,
+                                                           value=st.session_state.max_concurrent_requests,
+                                                           help='Maximum number of documents OCRed at the same time '
+                                                                'when concurrent inference is enabled.')
+
+# Request budget shared by every session using the same API key
+st.subheader('API Rate Limits:', divider='gray')
+if st.session_state.mistral_api_key:
+    budget = get_request_budget(st.session_state.mistral_api_key)
+    col1, col2, col3, col4 = st.columns(4)
+    requests_per_second = col1.number_input("Requests per Second (0 = unlimited):", min_value=0.0, max_value=1000.0,
+                                            step=1.0, value=float(budget.limits.requests_per_second or 0),
+                                            help='Rate of API calls made with this API key, shared by every session '
+                                                 'using it. Waiting calls take turns between sessions.')
+    burst = col2.number_input("Burst:", min_value=1, max_value=1000, value=budget.limits.burst,
+                              help='Calls that can be made at once after a quiet period.')
+    max_concurrent_uploads = col3.number_input("Concurrent Uploads:", min_value=1, max_value=64,
+                                               value=budget.limits.max_concurrent_uploads,
+                                               help='File uploads in flight at once, across all sessions.')
+    max_concurrent_polls = col4.number_input("Concurrent Job Polls:", min_value=1, max_value=64,
+                                             value=budget.limits.max_concurrent_polls,
+                                             help='Batch job status requests in flight at once, across all sessions.')
+    budget.configure(RateLimits(requests_per_second=requests_per_second or None, burst=burst,
+                                max_concurrent_uploads=max_concurrent_uploads,
+                                max_concurrent_polls=max_concurrent_polls))
+    display_request_budget(st.session_state.mistral_api_key)
+else:
+    st.caption('The request budget of the API key is shown here once it is configured.')
+
+# Born-digital pages are converted locally instead of being OCRed
+st.subheader('Text Layer:', divider='gray')
+st.session_state.use_text_layer = st.toggle("Use Embedded Text Layer", value=st.session_state.use_text_layer,
+                                           help='Convert pages that already contain complete, extractable text to '
+                                                'Markdown locally, only scanned and image pages are OCRed. Applies '
+                                                'to batch and concurrent inference.')
+
+# Retry policy for failed requests and pages
+st.subheader('Retry Policy:', divider='gray')
+col1, col2, col3 = st.columns(3)
+max_attempts = col1.number_input("Max Attempts per Request:", min_value=1, max_value=20,
+                                 value=st.session_state.retry_policy.max_attempts,
+                                 help='Attempts of a rate limited or failed concurrent request before giving up.')
+base_delay = col2.number_input("Initial Retry Delay (s):", min_value=0.0, max_value=60.0, step=0.5,
+                               value=st.session_state.retry_policy.base_delay,
+                               help='Delay before the first retry, doubled after every further attempt.')
+max_resubmissions = col3.number_input("Max Re-submissions of Failed Pages:", min_value=0, max_value=10,
+                                      value=st.session_state.retry_policy.max_resubmissions,
+                                      help='How often the failed pages of a batch job can be re-submitted.')
+st.session_state.retry_policy = RetryPolicy(max_attempts=max_attempts, base_delay=base_delay,
+                                            max_resubmissions=max_resubmissions)
+
+# Batch preparation configuration
+st.subheader('Batch Preparation:', divider='gray')
+st.session_state.submit_pdfs = st.toggle("Submit PDFs Directly", value=st.session_state.submit_pdfs,
+                                        help='Upload each PDF once and OCR it as a document. Only PDFs over the '
+                                             'size or page limits of the OCR endpoint are converted to page images.')
+st.session_state.perceptual_dedup = st.toggle("Perceptual Page Deduplication",
+                                             value=st.session_state.perceptual_dedup,
+                                             help='Treat pages that look the same (e.g. a cover sheet exported by '
+                                                  'different tools) as duplicates, not only identical ones. Matches '
+                                                  'are confirmed pixel by pixel. Pages are only deduplicated when '
+                                                  'they are converted to images, i.e. with "Submit PDFs Directly" '
+                                                  'off or for PDFs over the endpoint limits. Directly submitted PDFs '
+                                                  'are only deduplicated as whole identical files.')
+st.session_state.rasterize_workers = st.number_input("Rasterization Workers:", min_value=1, max_value=64,
+                                                     value=st.session_state.rasterize_workers,
+                                                     help='Number of processes used to render and encode PDF pages '
+                                                          'before uploading a batch job. Set to 1 to render serially.')
+
+col1, col2 = st.columns(2)
+st.session_state.max_shard_records = col1.number_input("Max Requests per Batch Job:", min_value=1, max_value=1000000,
+                                                       value=st.session_state.max_shard_records,
+                                                       help='Larger batches are split into several jobs that run '
+                                                            'concurrently, documents are downloadable as soon as '
+                                                            'their jobs finish.')
+st.session_state.max_shard_mb = col2.number_input("Max Batch File Size (MB):", min_value=1, max_value=1024,
+                                                  value=st.session_state.max_shard_mb,
+                                                  help='Batch input files are split to stay below this size.')
+
+# Rendering profile used when rasterizing pages for batch uploads, "Custom" when it matches none of the presets
+PROFILE_FIELDS = {'dpi': 'render_dpi', 'max_dimension': 'render_max_dimension', 'jpeg_quality': 'render_jpeg_quality',
+                  'grayscale': 'render_grayscale', 'optimize': 'render_optimize', 'progressive': 'render_progressive'}
+
+
+def profile_name(profile: RenderProfile) -> str:
+    return next((name for name, preset in RENDER_PROFILES.items() if preset == profile), 'Custom')
+
+
+def show_profile(profile: RenderProfile):
+    # Widgets are seeded from the session's profile on every run, since their state is dropped on other pages
+    st.session_state.render_profile_name = profile_name(profile)
+    for field, key in PROFILE_FIELDS.items():
+        st.session_state[key] = getattr(profile, field)
+    st.session_state.render_max_dimension = profile.max_dimension or 0
+
+
+def select_preset():
+    if st.session_state.render_profile_name in RENDER_PROFILES:
+        st.session_state.render_profile = RENDER_PROFILES[st.session_state.render_profile_name]
+
+
+def edit_profile():
+    # Only an edit of one of the fields replaces the profile
+    values = {field: st.session_state[key] for field, key in PROFILE_FIELDS.items()}
+    st.session_state.render_profile = RenderProfile(**{**values, 'max_dimension': values['max_dimension'] or None})
+
+
+show_profile(st.session_state.render_profile)
+st.selectbox("Rendering Profile:", list(RENDER_PROFILES) + ['Custom'], key='render_profile_name',
+             on_change=select_preset,
+             help='Smaller profiles shrink the upload payload of plain text documents several-fold. '
+                  'Custom profiles are edited below.')
+
+with st.expander('Customize Rendering Profile', icon=':material/tune:'):
+    col1, col2 = st.columns(2)
+    col1.number_input("DPI:", min_value=50, max_value=600, key='render_dpi', on_change=edit_profile)
+    col2.number_input("Max Long Edge (px, 0 = unlimited):", min_value=0, max_value=10000,
+                      key='render_max_dimension', on_change=edit_profile)
+    st.slider("JPEG Quality:", min_value=10, max_value=95, key='render_jpeg_quality', on_change=edit_profile)
+    col3, col4, col5 = st.columns(3)
+    col3.checkbox("Grayscale", key='render_grayscale', on_change=edit_profile)
+    col4.checkbox("Optimize JPEG", key='render_optimize', on_change=edit_profile)
+    col5.checkbox("Progressive JPEG", key='render_progressive', on_change=edit_profile)
+
+# OCR result cache
+st.subheader('OCR Cache:', divider='gray')
+cache = get_ocr_cache()
+col1, col2 = st.columns([3, 1], vertical_alignment="center")
+col1.write(f'Cached OCR results: {cache.size() / (1024 * 1024):.1f} MB of {cache.max_size / (1024 * 1024):.0f} MB')
+if col2.button('Clear Cache', icon=':material/delete:'):
+    cache.clear()
+    st.rerun()
+
 # Display footer
 display_footer()
\ No newline at end of file
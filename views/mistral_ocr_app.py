@@ -1,4 +1,6 @@
 import streamlit as st
+import os
+import uuid
 from util import *
 from datetime import datetime
 from streamlit_pdf_viewer import pdf_viewer
@@ -6,11 +8,59 @@ from streamlit_pdf_viewer import pdf_viewer
 if "mistral_api_key" not in st.session_state:
     st.session_state.mistral_api_key = ''
 
-if "markdown_mistral" not in st.session_state:
-    st.session_state.markdown_mistral = None
+if "ocr_pages" not in st.session_state:
+    st.session_state.ocr_pages = None
 
-if "retrieved_job" not in st.session_state:
-    st.session_state.retrieved_job = None
+if "ocr_pdf_id" not in st.session_state:
+    st.session_state.ocr_pdf_id = None
+
+if "concurrent_results" not in st.session_state:
+    st.session_state.concurrent_results = None
+
+if "batch_manifest" not in st.session_state:
+    st.session_state.batch_manifest = None
+
+if "batch_results" not in st.session_state:
+    st.session_state.batch_results = {}
+
+if "rasterize_workers" not in st.session_state:
+    st.session_state.rasterize_workers = os.cpu_count()
+
+if "submit_pdfs" not in st.session_state:
+    st.session_state.submit_pdfs = True
+
+if "perceptual_dedup" not in st.session_state:
+    st.session_state.perceptual_dedup = False
+
+if "max_concurrent_requests" not in st.session_state:
+    st.session_state.max_concurrent_requests = MAX_CONCURRENT_REQUESTS
+
+if "render_profile" not in st.session_state:
+    st.session_state.render_profile = RenderProfile()
+
+if "retry_policy" not in st.session_state:
+    st.session_state.retry_policy = RetryPolicy()
+
+if "max_shard_records" not in st.session_state:
+    st.session_state.max_shard_records = MAX_SHARD_RECORDS
+
+if "max_shard_mb" not in st.session_state:
+    st.session_state.max_shard_mb = MAX_SHARD_BYTES // (1024 * 1024)
+
+if "use_text_layer" not in st.session_state:
+    st.session_state.use_text_layer = False
+
+if "run_metrics" not in st.session_state:
+    st.session_state.run_metrics = new_run_metrics()
+
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# Timings and counters recorded during this script run belong to the session's last OCR run
+use_metrics(st.session_state.run_metrics)
+
+# API calls made during this script run wait their turn in the shared request budget as this session
+use_session(st.session_state.session_id)
 
 page_title = "Mistral OCR 📄🔍✨"
 page_icon = "📄"
@@ -34,6 +84,8 @@ api_key_status, api_key = check_api_key_status()
 
 st.subheader('Batch Inference:', divider='gray')
 batch_inference = st.checkbox("Batch Inference", value=True, disabled= not api_key_status)
+concurrent_inference = st.checkbox("Concurrent Inference", value=False, disabled=not api_key_status or batch_inference,
+                                   help='OCR several PDFs at once without waiting for a batch job, at full price.')
 st.success('*Enabling batch inference allows performing OCR tasks in bulk with half the cost.*', icon=':material/info:')
 
 # Execute this branch if batch inference is enabled
@@ -44,27 +96,78 @@ if batch_inference:
 
     # If pdf file is not none then read the file contents and pass it on to Mistral OCR
     if uploaded_pdfs:
-
-        # Reset the variables if new PDF is loaded.
-        st.session_state.markdown_mistral = None
-
-        run_ocr_mistral = st.button("Run OCR", type="primary", key="run_ocr_mistral", disabled=not uploaded_pdfs,
+        page_selections, skip_blank = display_page_selection(uploaded_pdfs, 'batch_pages')
+        run_ocr_mistral = st.button("Run OCR", type="primary", key="run_ocr_mistral",
+                                    disabled=not uploaded_pdfs or page_selections is None,
                                     icon=':material/document_scanner:')
 
         if run_ocr_mistral:
-            # OCR with batch inference
-            mistral_ocr_batch(uploaded_pdfs, api_key)
-
-            st.session_state.markdown_mistral = 'OCR Done'
-
-        # Display the Statistics and Download Link(s)
-        if st.session_state.markdown_mistral is not None:
+            # Results downloaded for earlier jobs are dropped from the session, their files stay on disk
+            st.session_state.batch_results = {}
+            start_run_metrics()
+
+            # OCR with batch inference, the job is tracked in the background
+            with st.spinner('Processing ...'):
+                st.session_state.batch_manifest = submit(uploaded_pdfs, api_key, st.session_state.rasterize_workers,
+                                                         st.session_state.render_profile,
+                                                         st.session_state.submit_pdfs,
+                                                         st.session_state.perceptual_dedup,
+                                                         st.session_state.max_shard_records,
+                                                         st.session_state.max_shard_mb * 1024 * 1024,
+                                                         page_selections, skip_blank,
+                                                         st.session_state.use_text_layer)
+
+    # Reattach to a job submitted earlier
+    display_job_reattach(api_key)
+
+    # Display the progress, or the Statistics and Download Link(s) once the job has finished
+    if st.session_state.batch_manifest is not None:
+        manifest = st.session_state.batch_manifest
+        if manifest["job_id"] is not None:
+            manifest = poll(manifest["job_id"], api_key)
+
+        if manifest["status"] in ACTIVE_JOB_STATUSES:
+            display_ocr_progress(manifest["job_id"], count_finished_jobs(manifest))
+
+            # Documents of the batch jobs that have already finished can be downloaded
+            if count_finished_jobs(manifest):
+                display_download_table(manifest)
+        else:
+            # The job tracker gave up on the jobs, e.g. because the API key was revoked
+            if manifest.get("error"):
+                st.error(manifest["error"], icon=':material/error:')
 
             # Display OCR Statistics
-            display_ocr_statistics(st.session_state.retrieved_job, uploaded_pdfs)
+            display_ocr_statistics(manifest)
 
             # Display table to download Markdown Files
-            display_download_table(uploaded_pdfs)
+            display_download_table(manifest)
+
+            # Offer to re-submit the pages that failed
+            display_failed_pages(manifest, uploaded_pdfs, api_key)
+
+# Execute this branch if concurrent inference is enabled
+elif concurrent_inference:
+    st.subheader("Upload PDF File(s):", divider='gray')
+    uploaded_pdfs = st.file_uploader("Upload PDF file(s)", type=["pdf"], label_visibility="collapsed",
+                                    accept_multiple_files=True, disabled=not api_key_status)
+
+    if uploaded_pdfs:
+        page_selections, skip_blank = display_page_selection(uploaded_pdfs, 'concurrent_pages')
+        run_ocr_mistral = st.button("Run OCR", type="primary", key="run_ocr_mistral",
+                                    disabled=not uploaded_pdfs or page_selections is None,
+                                    icon=':material/document_scanner:')
+
+        if run_ocr_mistral:
+            start_run_metrics()
+            # Results are displayed as each document finishes
+            display_concurrent_ocr(uploaded_pdfs, api_key, st.session_state.max_concurrent_requests,
+                                   st.session_state.retry_policy, page_selections, skip_blank,
+                                   st.session_state.use_text_layer)
+        elif st.session_state.concurrent_results is not None:
+            display_concurrent_results()
+    else:
+        st.session_state.concurrent_results = None
 
 # Execute this branch if batch inference is disabled
 else:
@@ -75,36 +178,67 @@ else:
     if uploaded_pdf is not None:
 
         # Reset the variables if new PDF is loaded.
-        st.session_state.markdown_mistral = None
+        if st.session_state.ocr_pdf_id != uploaded_pdf.file_id:
+            st.session_state.ocr_pages = None
+            st.session_state.ocr_pdf_id = uploaded_pdf.file_id
 
         col1, col2 = st.columns([1, 1], vertical_alignment="top")
 
         # OCR with Mistral API
         with (col1):
             st.subheader('OCR with Mistral:', divider='gray')
-            run_ocr_mistral = st.button("Run OCR", type="primary", key="run_ocr_mistral", disabled=not uploaded_pdf, icon=':material/document_scanner:')
+            page_selections, skip_blank = display_page_selection([uploaded_pdf], 'single_pages')
+            run_ocr_mistral = st.button("Run OCR", type="primary", key="run_ocr_mistral",
+                                        disabled=not uploaded_pdf or page_selections is None,
+                                        icon=':material/document_scanner:')
             if run_ocr_mistral:
+                start_run_metrics()
+                st.session_state.ocr_pages = None
+                st.session_state.pdf_renders = {}
+
+                # Show the first page as soon as it arrives, the paginated view takes over once all pages are in
+                preview = st.empty()
+                pages = []
                 with st.spinner('Processing ...'):
-                    st.session_state.markdown_mistral = mistral_ocr(uploaded_pdf, api_key)
+                    for range_pages in iter_mistral_ocr_pages(uploaded_pdf, api_key,
+                                                              max_concurrency=st.session_state.max_concurrent_requests,
+                                                              retry_policy=st.session_state.retry_policy,
+                                                              pages=page_selections[0], skip_blank=skip_blank):
+                        pages.extend(range_pages)
+                        with preview.container():
+                            st.caption(f'{len(pages)} page(s) OCRed so far')
+                            st.markdown(page_markdown(pages[0]), unsafe_allow_html=True)
+                preview.empty()
+                st.session_state.ocr_pages = pages
 
             # Display the markdown response
-            if st.session_state.markdown_mistral is not None:
+            if st.session_state.ocr_pages is not None:
                 st.subheader('Response:', divider='gray')
 
                 with st.expander('Markdown Response', expanded=True, icon=':material/markdown:'):
-                    mistral_container = st.container(height=1000, key='mistral-container')
-                    mistral_container.markdown(st.session_state.markdown_mistral, unsafe_allow_html=True)
+                    display_ocr_pages(st.session_state.ocr_pages, 'mistral')
 
                     # Create a unique file name based on current date & time for download
                     file_name = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                    left, right = st.columns(2)
-                    left.download_button("Download MD", data=st.session_state.markdown_mistral,file_name=f"{file_name}_mistral.md",
-                                       type='primary', icon=':material/markdown:', help='Download the Markdown Response',
-                                       on_click="ignore")
-                    pdf_data = convert_md_to_pdf(st.session_state.markdown_mistral)
-                    right.download_button("Download PDF", data=pdf_data,file_name=f"{file_name}_mistral.pdf",
-                                       type='primary', icon=':material/picture_as_pdf:', help='Download in PDF Format',
-                                       on_click="ignore")
+                    left, middle, right = st.columns(3)
+                    # The combined markdown and the bundle are only built when downloaded, on a thread of their own
+                    pages = st.session_state.ocr_pages
+                    pdf_name = uploaded_pdf.name
+                    left.download_button("Download MD", data=lambda: combine_pages_markdown(pages),
+                                         file_name=f"{file_name}_mistral.md", mime="text/markdown",
+                                         type='primary', icon=':material/markdown:', help='Download the Markdown Response',
+                                         on_click="ignore")
+                    middle.download_button("Download ZIP", data=lambda: document_zip(pages, f"{file_name}_mistral",
+                                                                                     pdf_name=pdf_name,
+                                                                                     model=OCR_MODEL),
+                                           file_name=f"{file_name}_mistral.zip", mime="application/zip",
+                                           icon=':material/folder_zip:', on_click="ignore",
+                                           help='Markdown with relative links to the image files, the images and a '
+                                                'JSON of the pages')
+                    with right:
+                        # Rendered in the background only when requested
+                        display_pdf_download(st.session_state.ocr_pdf_id, lambda: combine_pages_markdown(pages),
+                                             f"{file_name}_mistral.pdf", "pdf_btn_mistral")
 
         # Display PDF Previewer
         with col2:
@@ -112,5 +246,8 @@ else:
             with st.expander(':blue[***Preview PDF***]', expanded=False, icon=':material/preview:'):
                 pdf_viewer(uploaded_pdf.getvalue(), height=1000, render_text=True)
 
+# Display the timings of the last OCR run
+display_performance_panel()
+
 # Display footer on the sidebar
 display_footer()